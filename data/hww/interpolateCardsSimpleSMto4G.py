@@ -92,8 +92,8 @@ for X in [ 'hwwof_0j_shape',  'hwwof_1j_shape',  'hwwsf_0j_shape',  'hwwsf_1j_sh
     paramSysts = {}; flatParamNuisances = {}
     for (name,nf,pdf,args,errline) in DC1.systs:
         if options.etu != 0 and name in [ "QCDscale_ggH", "QCDscale_ggH1in", "QCDscale_ggH2in" ]:
-            for b in errline.iterkeys(): 
-                for p in errline[b].iterkeys():
+            for b in DC1.bins:
+                for p in DC1.exp[b].iterkeys():
                     if errline[b][p] != 0 and errline[b][p] != 1:
                         inflated = errline[b][p]+options.etu if errline[b][p] > 1 else errline[b][p]-options.etu
                         #print "Inflating uncertainty from %s to %s" % (errline[b][p], inflated);
@@ -0,0 +1,71 @@
+#ifndef CMSCountingPdf_h
+#define CMSCountingPdf_h
+#include <vector>
+#include "RooAbsPdf.h"
+#include "RooArgSet.h"
+#include "RooListProxy.h"
+#include "Rtypes.h"
+
+/// Product of the Poisson terms of many counting bins: the observed counts are one observable
+/// per bin, and the expectation of each bin is the sum of the yields of its processes
+/// (bins[i] is the bin of the i-th yield). All the bins are evaluated in one pass, in log space.
+/// The value itself underflows for many bins: in a product with other terms use a CMSLogProdPdf,
+/// whose log is the sum of the logs of the factors.
+class CMSCountingPdf : public RooAbsPdf {
+ public:
+  CMSCountingPdf();
+
+  CMSCountingPdf(const char* name, const char* title, RooArgList const& obs,
+                 RooArgList const& yields, std::vector<int> const& bins);
+
+  CMSCountingPdf(CMSCountingPdf const& other, const char* name = 0);
+
+  virtual TObject* clone(const char* newname) const {
+    return new CMSCountingPdf(*this, newname);
+  }
+  virtual ~CMSCountingPdf() {}
+
+  /// sum over the bins of n*log(mu) - mu - lgamma(n+1)
+  double getLogValFast() const;
+  /// the Poisson terms are already normalized over the observables
+  virtual Double_t getLogVal(const RooArgSet* set = 0) const { return getLogValFast(); }
+
+  Int_t getAnalyticalIntegral(RooArgSet& allVars, RooArgSet& analVars,
+                              const char* rangeName = 0) const;
+
+  Double_t analyticalIntegral(Int_t code, const char* rangeName = 0) const;
+
+  Int_t getGenerator(const RooArgSet& directVars, RooArgSet& generateVars,
+                     Bool_t staticInitOK = kTRUE) const;
+
+  void generateEvent(Int_t code);
+
+  /// set each observable to the expected yield of its bin (Asimov dataset)
+  void setToExpected();
+
+  RooArgList const& obsList() const { return obs_; }
+  RooArgList const& yieldList() const { return yields_; }
+  std::vector<int> const& bins() const { return bins_; }
+
+ protected:
+  Double_t evaluate() const;
+  virtual Bool_t redirectServersHook(const RooAbsCollection& newServerList, Bool_t mustReplaceAll,
+                                     Bool_t nameChange, Bool_t isRecursive);
+
+  RooListProxy obs_;
+  RooListProxy yields_;
+  std::vector<int> bins_;
+
+  mutable std::vector<RooAbsReal*> vobs_; //! not to be serialized
+  mutable std::vector<RooAbsReal*> vyields_; //! not to be serialized
+  mutable std::vector<double> expected_; //! not to be serialized
+  mutable bool initialized_; //! not to be serialized
+
+  void initialize() const;
+  void updateExpected() const;
+
+ private:
+  ClassDef(CMSCountingPdf,1)
+};
+
+#endif
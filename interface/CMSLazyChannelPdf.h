@@ -0,0 +1,71 @@
+#ifndef CMSLazyChannelPdf_h
+#define CMSLazyChannelPdf_h
+#include "RooAbsPdf.h"
+#include "RooArgSet.h"
+#include "RooListProxy.h"
+#include "TString.h"
+#include "Rtypes.h"
+
+class TDirectory;
+class RooWorkspace;
+
+/// Stand-in for the model of one channel, which is stored in its own directory of the workspace file
+/// (as the pdf pdfName of the workspace "channel" in directory dirName). It depends on the same observables
+/// and parameters as the model it stands for, and reads it only when it is first needed, so that
+/// the channels that are never evaluated (e.g. those masked when the NLL is made, see CachingSimNLL) are never read.
+class CMSLazyChannelPdf : public RooAbsPdf {
+ public:
+  CMSLazyChannelPdf();
+
+  CMSLazyChannelPdf(const char* name, const char* title, RooAbsPdf const& pdf, RooArgList const& obs,
+                    const char* fileName, const char* dirName);
+
+  CMSLazyChannelPdf(CMSLazyChannelPdf const& other, const char* name = 0);
+
+  virtual TObject* clone(const char* newname) const {
+    return new CMSLazyChannelPdf(*this, newname);
+  }
+  virtual ~CMSLazyChannelPdf();
+
+  /// the model of the channel, read on the first call
+  RooAbsPdf* channelPdf() const;
+  bool isLoaded() const { return pdf_ != 0; }
+
+  /// read the channel from this file (the one the workspace was read from) rather than from the file name given when building it
+  void setSource(TDirectory* dir) { source_ = dir; }
+
+  /// the model of the channel if pdf is a CMSLazyChannelPdf, pdf itself otherwise
+  static RooAbsPdf* resolve(RooAbsPdf* pdf);
+
+  /// the model of the channel is normalized over the observables
+  virtual Bool_t selfNormalized() const { return kTRUE; }
+  virtual ExtendMode extendMode() const { return ExtendMode(extended_); }
+  virtual Double_t expectedEvents(const RooArgSet* nset) const;
+
+  Int_t getAnalyticalIntegral(RooArgSet& allVars, RooArgSet& analVars,
+                              const char* rangeName = 0) const;
+
+  Double_t analyticalIntegral(Int_t code, const char* rangeName = 0) const;
+
+ protected:
+  Double_t evaluate() const;
+  virtual Bool_t redirectServersHook(const RooAbsCollection& newServerList, Bool_t mustReplaceAll,
+                                     Bool_t nameChange, Bool_t isRecursive);
+
+  RooListProxy obs_;
+  RooListProxy params_;
+  TString fileName_;
+  TString dirName_;
+  TString pdfName_;
+  Int_t extended_;
+
+  mutable RooAbsPdf* pdf_; //! not to be serialized
+  mutable RooWorkspace* channel_; //! not to be serialized
+  mutable RooArgSet* normSet_; //! not to be serialized
+  TDirectory* source_; //! not to be serialized
+
+ private:
+  ClassDef(CMSLazyChannelPdf,1)
+};
+
+#endif
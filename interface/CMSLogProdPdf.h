@@ -0,0 +1,24 @@
+#ifndef CMSLogProdPdf_h
+#define CMSLogProdPdf_h
+#include "RooProdPdf.h"
+
+/// RooProdPdf whose log is the sum of the logs of its factors, so that it does not underflow
+/// when a factor (e.g. a CMSCountingPdf of many bins) has a value too small for a double.
+/// Only for products without conditional terms, i.e. of factors depending on separate observables.
+class CMSLogProdPdf : public RooProdPdf {
+ public:
+  CMSLogProdPdf() {}
+  CMSLogProdPdf(const char* name, const char* title, RooArgList const& pdfs) : RooProdPdf(name, title, pdfs) {}
+  CMSLogProdPdf(CMSLogProdPdf const& other, const char* name = 0) : RooProdPdf(other, name) {}
+
+  virtual TObject* clone(const char* newname) const { return new CMSLogProdPdf(*this, newname); }
+  virtual ~CMSLogProdPdf() {}
+
+  /// sum over the factors of their log, each normalized over the observables in set it depends on
+  virtual Double_t getLogVal(const RooArgSet* set = 0) const;
+
+ private:
+  ClassDef(CMSLogProdPdf,1)
+};
+
+#endif
@@ -17,9 +17,11 @@
 #include <RooProduct.h>
 #include "HiggsAnalysis/CombinedLimit/interface/SimpleGaussianConstraint.h"
 #include "HiggsAnalysis/CombinedLimit/interface/SimplePoissonConstraint.h"
+#include "HiggsAnalysis/CombinedLimit/interface/SimpleGaussianConstraintBlock.h"
 #include <boost/ptr_container/ptr_vector.hpp>
 
 class RooMultiPdf;
+class CMSLazyChannelPdf;
 
 // Part zero: ArgSet checker
 namespace cacheutils {
@@ -181,6 +183,8 @@ class CachingSimNLL  : public RooAbsReal {
         virtual void constOptimizeTestStatistic(ConstOpCode opcode, Bool_t doAlsoTrackingOpt=kTRUE) { }
     private:
         void setup_();
+        void setupChannel_(int ib, const char *label, RooAbsPdf *pdf);
+        void setupLazyChannels_(const RooArgList &masks);
         RooSimultaneous   *pdfOriginal_;
         const RooAbsData  *dataOriginal_;
         const RooArgSet   *nuis_;
@@ -192,7 +196,9 @@ class CachingSimNLL  : public RooAbsReal {
         std::vector<bool>                        constrainPdfsFastOwned_;
         std::vector<SimplePoissonConstraint *>   constrainPdfsFastPoisson_;
         std::vector<bool>                        constrainPdfsFastPoissonOwned_;
+        std::vector<SimpleGaussianConstraintBlock *> constrainPdfsFastBlock_;
         std::vector<CachingAddNLL*>     pdfs_;
+        std::vector<CMSLazyChannelPdf*> lazyPdfs_; // masked channels not read yet (pdfs_ is null for them)
         std::auto_ptr<TList>            dataSets_;
         std::vector<RooDataSet *>       datasets_;
         static bool noDeepLEE_;
@@ -201,6 +207,7 @@ class CachingSimNLL  : public RooAbsReal {
         std::vector<double> constrainZeroPoints_;
         std::vector<double> constrainZeroPointsFast_;
         std::vector<double> constrainZeroPointsFastPoisson_;
+        std::vector<double> constrainZeroPointsFastBlock_;
         std::vector<RooAbsReal*> channelMasks_;
 };
 
@@ -26,7 +26,8 @@ class ProcessNormalization : public RooAbsReal {
 
       void setNominalValue(double nominal) { nominalValue_ = nominal; }
       void addLogNormal(double kappa, RooAbsReal &theta) ;
-      void addAsymmLogNormal(double kappaLo, double kappaHi, RooAbsReal &theta) ;
+      /// an almost symmetric effect (kappaLo*kappaHi within 1e-5 of 1) is added as symmetric, unless exact is set
+      void addAsymmLogNormal(double kappaLo, double kappaHi, RooAbsReal &theta, bool exact = false) ;
       void addOtherFactor(RooAbsReal &factor) ;
       void dump() const ;
     protected:
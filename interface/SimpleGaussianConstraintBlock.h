@@ -0,0 +1,60 @@
+#ifndef SimpleGaussianConstraintBlock_h
+#define SimpleGaussianConstraintBlock_h
+
+#include <vector>
+#include <RooAbsPdf.h>
+#include <RooListProxy.h>
+
+/// Product of many unit Gaussian constraints exp(-0.5*(x[i]-mean[i])^2), with the
+/// parameters x (the nuisances) and the means (the global observables) kept as
+/// ordinary named variables, but evaluated all together in one loop over contiguous arrays.
+/// Meant to replace a RooProdPdf of tens of thousands of SimpleGaussianConstraint terms.
+/// text2workspace sets on each parameter of a block the string attribute "constraintBlock" (the name of the block),
+/// for the code that would otherwise look for the <parameter>_Pdf constraint of a parameter.
+class SimpleGaussianConstraintBlock : public RooAbsPdf {
+    public:
+        SimpleGaussianConstraintBlock() : initialized_(false) {} ;
+        SimpleGaussianConstraintBlock(const char *name, const char *title, const RooArgList &x, const RooArgList &mean) ;
+        SimpleGaussianConstraintBlock(const SimpleGaussianConstraintBlock& other, const char* name=0) ;
+
+        virtual TObject* clone(const char* newname) const { return new SimpleGaussianConstraintBlock(*this,newname); }
+        inline virtual ~SimpleGaussianConstraintBlock() { }
+
+        /// sum of the logs of the unnormalized Gaussians (not cached: it costs the same as checking all the parameters for changes)
+        double getLogValFast() const { return evaluateLog(); }
+        virtual Double_t getLogVal(const RooArgSet* set=0) const ;
+
+        virtual Int_t getAnalyticalIntegral(RooArgSet& allVars, RooArgSet& analVars, const char* rangeName=0) const ;
+        virtual Double_t analyticalIntegral(Int_t code, const char* rangeName=0) const ;
+
+        virtual Int_t getGenerator(const RooArgSet& directVars, RooArgSet &generateVars, Bool_t staticInitOK=kTRUE) const ;
+        virtual void generateEvent(Int_t code) ;
+
+        const RooArgList & xList() const { return x_; }
+        const RooArgList & meanList() const { return mean_; }
+
+        /// drop the constraint on parameter x (e.g. when it is promoted to a parameter of interest), also setting the attribute
+        /// ignoreConstraint on x, which the block honours like separate constraint pdfs do; returns false if x is not in the block
+        bool ignoreConstraint(const RooAbsArg &x) ;
+    protected:
+        virtual Double_t evaluate() const ;
+        virtual Bool_t redirectServersHook(const RooAbsCollection& newServerList, Bool_t mustReplaceAll, Bool_t nameChange, Bool_t isRecursive) ;
+    private:
+        RooListProxy x_;
+        RooListProxy mean_;
+        std::vector<int> ignored_; // indices of the constraints to skip
+
+        mutable std::vector<RooAbsReal *> vx_; //! not to be serialized
+        mutable std::vector<RooAbsReal *> vmean_; //! not to be serialized
+        mutable std::vector<double> xvals_; //! not to be serialized
+        mutable std::vector<double> meanvals_; //! not to be serialized
+        mutable std::vector<double> weights_; //! not to be serialized
+        mutable bool initialized_; //! not to be serialized
+
+        void initialize() const ;
+        double evaluateLog() const ;
+
+        ClassDef(SimpleGaussianConstraintBlock,1) // Block of unit Gaussian constraints with fast log
+};
+
+#endif
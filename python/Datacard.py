@@ -1,3 +1,5 @@
+import re, fnmatch
+
 class Datacard():
     """
     Description:
@@ -52,8 +54,24 @@ class Datacard():
 	self.binParFlags = {}
         
 	self.groups = {}
+        ## list of the group lines as (group name, '=' or '+=', [nuisances]), to be able to rebuild exactly the same group sets elsewhere
+        self.groupLines = []
 	self.discretes = []
 
+        ## columnar store of the nuisance effects, used instead of the errline dicts when parsing with --X-compact-datacard
+        self.systMatrix = None
+
+        ## cache of the bins and processes matching the patterns of rateParam, autoMCStats and nuisance edit lines
+        self.namePatterns = NamePatterns(self)
+
+        ## inverted (bin, process) -> nuisance index of the non-null effects, for the model builders
+        self.nuisanceEffects = NuisanceEffects(self)
+
+    def writeNpz(self, out):
+        """Write the datacard in the binary .npz format of DatacardNpz, out being a file name or a file object"""
+        from HiggsAnalysis.CombinedLimit.DatacardNpz import writeNpzCard
+        writeNpzCard(self, out)
+
     def print_structure(self):
 	"""
 	Print the contents of the -> should allow for direct text2workspace on python config
@@ -243,3 +261,246 @@ MB.doModel()
 
 	return list(set(allVars))
 
+
+
+class NamePatterns():
+    """
+    Index of the bins and processes of a datacard that match a given glob or regular expression pattern. Each pattern is
+    compiled and checked against the names only once per card, and the result is reused by all the rateParam,
+    autoMCStats and nuisance edit lines using the same pattern.
+    """
+    def __init__(self, datacard):
+        self.datacard = datacard
+        self._cache = {}
+        self._size = None
+
+    def _match(self, kind, names, pattern, method):
+        # the lists of bins and processes are only filled while parsing the header, drop what was cached before
+        size = (len(self.datacard.bins), len(self.datacard.processes))
+        if size != self._size:
+            self._cache = {}
+            self._size = size
+        key = (kind, pattern, method)
+        if key not in self._cache:
+            if method == "glob":
+                regexp = re.compile(fnmatch.translate(pattern))
+                self._cache[key] = [ n for n in names if regexp.match(n) ]
+            else:
+                test = getattr(re.compile(pattern), method)
+                self._cache[key] = [ n for n in names if test(n) ]
+        return self._cache[key]
+
+    def bins(self, pattern, method="glob"):
+        """List of the bins matching the pattern (in the order of Datacard.bins); method is 'glob', or the name of the re method to use ('match', 'search')"""
+        return self._match("bin", self.datacard.bins, pattern, method)
+
+    def processes(self, pattern, method="glob"):
+        """List of the processes matching the pattern (in the order of Datacard.processes); method as for bins"""
+        return self._match("process", self.datacard.processes, pattern, method)
+
+    def binSet(self, pattern, method="search"):
+        """Same as bins, as a set (for fast membership tests)"""
+        return self._set("bin", pattern, method)
+
+    def processSet(self, pattern, method="search"):
+        """Same as processes, as a set (for fast membership tests)"""
+        return self._set("process", pattern, method)
+
+    def _set(self, kind, pattern, method):
+        names = self._match(kind, self.datacard.bins if kind == "bin" else self.datacard.processes, pattern, method)
+        key = (kind+"Set", pattern, method)
+        if key not in self._cache: self._cache[key] = set(names)
+        return self._cache[key]
+
+class SparseErrline(dict):
+    """
+    Sparse {bin : {process : kappa}} errline: only the non-null effects are stored, and looking up a process of a
+    bin that has no entry gives 0 (no effect), so that it can be used in place of a full errline dict.
+    """
+    def __init__(self, bins):
+        dict.__init__(self, [(b,SparseErrlineBin()) for b in bins])
+    def nonZero(self):
+        """Iterate on the ((bin, process), kappa) of the non-null effects"""
+        for b,effects in self.iteritems():
+            for p,v in effects.iteritems():
+                if v != 0: yield ((b,p),v)
+
+class SparseErrlineBin(dict):
+    """{process : kappa} of one bin of a SparseErrline, 0 for the processes that are not stored"""
+    def __missing__(self, p):
+        return 0.
+
+def nonZeroEffects(errline):
+    """Iterate on the ((bin, process), kappa) of the non-null effects in any kind of errline"""
+    if hasattr(errline, "nonZero"): return errline.nonZero()
+    return ( ((b,p),v) for b,effects in errline.iteritems() for p,v in effects.iteritems() if v != 0 )
+
+class NuisanceEffects():
+    """
+    Inverted (bin, process) -> nuisance index of the effects in Datacard.systs: for each column of the keyline, the
+    (name, nofloat, pdf, args, value) of the nuisances with a non-null effect on it, stored as a CSR-like pair of lists
+    (indptr, entries). It is built in a single pass on the non-null entries of the errlines the first time it is used,
+    and built again if Datacard.systs is replaced or changes length, or after reset() (the nuisance edits call it).
+    """
+    def __init__(self, datacard):
+        self.datacard = datacard
+        self.reset()
+
+    def reset(self):
+        """Forget the index, so that it is built again from Datacard.systs the next time it is used"""
+        self._systs = None
+        self._size = None
+
+    def _build(self):
+        DC = self.datacard
+        if self._systs is DC.systs and self._size == len(DC.systs): return
+        self.columns = dict([((b,p),k) for k,(b,p,s) in enumerate(DC.keyline)])
+        rows = [ [] for k in DC.keyline ]
+        for (lsyst,nofloat,pdf,args,errline) in DC.systs:
+            if pdf == "param" or pdf == "discrete" or pdf == "rateParam": continue
+            for (bp,v) in nonZeroEffects(errline):
+                if bp in self.columns: rows[self.columns[bp]].append((lsyst,nofloat,pdf,args,v))
+        self.indptr = [0]; self.entries = []
+        for r in rows:
+            self.entries += r
+            self.indptr.append(len(self.entries))
+        self._systs = DC.systs; self._size = len(DC.systs)
+
+    def effects(self, b, p):
+        """List of (name, nofloat, pdf, args, value) of the nuisances with a non-null effect on process p in bin b, in the order of Datacard.systs"""
+        self._build()
+        if (b,p) not in self.columns: return []
+        k = self.columns[(b,p)]
+        return self.entries[self.indptr[k]:self.indptr[k+1]]
+
+class CompactSystematics():
+    """
+    Columnar store for the effects of the nuisances of a datacard: a dense (number of nuisances x number of keyline
+    entries) NumPy array of kappas, where column k corresponds to Datacard.keyline[k]. Asymmetric kappas are kept as
+    [kappaLo, kappaHi] lists in a side table (the array holds kappaHi, so that they are never seen as null effects).
+    Rows are handed out to the parser as ErrlineView objects, which behave like the usual errline dicts.
+    """
+    def __init__(self, keyline, capacity=64):
+        import numpy
+        self.keyline = keyline
+        self.index = dict([((b,p),k) for k,(b,p,s) in enumerate(keyline)])
+        self.bins = []
+        self.binProcs = {}
+        for (b,p,s) in keyline:
+            if b not in self.binProcs:
+                self.bins.append(b)
+                self.binProcs[b] = []
+            self.binProcs[b].append(p)
+        self.values = numpy.zeros((capacity, len(keyline)))
+        ## dict of {row : {column : [kappaLo, kappaHi]}}
+        self.asymm = {}
+        self.nrows = 0
+
+    def addRow(self, values=None, asymm=None):
+        """Append a row (all zeros unless values are given) and return an ErrlineView on it"""
+        if self.nrows == self.values.shape[0]:
+            import numpy
+            grown = numpy.zeros((2*self.nrows, self.values.shape[1]))
+            grown[:self.nrows] = self.values[:self.nrows]
+            self.values = grown
+        row = self.nrows
+        if values is not None: self.values[row] = values
+        if asymm: self.asymm[row] = asymm
+        self.nrows += 1
+        return ErrlineView(self, row)
+
+    def get(self, row, k):
+        if row in self.asymm and k in self.asymm[row]: return self.asymm[row][k]
+        return float(self.values[row,k])
+
+    def set(self, row, k, value):
+        if type(value) == list:
+            if row not in self.asymm: self.asymm[row] = {}
+            self.asymm[row][k] = value
+            self.values[row,k] = value[1]
+        else:
+            if row in self.asymm: self.asymm[row].pop(k, None)
+            self.values[row,k] = value
+
+    def countEffects(self, rows, isLnN, rates):
+        """
+        Number of entries with a non-null effect on a non-zero rate for each of the given rows (a kappa of 0, or of 1 for
+        the rows flagged in isLnN, has no effect), as an array. rates is aligned to the keyline.
+        """
+        import numpy
+        rows = numpy.asarray(rows, dtype=int)
+        values = self.values[rows]
+        nonNull = (values != 0)
+        nonNull[numpy.asarray(isLnN, dtype=bool)] &= (values[numpy.asarray(isLnN, dtype=bool)] != 1)
+        for i,row in enumerate(rows):
+            if row in self.asymm:
+                for k in self.asymm[row]: nonNull[i,k] = True
+        return (nonNull & (numpy.asarray(rates) != 0)).sum(axis=1)
+
+class ErrlineView():
+    """Dict-like {bin : {process : kappa}} view on one row of a CompactSystematics store"""
+    def __init__(self, matrix, row):
+        self.matrix = matrix
+        self.row = row
+    def __getitem__(self, b):
+        if b not in self.matrix.binProcs: raise KeyError, b
+        return ErrlineBinView(self.matrix, self.row, b)
+    def __contains__(self, b):
+        return b in self.matrix.binProcs
+    has_key = __contains__
+    def __iter__(self):
+        return iter(self.matrix.bins)
+    def __len__(self):
+        return len(self.matrix.bins)
+    def keys(self):
+        return self.matrix.bins[:]
+    iterkeys = __iter__
+    def values(self):
+        return [self[b] for b in self.matrix.bins]
+    def itervalues(self):
+        return iter(self.values())
+    def items(self):
+        return [(b,self[b]) for b in self.matrix.bins]
+    def iteritems(self):
+        return iter(self.items())
+    def nonZero(self):
+        """Iterate on the ((bin, process), kappa) of the non-null effects, from the non-zero entries of the row"""
+        import numpy
+        for k in numpy.flatnonzero(self.matrix.values[self.row]):
+            (b,p,s) = self.matrix.keyline[k]
+            yield ((b,p), self.matrix.get(self.row, k))
+    def __repr__(self):
+        return repr(dict([(b,dict(v.items())) for b,v in self.items()]))
+
+class ErrlineBinView():
+    """Dict-like {process : kappa} view on the entries of one bin in one row of a CompactSystematics store"""
+    def __init__(self, matrix, row, b):
+        self.matrix = matrix
+        self.row = row
+        self.bin = b
+    def __getitem__(self, p):
+        return self.matrix.get(self.row, self.matrix.index[(self.bin,p)])
+    def __setitem__(self, p, value):
+        self.matrix.set(self.row, self.matrix.index[(self.bin,p)], value)
+    def __contains__(self, p):
+        return (self.bin,p) in self.matrix.index
+    has_key = __contains__
+    def get(self, p, default=None):
+        return self[p] if p in self else default
+    def __iter__(self):
+        return iter(self.matrix.binProcs[self.bin])
+    def __len__(self):
+        return len(self.matrix.binProcs[self.bin])
+    def keys(self):
+        return self.matrix.binProcs[self.bin][:]
+    iterkeys = __iter__
+    def values(self):
+        return [self[p] for p in self.matrix.binProcs[self.bin]]
+    def itervalues(self):
+        return iter(self.values())
+    def items(self):
+        return [(p,self[p]) for p in self.matrix.binProcs[self.bin]]
+    def iteritems(self):
+        return iter(self.items())
+    def __repr__(self):
+        return repr(dict(self.items()))
@@ -0,0 +1,619 @@
+import os.path, tempfile, mmap, copy
+from sys import stderr
+
+from HiggsAnalysis.CombinedLimit.Datacard import Datacard, SparseErrline
+from HiggsAnalysis.CombinedLimit.DatacardParser import parseCard, isVetoed, isIncluded, FloatToString, FloatToStringScientific, datacardCacheKey, tokenizeLine, checkBinRates, dropNullEffectSysts
+from HiggsAnalysis.CombinedLimit.NuisanceModifier import doEditNuisance
+
+class CardContribution():
+    """
+    What a single input datacard contributes to a combination, with its bins already relabelled: the columns of the
+    keyline, the per-column effect of each nuisance, and the card-level directives (shapes, params, groups, ...).
+    Everything is kept as plain lists in the order in which the card provides it, so that merging the contributions
+    in the order of the input cards gives the same result independently of where (or in which process) they were made.
+    """
+    def __init__(self, fname, label):
+        self.fname = fname
+        self.label = label
+        ## list of output bins and of the corresponding observations (formatted), obsline is None if the card has no observations
+        self.obskeyline = []
+        self.obsline = []
+        ## list of (output bin, process, isSignal) and of the formatted rates
+        self.keyline = []
+        self.expline = []
+        ## observations and rates as numbers, aligned to self.obskeyline and self.keyline
+        self.obsValues = []
+        self.rates = []
+        ## list of [name, pdf, pdf args, nofloat, values], with values aligned to self.keyline
+        self.systs = []
+        ## list of (name, args) of the param nuisances
+        self.paramSysts = []
+        self.flatParamNuisances = []
+        self.extArgs = []
+        self.binParFlags = []
+        self.rateParams = []
+        self.rateParamsOrder = []
+        self.discretes = []
+        self.shapeLines = []
+        self.groupLines = []
+        self.nuisanceEdits = []
+        ## once the effects are formatted in a ColumnStore (CardCombination.storeEffects) the values in self.systs are
+        ## replaced by their location in the store, and this is the width of the widest of their cells
+        self.storedWidth = None
+
+def formatEffect(value):
+    """Text for the effect of a nuisance on a bin/process in the combined datacard"""
+    if type(value) == list: return "%s/%s" % (FloatToString(value[0]), FloatToString(value[1]))
+    if value == 0: return "-"
+    return str(value)
+
+def relabelCard(fname, label, options, DC=None):
+    """Parse a datacard (unless DC is given) and return its CardContribution to the combination under the given label"""
+    dirname = os.path.dirname(fname)
+    if DC is None: DC = parseCard(open(fname, "r"), options)
+    ret = CardContribution(fname, label)
+    singlebin = (len(DC.bins) == 1)
+    if label == ".":
+        label=DC.bins[0] if singlebin else "";
+    elif not singlebin:
+        label += "_";
+    # keep only the bins that are not vetoed, as (input bin, output bin)
+    bins = []
+    for b in DC.bins:
+        bout = label if singlebin else label+b
+        b_in  = label if singlebin else b
+        if isVetoed(b_in,options.channelVetos): continue
+        if not isIncluded(b_in,options.channelIncludes): continue
+        bins.append((b,bout))
+    keyline = []
+    for (b,bout) in bins:
+        ret.obskeyline.append(bout)
+        for (p,e) in DC.exp[b].items(): # so that we get only self.DC.processes contributing to this bin
+            if DC.isSignal[p] == False: continue
+            ret.expline.append("%s" % FloatToString(e)) if (e == 0 or e > 1e-3) else ret.expline.append("%s" % FloatToStringScientific(e))
+            keyline.append((b, p)); ret.keyline.append((bout, p, DC.isSignal[p])); ret.rates.append(e)
+        for (p,e) in DC.exp[b].items(): # so that we get only self.DC.processes contributing to this bin
+            if DC.isSignal[p]: continue
+            ret.expline.append("%s" % FloatToString(e)) if (e == 0 or e > 1e-3) else ret.expline.append("%s" % FloatToStringScientific(e))
+            keyline.append((b, p)); ret.keyline.append((bout, p, DC.isSignal[p])); ret.rates.append(e)
+    # systematics
+    for (lsyst,nofloat,pdf,pdfargs,errline) in DC.systs:
+        if pdf == "param":
+            ret.paramSysts.append((lsyst,pdfargs))
+            continue
+        ret.systs.append([lsyst, pdf, pdfargs, nofloat, [ errline[b][p] for (b,p) in keyline ]])
+    # flat params
+    ret.flatParamNuisances = DC.flatParamNuisances.keys()
+    ret.extArgs = DC.extArgs.items()
+    for K in DC.binParFlags.iterkeys():
+        tbin = label if singlebin else label+K
+        ret.binParFlags.append((tbin, DC.binParFlags[K]))
+    # rate params
+    for K in DC.rateParams.iterkeys():
+        tbin,tproc = K.split("AND")[0],K.split("AND")[1]
+        b_in = tbin
+        tbin = label if singlebin else label+tbin
+        if isVetoed(b_in,options.channelVetos): continue
+        if not isIncluded(b_in,options.channelIncludes): continue
+        ret.rateParams.append((tbin+"AND"+tproc, DC.rateParams[K]))
+        ret.rateParamsOrder += list(DC.rateParamsOrder)
+    ret.discretes = DC.discretes[:]
+    # put shapes, if available
+    if len(DC.shapeMap):
+        for (b,bout) in bins:
+            p2sMap  = DC.shapeMap[b]   if DC.shapeMap.has_key(b)   else {}
+            p2sMapD = DC.shapeMap['*'] if DC.shapeMap.has_key('*') else {}
+            for p, x in p2sMap.items():
+                xrep = [xi.replace("$CHANNEL",b) for xi in x]
+                if xrep[0] != 'FAKE' and dirname != '': xrep[0] = dirname+"/"+xrep[0]
+                ret.shapeLines.append((p,bout,xrep))
+            for p, x in p2sMapD.items():
+                if p2sMap.has_key(p): continue
+                xrep = [xi.replace("$CHANNEL",b) for xi in x]
+                if xrep[0] != 'FAKE' and dirname != '': xrep[0] = dirname+"/"+xrep[0]
+                ret.shapeLines.append((p,bout,xrep))
+    elif options.shape:
+        for b in DC.bins:
+            bout = label if singlebin else label+b
+            ret.shapeLines.append(('*',bout,['FAKE']))
+    # observations, the line is removed if any of the datacards doesn't have it
+    if len(DC.obs) == 0:
+        ret.obsline = None; ret.obsValues = None
+    else:
+        ret.obsline = [ FloatToString(DC.obs[b]) for (b,bout) in bins ]
+        ret.obsValues = [ DC.obs[b] for (b,bout) in bins ]
+    # the groups are rebuilt from their definitions, so that the sets are identical to the ones of DC.groups
+    ret.groupLines = [ (groupName, [ (defTok, nuisances) for (g,defTok,nuisances) in DC.groupLines if g == groupName ]) for groupName in DC.groups.iterkeys() ]
+    # nuisance edits propagated to end of card
+    for editline in DC.nuisanceEditLines:
+      if len(editline)==2: ret.nuisanceEdits.append("%s %s"%(editline[0]," ".join(editline[1])))
+      else:
+
+        tmp_chan = editline[2]
+        tmp_proc = editline[1]
+
+        if tmp_chan == "*": # all channels
+          tmp_chan = "%s(%s)"%(label,"|".join(c for c in DC.bins)) if len (DC.bins)>1 else label
+        if tmp_proc == "*":
+          tmp_proc = "(%s)"%("|".join(p for p in DC.processes))
+        ret.nuisanceEdits.append("%s %s %s %s"%(editline[0],tmp_proc,tmp_chan," ".join(editline[3])))
+    return ret
+
+def _relabelCardJob((fname, label, options)):
+    return relabelCard(fname, label, options)
+
+def relabelCards(cards, options, jobs=1):
+    """
+    Iterate over the CardContribution of each (file name, label) in cards, in the same order.
+    With jobs > 1 the cards are parsed and relabelled in a pool of jobs processes, while the results are still
+    returned in order so that the combination does not depend on which card is ready first.
+    """
+    if jobs <= 1 or len(cards) <= 1:
+        for (fname, label) in cards: yield relabelCard(fname, label, options)
+        return
+    from multiprocessing import Pool
+    pool = Pool(processes=min(jobs,len(cards)))
+    try:
+        for card in pool.imap(_relabelCardJob, [ (fname, label, options) for (fname, label) in cards ]):
+            yield card
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+class ColumnStore():
+    """
+    Temporary on-disk store of the formatted effects of the nuisances: for each nuisance, the cells of the columns of each
+    input card are appended as one record, and only their offsets are kept in memory until the final card is written.
+    With a path, the records are appended to that file and kept after the combination (see CombinationIndex).
+    """
+    def __init__(self, path=None):
+        self.file = open(path, "a+b") if path else None
+        self.size = os.path.getsize(path) if path else 0
+        self.map = None
+
+    def append(self, cells):
+        data = " ".join(cells)
+        if self.file is None: self.file = tempfile.TemporaryFile()
+        self.file.write(data)
+        self.size += len(data)
+        return (self.size-len(data), len(data))
+
+    def get(self, (offset, length)):
+        if length == 0: return []
+        if self.map is None:
+            self.file.flush()
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else ""
+        return self.map[offset:offset+length].split(" ")
+
+    def flush(self):
+        if self.file is not None: self.file.flush()
+
+class CardCombination():
+    """
+    Combination of datacards, built by adding the contributions of the input cards one by one (in the order in which they
+    should appear in the output). The effects of the nuisances go to a ColumnStore, so that only the keyline and the
+    index of the nuisances are kept in memory.
+    """
+    def __init__(self, store=None):
+        self.obsline = []; self.obskeyline = [] ;
+        self.keyline = []; self.expline = []; self.systlines = {}
+        self.shapeLines = []
+        self.paramSysts = {}; self.flatParamNuisances = {}; self.discreteNuisances = {}; self.groups = {}; self.rateParams = {}; self.rateParamsOrder = set();
+        self.extArgs = {}; self.binParFlags = {}
+        self.nuisanceEdits = [];
+        ## number of columns of each card, in order
+        self.ncolumns = []
+        self.cmax = 5 # column width
+        self.store = store if store is not None else ColumnStore()
+
+    def add(self, card):
+        """Merge the CardContribution of the next input card"""
+        icard = len(self.ncolumns)
+        self.ncolumns.append(len(card.keyline))
+        self.obskeyline += card.obskeyline
+        self.keyline += card.keyline
+        self.expline += card.expline
+        # systematics
+        if card.storedWidth is not None: self.cmax = max(self.cmax, card.storedWidth)
+        for (lsyst,pdf,pdfargs,nofloat,values) in card.systs:
+            thiseffect = values if card.storedWidth is not None else self.systEffect(values)
+            if self.systlines.has_key(lsyst):
+                (otherpdf, otherargs, othereffect, othernofloat) = self.systlines[lsyst]
+                if otherpdf != pdf:
+                    if (pdf == "lnN" and otherpdf.startswith("shape")):
+                        if self.systlines[lsyst][0][-1] != '?': self.systlines[lsyst][0] += '?'
+                    elif (pdf.startswith("shape") and otherpdf == "lnN"):
+                        if pdf[-1] != '?': pdf += '?'
+                        self.systlines[lsyst][0] = pdf
+                    elif (pdf == otherpdf+"?") or (pdf+"?" == otherpdf):
+                        self.systlines[lsyst][0] = pdf.replace("?","")+"?"
+                    else:
+                        raise RuntimeError, "File %s defines systematic %s as using pdf %s, while a previous file defines it as using %s" % (card.fname,lsyst,pdf,otherpdf)
+                else:
+                    if pdf == "gmN" and int(pdfargs[0]) != int(otherargs[0]):
+                        raise RuntimeError, "File %s defines systematic %s as using gamma with %s events in sideband, while a previous file has %s" % (card.fname,lsyst,pdfargs[0],otherargs[0])
+                othereffect[icard] = thiseffect
+            else:
+                pdfargs = [ str(x) for x in pdfargs ]
+                self.systlines[lsyst] = [pdf,pdfargs,{icard:thiseffect},nofloat]
+        for (lsyst,pdfargs) in card.paramSysts:
+            if self.paramSysts.has_key(lsyst):
+               if self.paramSysts[lsyst] != pdfargs: raise RuntimeError, "Parameter uncerainty %s mismatch between cards." % lsyst
+            else:
+                self.paramSysts[lsyst] = pdfargs
+        # flat params
+        for K in card.flatParamNuisances:
+            self.flatParamNuisances[K] = True
+        for K,v in card.extArgs:
+            self.extArgs[K] = v
+        for tbin,v in card.binParFlags:
+            self.binParFlags[tbin] = v
+        # rate params
+        for nK,v in card.rateParams:
+            self.rateParams[nK] = v
+        self.rateParamsOrder.update(card.rateParamsOrder)
+        # discrete nuisance
+        for K in card.discretes:
+            if self.discreteNuisances.has_key(K): raise RuntimeError, "Cannot currently correlate discrete nuisances across categories. Rename %s in one."%K
+            else: self.discreteNuisances[K] = True
+        self.shapeLines += card.shapeLines
+        # combine observations, but remove line if any of the datacards doesn't have it
+        if card.obsline is None:
+            self.obsline = None
+        elif self.obsline != None:
+            self.obsline += card.obsline
+        #get the groups - keep nuisances in a set so that they are never repetitions
+        for groupName,definitions in card.groupLines:
+            nuisanceNames = set(definitions[0][1])
+            for (defTok,nuisances) in definitions[1:]: nuisanceNames.update( set(nuisances) )
+            if groupName in self.groups:
+                self.groups[groupName].update(set(nuisanceNames))
+            else:
+                self.groups[groupName] = set(nuisanceNames)
+        self.nuisanceEdits += card.nuisanceEdits
+
+    def systEffect(self, values):
+        """Format the effects of a nuisance on the columns of a card and put them in the store, returning where they are"""
+        cells = [ formatEffect(v) for v in values ]
+        if cells: self.cmax = max([self.cmax]+[len(r) for r in cells]) # get max col length, as it's more tricky to do it later with a map
+        return self.store.append(cells)
+
+    def storeEffects(self, card):
+        """Format the effects of the nuisances of a card into the store before adding it, and keep only their location in the card"""
+        width = 0
+        for syst in card.systs:
+            cells = [ formatEffect(v) for v in syst[4] ]
+            if cells: width = max([width]+[len(r) for r in cells])
+            syst[4] = self.store.append(cells)
+        card.storedWidth = width
+
+    def systRow(self, effect):
+        """Cells of a nuisance for the full keyline"""
+        row = []
+        for icard,n in enumerate(self.ncolumns):
+            if icard in effect: row += self.store.get(effect[icard])
+            else: row += ["-"]*n
+        return row
+
+    def write(self, out, args, editNuisFile=None, chunk=1000):
+        """Write the combined datacard to the file object out, buffering the lines and writing them in chunks"""
+        lines = []
+        def emit(line):
+            lines.append(line+"\n")
+            if len(lines) >= chunk:
+                out.write("".join(lines))
+                del lines[:]
+        keyline = self.keyline; cmax = self.cmax
+        bins = []; signals = []; backgrounds = []
+        for (b,p,s) in keyline:
+            if b not in bins: bins.append(b)
+            if s:
+                if p not in signals: signals.append(p)
+            else:
+                if p not in backgrounds: backgrounds.append(p)
+
+        emit("Combination of " + "  ".join(args))
+        emit("imax %d number of bins" % len(bins))
+        emit("jmax %d number of processes minus 1" % (len(signals) + len(backgrounds) - 1))
+        emit("kmax %d number of nuisance parameters" % (len(self.systlines) + len(self.paramSysts)))
+        emit("-" * 130)
+
+        shapeLines = self.shapeLines
+        if shapeLines:
+            chmax = max([max(len(p),len(c)) for p,c,x in shapeLines]);
+            cfmt = "%-"+str(chmax)+"s ";
+            shapeLines.sort( lambda x,y : cmp(x[0],y[0]) if x[1] == y[1] else cmp(x[1],y[1]) )
+            for (process,channel,stuff) in shapeLines:
+                emit(" ".join(["shapes", cfmt % process, cfmt % channel, ' '.join(stuff)]))
+            emit("-" * 130)
+
+        if self.obsline:
+            cmax = max([cmax]+[len(l) for l in self.obskeyline]+[len(x) for x in self.obsline])
+            cfmt = "%-"+str(cmax)+"s";
+            emit("bin          " + "  ".join([cfmt % x for x in self.obskeyline]))
+            emit("observation  " + "  ".join([cfmt % x for x in self.obsline]))
+
+        emit("-" * 130)
+
+        pidline = []; signals = []; backgrounds = []
+        tmpsignals = [];
+        for (b,p,s) in keyline:
+            if s:
+                if p not in tmpsignals: tmpsignals.append(p)
+        for (b,p,s) in keyline:
+            if s:
+                if p not in signals: signals.append(p)
+                pidline.append(signals.index(p)-len(tmpsignals)+1)
+            else:
+                if p not in backgrounds: backgrounds.append(p)
+                pidline.append(1+backgrounds.index(p))
+        cmax = max([cmax]+[max(len(p),len(b)) for p,b,s in keyline]+[len(e) for e in self.expline])
+        hmax = max([10] + [len("%-12s[nofloat]  %s %s" % (l,p,a)) for l,(p,a,e,nf) in self.systlines.items()])
+        cfmt  = "%-"+str(cmax)+"s"; hfmt = "%-"+str(hmax)+"s  ";
+        emit(hfmt % "bin" + " " + "  ".join([cfmt % p for p,b,s in keyline]))
+        emit(hfmt % "process" + " " + "  ".join([cfmt % b for p,b,s in keyline]))
+        emit(hfmt % "process" + " " + "  ".join([cfmt % x for x in pidline]))
+        emit(hfmt % "rate" + " " + "  ".join([cfmt % x for x in self.expline]))
+
+        emit("-" * 130)
+
+        sysnamesSorted = self.systlines.keys(); sysnamesSorted.sort()
+        for name in sysnamesSorted:
+            (pdf,pdfargs,effect,nofloat) = self.systlines[name]
+            if nofloat: name += "[nofloat]"
+            emit(hfmt % ("%-21s   %s  %s" % (name, pdf, " ".join(pdfargs))) + " " + "  ".join([cfmt % x for x in self.systRow(effect)]))
+        for (pname, pargs) in self.paramSysts.items():
+            emit("%-12s  param  %s" %  (pname, " ".join(pargs)))
+
+        for pname in self.flatParamNuisances.iterkeys():
+            emit("%-12s  flatParam" % pname)
+        for pname in self.rateParams.iterkeys():
+            for pk in range(len(self.rateParams[pname])):
+                # same spacing as the print statements used originally
+                rp = self.rateParams[pname][pk]
+                emit("%-12s  rateParam %s"% (rp[0][0],pname.replace("AND"," ")) + "".join([" %s" % p for p in rp[0][1:-1]]) + " %s " % (rp[1],))
+        for dname in self.discreteNuisances.iterkeys():
+            emit("%-12s  discrete" % dname)
+        for ext in self.extArgs.iterkeys():
+            emit("%s" % ' '.join(self.extArgs[ext]))
+        for groupName,nuisanceNames in self.groups.iteritems():
+            nuisances = ' '.join(nuisanceNames)
+            emit('%(groupName)s group = %(nuisances)s' % locals())
+        for bpf in self.binParFlags.iterkeys():
+            if len(self.binParFlags[bpf]) == 1:
+              emit("%s autoMCStats %g" % (bpf,self.binParFlags[bpf][0]))
+            if len(self.binParFlags[bpf]) == 2:
+              emit("%s autoMCStats %g %i" % (bpf,self.binParFlags[bpf][0], self.binParFlags[bpf][1]))
+            if len(self.binParFlags[bpf]) == 3:
+              emit("%s autoMCStats %g %i %i" % (bpf,self.binParFlags[bpf][0], self.binParFlags[bpf][1], self.binParFlags[bpf][2]))
+
+        nuisanceEdits = set(self.nuisanceEdits)
+        for edit in nuisanceEdits:
+            emit("nuisance edit  " + edit)
+
+        if editNuisFile:
+            emit(open(editNuisFile, "r").read())
+        out.write("".join(lines))
+
+class DatacardCombination(CardCombination):
+    """
+    Combination of datacards kept in memory: the effects of the nuisances are kept as numbers instead of being formatted,
+    and the result is a Datacard equivalent to what parseCard returns when reading the card written by CardCombination.
+    """
+    def __init__(self):
+        CardCombination.__init__(self)
+        self.obsValues = []
+        self.rates = []
+
+    def add(self, card):
+        CardCombination.add(self, card)
+        self.rates += card.rates
+        if card.obsValues is None:
+            self.obsValues = None
+        elif self.obsValues != None:
+            self.obsValues += card.obsValues
+
+    def systEffect(self, values):
+        return values
+
+    def addNuisanceEdits(self, lines):
+        """Add the 'nuisance edit' lines (e.g. of the file given with --en-file) to the edits of the combination"""
+        for l in lines:
+            f = tokenizeLine(l)
+            if len(f) == 0: continue
+            if len(f) < 3 or f[1] != "edit": raise RuntimeError, "Only 'nuisance edit' lines can be added to the combination, not '%s'" % l.strip()
+            self.nuisanceEdits.append(" ".join(f[2:]))
+
+    def datacard(self, options):
+        """Return the combined Datacard, running the same checks and nuisance edits as parseCard"""
+        ret = Datacard()
+        if self.obsline:
+            ret.bins = self.obskeyline[:]
+            ret.obs = dict(zip(ret.bins, self.obsValues))
+        for (b,p,s) in self.keyline:
+            ret.keyline.append((b,p,s))
+            if b not in ret.bins: ret.bins.append(b)
+            if p not in ret.processes: ret.processes.append(p)
+        ret.exp = dict([(b,{}) for b in ret.bins])
+        ret.isSignal = dict([(p,None) for p in ret.processes])
+        for (b,p,s) in ret.keyline:
+            if ret.isSignal[p] == None:
+                ret.isSignal[p] = s
+            elif ret.isSignal[p] != s:
+                raise RuntimeError, "Process %s is declared as signal in some bin and as background in some other bin" % p
+        ret.signals = [p for p,s in ret.isSignal.items() if s == True]
+        if len(ret.signals) == 0 and not options.allowNoSignal: raise RuntimeError, "You must have at least one signal process (id <= 0)"
+        for (b,p,s),r in zip(ret.keyline, self.rates):
+            ret.exp[b][p] = r
+        for (process,channel,stuff) in self.shapeLines:
+            if not ret.shapeMap.has_key(channel): ret.shapeMap[channel] = {}
+            if ret.shapeMap[channel].has_key(process): raise RuntimeError, "Duplicate definition for process '%s', channel '%s'" % (process, channel)
+            ret.shapeMap[channel][process] = stuff
+        # nuisances, in the same order as in the combined text datacard
+        sysnamesSorted = self.systlines.keys(); sysnamesSorted.sort()
+        for name in sysnamesSorted:
+            (pdf,pdfargs,effect,nofloat) = self.systlines[name]
+            errline = SparseErrline(ret.bins)
+            start = 0
+            for icard,n in enumerate(self.ncolumns):
+                for k,v in enumerate(effect.get(icard, [])):
+                    if v == 0: continue
+                    (b,p,s) = ret.keyline[start+k]
+                    errline[b][p] = v
+                start += n
+            ret.systs.append([name,nofloat,pdf,systArgs(pdf,pdfargs),errline])
+        for (pname, pargs) in self.paramSysts.items():
+            ret.systs.append([pname,False,"param",pargs,[]])
+        ret.flatParamNuisances = dict(self.flatParamNuisances)
+        ret.rateParams = dict(self.rateParams)
+        ret.rateParamsOrder = set(self.rateParamsOrder)
+        ret.discretes = self.discreteNuisances.keys()
+        ret.extArgs = dict(self.extArgs)
+        for groupName,nuisanceNames in self.groups.iteritems():
+            ret.groupLines.append((groupName,'=',list(nuisanceNames)))
+            ret.groups[groupName] = set(nuisanceNames)
+        ret.binParFlags = dict(self.binParFlags)
+        for edit in set(self.nuisanceEdits):
+            numbers = tokenizeLine("nuisance edit " + edit)[2:]
+            if options.evaluateEdits:
+                doEditNuisance(ret, numbers[0], numbers[1:])
+            else:
+                if numbers[0] in ["changepdf","freeze"]: ret.nuisanceEditLines.append([numbers[0],numbers[1:]])
+                else: ret.nuisanceEditLines.append([numbers[0],numbers[1],numbers[2],numbers[3:]])
+        checkBinRates(ret, options)
+        dropNullEffectSysts(ret, options)
+        if options.stat: ret.systs = []
+        ret.hasShapes = (len(ret.shapeMap) > 0)
+        return ret
+
+COMBINATION_INDEX_VERSION = 3
+
+def cardLayout(card):
+    """Processes and nuisances contributed by a card, which make the jmax and the list of nuisances of the combination"""
+    return (set([ (p,s) for (b,p,s) in card.keyline ]),
+            set([ (lsyst,pdf,tuple(pdfargs),nofloat) for (lsyst,pdf,pdfargs,nofloat,values) in card.systs ]),
+            set([ (lsyst,tuple(pdfargs)) for (lsyst,pdfargs) in card.paramSysts ]))
+
+class CombinationIndex():
+    """
+    Sidecar index of a combination: for each input card it stores the hash of its content (and of the options used to
+    parse it) and the rows and columns that it contributes to the combined card, i.e. its CardContribution, with the
+    formatted effects of its nuisances kept in a ColumnStore file next to the index (path.columns.<generation>).
+    When the same cards are combined again, only the cards whose hash changed are parsed, and the combined card is
+    written again from their new columns and from the stored columns of the others.
+    All the cards are parsed again, in a new generation of the ColumnStore, if the index cannot be read or was made
+    with different cards or combination options, if a changed card does not contribute the same processes and
+    nuisances as before (so that jmax or the list of nuisances could change), or if most of the store is made of
+    the records of old versions of the cards.
+    """
+    def __init__(self, path, options):
+        self.path = path
+        self.options = options
+        self.generation = 0
+        ## list of (file name, label, hash) and of the CardContribution of the cards, None if there is no usable index
+        self.cards = None
+        self.contributions = []
+        if not os.path.exists(path): return
+        try:
+            import cPickle
+            (version, opts, generation, cards, contributions) = cPickle.load(open(path, "rb"))
+        except Exception, e:
+            stderr.write("Warning: ignoring unreadable combination index %s (%s)\n" % (path, e))
+            return
+        if version != COMBINATION_INDEX_VERSION: return
+        self.generation = generation
+        if opts == self.optionsKey() and os.path.exists(self.columnsPath(generation)):
+            self.cards = cards
+            self.contributions = contributions
+
+    def optionsKey(self):
+        """Options that change the contribution of a card (besides those already in the hash of the card)"""
+        return (getattr(self.options,"channelVetos",[]), getattr(self.options,"channelIncludes",[]), getattr(self.options,"shape",False))
+
+    def columnsPath(self, generation):
+        return "%s.columns.%d" % (self.path, generation)
+
+    def mostlyDead(self):
+        """True if less than half of the ColumnStore is used by the stored cards"""
+        live = sum([ location[1] for card in self.contributions for (lsyst,pdf,pdfargs,nofloat,location) in card.systs ])
+        return os.path.getsize(self.columnsPath(self.generation)) > 2*live
+
+    def combine(self, cards, jobs=1):
+        """Return the CardCombination of the cards, given as a list of (file name, label), and update the index"""
+        hashes = [ datacardCacheKey(open(fname, "r").read(), self.options) for (fname, label) in cards ]
+        parsed = {}
+        if self.cards is not None and [ (fname, label) for (fname, label, h) in self.cards ] == cards and not self.mostlyDead():
+            changed = [ i for i in xrange(len(cards)) if self.cards[i][2] != hashes[i] ]
+            parsed = dict(zip(changed, relabelCards([ cards[i] for i in changed ], self.options, jobs)))
+            if all([ cardLayout(parsed[i]) == cardLayout(self.contributions[i]) for i in changed ]):
+                combination = CardCombination(ColumnStore(self.columnsPath(self.generation)))
+                for i in changed:
+                    combination.storeEffects(parsed[i])
+                    self.contributions[i] = parsed[i]
+                return self.update(cards, hashes, combination, self.generation)
+            stderr.write("The processes or the nuisances of the changed datacards are not the same as before: combining all the datacards again\n")
+        # full rebuild, reusing the cards that were just parsed
+        generation = self.generation + 1
+        if os.path.exists(self.columnsPath(generation)): os.remove(self.columnsPath(generation))
+        combination = CardCombination(ColumnStore(self.columnsPath(generation)))
+        others = relabelCards([ card for (i,card) in enumerate(cards) if i not in parsed ], self.options, jobs)
+        self.contributions = []
+        for i in xrange(len(cards)):
+            card = parsed[i] if i in parsed else others.next()
+            combination.storeEffects(card)
+            self.contributions.append(card)
+        others.close()
+        return self.update(cards, hashes, combination, generation)
+
+    def update(self, cards, hashes, combination, generation):
+        """Add the cards to the combination and write the index for them (dropping the old ColumnStore if it was replaced)"""
+        for card in self.contributions:
+            combination.add(card)
+        combination.store.flush()
+        import cPickle
+        try:
+            tmp = "%s.tmp%d" % (self.path, os.getpid())
+            cPickle.dump((COMBINATION_INDEX_VERSION, self.optionsKey(), generation, [ (f,l,h) for ((f,l),h) in zip(cards,hashes) ], self.contributions),
+                         open(tmp, "wb"), cPickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, self.path)
+        except (IOError, OSError), e:
+            stderr.write("Warning: could not write combination index %s (%s)\n" % (self.path, e))
+            return combination
+        if generation != self.generation and os.path.exists(self.columnsPath(self.generation)):
+            os.remove(self.columnsPath(self.generation))
+        self.generation = generation
+        return combination
+
+def systArgs(pdf, pdfargs):
+    """Arguments of a nuisance line as parseCard returns them"""
+    if pdf == "gmN": return [int(pdfargs[0])]
+    if pdf == "unif": return [float(pdfargs[0]), float(pdfargs[1])]
+    if pdf == "dFD" or pdf == "dFD2": return [float(pdfargs[0])]
+    return []
+
+def labelledCards(args, prefix=""):
+    """List of (file name, label) for command line arguments of the form label=datacard.txt or datacard.txt"""
+    cards = []
+    for ich,fname in enumerate(args):
+        label = "ch%d" % (ich+1)
+        if "=" in fname: (label,fname) = fname.split("=")
+        cards.append((prefix+fname, label))
+    return cards
+
+def combineDatacards(args, options, jobs=1):
+    """
+    Combine the datacards given as label=datacard.txt (or datacard.txt) arguments directly into a Datacard, with the
+    same relabelling rules as combineCards.py, without writing and parsing again the combined text datacard.
+    """
+    cardOptions = copy.copy(options)
+    cardOptions.evaluateEdits = False
+    cardOptions.allowNoSignal = True
+    cardOptions.allowNoBackground = True
+    for (name,default) in (("channelVetos",[]), ("channelIncludes",[]), ("shape",False)):
+        if not hasattr(cardOptions, name): setattr(cardOptions, name, default)
+    combination = DatacardCombination()
+    for card in relabelCards(labelledCards(args), cardOptions, jobs):
+        combination.add(card)
+    if not hasattr(options,"evaluateEdits"): options.evaluateEdits = True
+    return combination.datacard(options)
@@ -0,0 +1,151 @@
+"""
+Binary datacard format: a NumPy .npz bundle with the content of a Datacard as arrays.
+
+ - bins, processes: names; keyline: (bin index, process index) for each column, with isSignal and the rates
+ - observation: one number per bin (empty if the datacard has no observation line)
+ - nuisances: name, pdf, [nofloat] flag and arguments, and the kappas as a sparse (CSR) matrix over the keyline
+   columns: the effects of nuisance i are kappaValues[kappaIndptr[i]:kappaIndptr[i+1]] on the columns kappaIndices[...],
+   with kappaLow holding the lower kappa of the asymmetric ones (flagged by kappaAsymm)
+ - shapes, flatParam, rateParam, discrete, extArg, group, autoMCStats and nuisance edit directives, each one stored as the
+   words of the corresponding datacard line joined by spaces (the words of a datacard never contain whitespace)
+
+The options of parseCard that select what is read (nuisance vetoes, --stat, nuisance edits) are applied when reading.
+"""
+
+from sys import stderr
+
+from HiggsAnalysis.CombinedLimit.Datacard import Datacard, CompactSystematics, SparseErrline, nonZeroEffects
+from HiggsAnalysis.CombinedLimit.DatacardParser import isVetoed, addRateParam, checkBinRates, dropNullEffectSysts
+from HiggsAnalysis.CombinedLimit.NuisanceModifier import doEditNuisance
+
+NPZ_DATACARD_VERSION = 1
+
+def _strings(values):
+    import numpy
+    return numpy.array(values, dtype=str) if values else numpy.zeros(0, dtype="S1")
+
+def writeNpzCard(DC, out):
+    """Write the Datacard DC to out (a file name or a file object) in the binary .npz format"""
+    import numpy
+    data = {}
+    data["version"] = numpy.array([NPZ_DATACARD_VERSION])
+    data["bins"] = _strings(DC.bins)
+    data["observation"] = numpy.array([ DC.obs[b] for b in DC.bins ] if len(DC.obs) else [], dtype=float)
+    data["processes"] = _strings(DC.processes)
+    binIndex = dict([(b,i) for i,b in enumerate(DC.bins)]); processIndex = dict([(p,i) for i,p in enumerate(DC.processes)])
+    data["keyline"] = numpy.array([ (binIndex[b], processIndex[p]) for (b,p,s) in DC.keyline ], dtype=int).reshape(len(DC.keyline),2)
+    data["isSignal"] = numpy.array([ s for (b,p,s) in DC.keyline ], dtype=bool)
+    data["rates"] = numpy.array([ DC.exp[b][p] for (b,p,s) in DC.keyline ], dtype=float)
+    columns = dict([((b,p),k) for k,(b,p,s) in enumerate(DC.keyline)])
+    names = []; pdfs = []; nofloats = []; args = []
+    indptr = [0]; indices = []; values = []; low = []; asymm = []
+    for (lsyst,nofloat,pdf,pdfargs,errline) in DC.systs:
+        names.append(lsyst); pdfs.append(pdf); nofloats.append(nofloat); args.append(" ".join([str(x) for x in pdfargs]))
+        if pdf not in ("param","discrete","rateParam"):
+            for (k,r) in sorted([ (columns[bp],r) for (bp,r) in nonZeroEffects(errline) if bp in columns ]):
+                if type(r) == list:
+                    indices.append(k); values.append(r[1]); low.append(r[0]); asymm.append(True)
+                else:
+                    indices.append(k); values.append(r); low.append(0.); asymm.append(False)
+        indptr.append(len(indices))
+    data["systNames"] = _strings(names)
+    data["systPdfs"] = _strings(pdfs)
+    data["systNofloat"] = numpy.array(nofloats, dtype=bool)
+    data["systArgs"] = _strings(args)
+    data["kappaIndptr"] = numpy.array(indptr, dtype=int)
+    data["kappaIndices"] = numpy.array(indices, dtype=int)
+    data["kappaValues"] = numpy.array(values, dtype=float)
+    data["kappaLow"] = numpy.array(low, dtype=float)
+    data["kappaAsymm"] = numpy.array(asymm, dtype=bool)
+    # directives, as the words of their datacard lines
+    data["shapes"] = _strings([ " ".join([p,b]+x) for b in DC.shapeMap.iterkeys() for (p,x) in DC.shapeMap[b].iteritems() ])
+    data["flatParams"] = _strings(DC.flatParamNuisances.keys())
+    rateParams = []
+    for K in DC.rateParams.iterkeys():
+        for rp in DC.rateParams[K]:
+            rateParams.append(" ".join([rp[0][0], "rateParam", K.replace("AND"," ")] + [str(x) for x in rp[0][1:-1]] + ([rp[1]] if rp[1] else [])))
+    data["rateParams"] = _strings(rateParams)
+    data["discretes"] = _strings(DC.discretes)
+    data["extArgs"] = _strings([ " ".join(f) for f in DC.extArgs.itervalues() ])
+    data["groups"] = _strings([ " ".join([g,d]+n) for (g,d,n) in DC.groupLines ])
+    data["autoMCStats"] = _strings([ " ".join([b]+[repr(x) for x in flags]) for (b,flags) in DC.binParFlags.iteritems() ])
+    data["nuisanceEdits"] = _strings([ " ".join([e[0]]+e[1]) if len(e) == 2 else " ".join(e[:3]+e[3]) for e in DC.nuisanceEditLines ])
+    numpy.savez_compressed(out, **data)
+
+def parseNpzCard(file, options):
+    """Read a Datacard from a file in the binary .npz format (see writeNpzCard), applying the options as parseCard does"""
+    import numpy
+    data = numpy.load(file)
+    if int(data["version"][0]) != NPZ_DATACARD_VERSION:
+        raise RuntimeError, "Unsupported version %d of binary datacard %s" % (int(data["version"][0]), getattr(file,'name',file))
+    ret = Datacard()
+    ret.bins = [ str(b) for b in data["bins"] ]
+    ret.processes = [ str(p) for p in data["processes"] ]
+    if len(data["observation"]): ret.obs = dict(zip(ret.bins, data["observation"].tolist()))
+    ret.keyline = [ (ret.bins[ib], ret.processes[ip], bool(s)) for ((ib,ip),s) in zip(data["keyline"].tolist(), data["isSignal"]) ]
+    ret.exp = dict([(b,{}) for b in ret.bins])
+    for (b,p,s),r in zip(ret.keyline, data["rates"].tolist()):
+        ret.exp[b][p] = r
+    ret.isSignal = dict([(p,None) for p in ret.processes])
+    for (b,p,s) in ret.keyline: ret.isSignal[p] = s
+    ret.signals = [p for p,s in ret.isSignal.items() if s == True]
+    if len(ret.signals) == 0 and not options.allowNoSignal: raise RuntimeError, "You must have at least one signal process (id <= 0)"
+    for l in data["shapes"]:
+        f = str(l).split()
+        if not ret.shapeMap.has_key(f[1]): ret.shapeMap[f[1]] = {}
+        ret.shapeMap[f[1]][f[0]] = f[2:]
+    # nuisances
+    if getattr(options,"compactCard",False): ret.systMatrix = CompactSystematics(ret.keyline)
+    indptr = data["kappaIndptr"].tolist(); indices = data["kappaIndices"].tolist(); values = data["kappaValues"].tolist()
+    low = data["kappaLow"].tolist(); asymm = data["kappaAsymm"].tolist()
+    for i,(lsyst,pdf,nofloat,args) in enumerate(zip(data["systNames"], data["systPdfs"], data["systNofloat"], data["systArgs"])):
+        lsyst = str(lsyst); pdf = str(pdf); nofloat = bool(nofloat); args = str(args).split()
+        if options.nuisancesToExclude and isVetoed(lsyst, options.nuisancesToExclude):
+            if options.verbose > 0: stderr.write("Excluding nuisance %s selected by a veto pattern among %s\n" % (lsyst, options.nuisancesToExclude))
+            continue
+        if pdf == "gmN": args = [int(args[0])]
+        elif pdf == "unif": args = [float(args[0]), float(args[1])]
+        elif pdf == "dFD" or pdf == "dFD2": args = [float(args[0])]
+        if pdf == "param":
+            ret.systs.append([lsyst,nofloat,pdf,args,[]])
+            continue
+        entries = range(indptr[i],indptr[i+1])
+        if ret.systMatrix is not None:
+            row = numpy.zeros(len(ret.keyline))
+            for j in entries: row[indices[j]] = values[j]
+            errline = ret.systMatrix.addRow(row, dict([(indices[j],[low[j],values[j]]) for j in entries if asymm[j]]))
+        else:
+            errline = SparseErrline(ret.bins)
+            for j in entries:
+                (b,p,s) = ret.keyline[indices[j]]
+                errline[b][p] = [low[j],values[j]] if asymm[j] else values[j]
+        ret.systs.append([lsyst,nofloat,pdf,args,errline])
+    # directives
+    for lsyst in data["flatParams"]: ret.flatParamNuisances[str(lsyst)] = True
+    for l in data["rateParams"]:
+        f = str(l).split()
+        addRateParam(f[0],f,ret)
+    ret.discretes = [ str(d) for d in data["discretes"] ]
+    for l in data["extArgs"]:
+        f = str(l).split()
+        ret.extArgs[f[0]] = f
+    for l in data["groups"]:
+        f = str(l).split()
+        ret.groupLines.append((f[0],f[1],f[2:]))
+        if f[1] == '=': ret.groups[f[0]] = set(f[2:])
+        else:           ret.groups[f[0]].update( set(f[2:]) )
+    for l in data["autoMCStats"]:
+        f = str(l).split()
+        ret.binParFlags[f[0]] = (float(f[1]), f[2] == "True", int(f[3]))
+    for l in data["nuisanceEdits"]:
+        numbers = str(l).split()
+        if getattr(options,"evaluateEdits",True):
+            doEditNuisance(ret, numbers[0], numbers[1:])
+        else:
+            if numbers[0] in ["changepdf","freeze"]: ret.nuisanceEditLines.append([numbers[0],numbers[1:]])
+            else: ret.nuisanceEditLines.append([numbers[0],numbers[1],numbers[2],numbers[3:]])
+    checkBinRates(ret, options)
+    dropNullEffectSysts(ret, options)
+    if options.stat: ret.systs = []
+    ret.hasShapes = (len(ret.shapeMap) > 0)
+    return ret
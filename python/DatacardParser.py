@@ -1,4 +1,4 @@
-import re, fnmatch
+import re, fnmatch, os
 from sys import stderr
 
 globalNuisances = re.compile('(lumi|pdf_(qqbar|gg|qg)|QCDscale_(ggH|qqH|VH|ggH1in|ggH2in|VV)|UEPS|FakeRate|CMS_(eff|fake|trigger|scale|res)_([gemtjb]|met))')
@@ -18,6 +18,7 @@ def addDatacardParserOptions(parser):
     parser.add_option("--poisson",  dest="poisson",  default=0,  type="int",    help="If set to a positive number, binned datasets wih more than this number of entries will be generated using poissonians")
     parser.add_option("--default-morphing",  dest="defMorph", type="string", default="shape", help="Default template morphing algorithm (to be used when the datacard has just 'shape')")
     parser.add_option("--no-b-only","--for-fits",    dest="noBOnly", default=False, action="store_true", help="Do not save the background-only pdf (saves time)")
+    parser.add_option("--X-lazy-b-only",    dest="lazyBOnly", default=False, action="store_true", help="Do not save the background-only pdf, but the set 'signalYields' of the signal yields of all channels, that combine sets to zero to build it when it is needed (implies --no-b-only)")
     parser.add_option("--no-optimize-pdfs",    dest="noOptimizePdf", default=False, action="store_true", help="Do not save the RooSimultaneous as RooSimultaneousOpt and Gaussian constraints as SimpleGaussianConstraint")
     parser.add_option("--optimize-simpdf-constraints",    dest="moreOptimizeSimPdf", default="none", type="string", help="Handling of constraints in simultaneous pdf: 'none' = add all constraints on all channels (default); 'lhchcg' = add constraints on only the first channel; 'cms' = add constraints to the RooSimultaneousOpt.")
     #parser.add_option("--use-HistPdf",  dest="useHistPdf", type="string", default="always", help="Use RooHistPdf for TH1s: 'always' (default), 'never', 'when-constant' (i.e. not when doing template morphing)")
@@ -37,9 +38,20 @@ def addDatacardParserOptions(parser):
     parser.add_option("--X-no-optimize-templates",  dest="optimizeExistingTemplates", default=True, action="store_false", help="Don't optimize templates on the fly (relevant for HZZ)")
     parser.add_option("--X-no-optimize-bound-nusances",  dest="optimizeBoundNuisances", default=True, action="store_false", help="Don't flag nuisances to have a different implementation of bounds")
     parser.add_option("--X-no-optimize-bins",  dest="optimizeTemplateBins", default=True, action="store_false", help="Don't optimize template bins (removes padding from TH1s)")
+    parser.add_option("--X-datacard-cache",  dest="datacardCache", default=os.environ.get("COMBINE_DATACARD_CACHE",None), type="string", help="Directory where parsed datacards are cached, keyed by the card content and the parsing options (default: $COMBINE_DATACARD_CACHE, if set)")
+    parser.add_option("--X-prefetch-shapes",  dest="prefetchShapes", default=0, type="int", help="Read all the histograms of the model up front, one file per task in a pool of this number of processes (default: 0, read them when needed)")
+    parser.add_option("--X-shape-file-cache",  dest="shapeFileCacheSize", default=256, type="int", help="Keep at most this number of shape files open, closing the least recently used ones (0 = no limit; files holding workspaces or trees are always kept open)")
+    parser.add_option("--X-shape-cache-mb",  dest="shapeCacheMB", default=2048, type="int", help="Keep at most this many MB of histogram templates in memory, dropping the least recently used ones (0 = no limit)")
+    parser.add_option("--X-model-jobs",  dest="modelJobs", default=1, type="int", help="Build the models of the channels in this number of worker processes, and merge them in the workspace")
+    parser.add_option("--X-model-cache",  dest="modelCache", default=os.environ.get("COMBINE_MODEL_CACHE",None), type="string", help="Directory where the models of the individual channels are cached, keyed by their inputs, to skip rebuilding the unchanged channels (default: $COMBINE_MODEL_CACHE, if set)")
+    parser.add_option("--X-masses",  dest="masses", default=None, type="string", help="Build one workspace for each of these comma-separated masses, reading the templates that don't depend on $MASS only once; the output file name has $MASS replaced by the mass, or .mH<mass> added before .root")
+    parser.add_option("--X-lazy-channels",  dest="lazyChannels", default=False, action="store_true", help="Write the model of each channel to its own directory of the output file, and only a stand-in for it in the workspace: combine reads the channels when it sets up the likelihood, except the ones masked at that point (--channel-masks), which are never read, not even to generate toys (not compatible with --X-lazy-b-only; channels with autoMCStats stay in the workspace)")
+    parser.add_option("--X-nuisance-block",  dest="nuisanceBlock", default=False, action="store_true", help="Put the unit Gaussian constraints of all the nuisances in a single SimpleGaussianConstraintBlock instead of one pdf each (faster for very large numbers of nuisances)")
+    parser.add_option("--X-counting-pdf",  dest="countingPdf", default=False, action="store_true", help="For counting experiments, model all the bins with a single CMSCountingPdf instead of one RooPoisson pdf_bin<X> per bin (faster for very many bins; the workspace then has no n_exp_bin<X> and pdf_bin<X>, and model_s is a CMSLogProdPdf)")
+    parser.add_option("--X-compact-datacard",  dest="compactCard", default=False, action="store_true", help="Store the nuisance effects in a compact columnar (NumPy) array instead of dicts (faster and leaner for very large datacards)")
 
 
-from HiggsAnalysis.CombinedLimit.Datacard import Datacard
+from HiggsAnalysis.CombinedLimit.Datacard import Datacard, CompactSystematics, ErrlineView, SparseErrline, nonZeroEffects
 from HiggsAnalysis.CombinedLimit.NuisanceModifier import doEditNuisance
 
 def isVetoed(name,vetoList):
@@ -71,14 +83,167 @@ def addRateParam(lsyst,f,ret):
     else: ret.rateParams["%sAND%s"%(f[2],f[3])] = [tmp_exp]
     ret.rateParamsOrder.add(lsyst)
 
+def tokenizeLine(l):
+    """Split a nuisance line into words, dropping comments and turning '-' placeholders into '0' (in a single pass)"""
+    f = l.split("#",1)[0].split()
+    f[1:] = [ ("0" if (x[0] == "-" and (x == "-" or x.strip("-") == "")) else x) for x in f[1:] ]
+    return f
+
+def parseCompactErrline(ret,pdf,lsyst,numbers):
+    """Fill one row of the compact columnar store from the words of a nuisance line, returning the ErrlineView on it"""
+    import numpy
+    numbers = numbers[:len(ret.keyline)]
+    asymm = {}
+    if any(["/" in r for r in numbers]):
+        values = numpy.zeros(len(numbers))
+        for k,r in enumerate(numbers):
+            if "/" in r: # "number/number"
+                (b,p,s) = ret.keyline[k]
+                if (pdf not in ["lnN","lnU"]) and ("?" not in pdf): raise RuntimeError, "Asymmetric errors are allowed only for Log-normals"
+                asymm[k] = [ float(x) for x in r.split("/") ]
+                for v in asymm[k]:
+                    if v <= 0.00: raise ValueError('Found "%s" in the nuisances affecting %s for %s. This would lead to NANs later on, so please fix it.'%(r,p,b))
+                values[k] = asymm[k][1]
+            else:
+                values[k] = float(r)
+    else:
+        values = numpy.array(numbers, dtype=float)
+    #values of 0.0 are treated as 1.0; scrap negative values.
+    if pdf not in ["trG", "dFD", "dFD2"]:
+        for k in numpy.flatnonzero(values < 0):
+            if k in asymm: continue
+            (b,p,s) = ret.keyline[k]
+            raise ValueError('Found "%s" in the nuisances affecting %s in %s. This would lead to NANs later on, so please fix it.'%(numbers[k],p,b))
+    # set the rate to epsilon for backgrounds with zero observed sideband events.
+    if pdf == "gmN":
+        for k in numpy.flatnonzero(values):
+            (b,p,s) = ret.keyline[k]
+            if ret.exp[b][p] == 0: ret.exp[b][p] = 1e-6
+    return ret.systMatrix.addRow(values, asymm)
+
+## bump this whenever the parsing of the nuisance lines changes, to invalidate old cache entries
+DATACARD_CACHE_VERSION = 2
+
+## pdfs of the nuisance lines whose per bin/process effects are stored in the cache (together with all the shape* ones)
+cachedPdfs = [ "lnN", "lnU", "gmM", "trG", "gmN", "unif", "dFD", "dFD2" ]
+
+def datacardCacheKey(content, options):
+    """Hash of the datacard text and of all the options that change the result of parseCard"""
+    import hashlib
+    patterns = [ getattr(x,"pattern",x) for x in getattr(options,"nuisancesToExclude",[]) ]
+    parseOpts = (DATACARD_CACHE_VERSION, getattr(options,"stat",False), patterns, getattr(options,"evaluateEdits",True),
+                 getattr(options,"noJMax",False), getattr(options,"allowNoSignal",False), getattr(options,"allowNoBackground",False),
+                 getattr(options,"modelparams",[]))
+    return hashlib.md5(content + "\n" + repr(parseOpts)).hexdigest()
+
+class DatacardCacheEntry():
+    """
+    On-disk cache of the parsed nuisance lines of a datacard: the non-null effects of all the nuisance lines with a per
+    bin/process column (before any nuisance edit is applied) are stored in path.npz as a sparse (lines x keyline) matrix,
+    i.e. the keyline columns and the values of each line (cols[indptr[i]:indptr[i+1]] and vals[indptr[i]:indptr[i+1]]),
+    while the asymmetric kappas are pickled in path.pkl.
+    The rest of the datacard is always re-parsed, which is cheap and keeps the result identical to an uncached parse.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.indptr = None
+        self.asymm = {}
+        self.cols = []; self.vals = []; self.lines = [0]
+        self.columns = None
+        self.next = 0
+        if not os.path.exists(path+".pkl"): return
+        try:
+            import cPickle, numpy
+            self.asymm = cPickle.load(open(path+".pkl", "rb"))
+            stored = numpy.load(path+".npz")
+            self.cols, self.vals, self.indptr = stored["cols"], stored["vals"], stored["indptr"]
+        except Exception, e:
+            stderr.write("Warning: ignoring unreadable datacard cache entry %s (%s)\n" % (path, e))
+            self.indptr = None; self.asymm = {}; self.cols = []; self.vals = []
+
+    def hit(self):
+        return self.indptr is not None
+
+    def replay(self, ret, pdf):
+        """Return the errline for the next nuisance line, taking the values from the cache"""
+        i = self.next; self.next += 1
+        asymm = self.asymm.get(i, {})
+        cols = self.cols[self.indptr[i]:self.indptr[i+1]].tolist()
+        vals = self.vals[self.indptr[i]:self.indptr[i+1]].tolist()
+        if pdf == "gmN":
+            for k in cols:
+                (b,p,s) = ret.keyline[k]
+                if ret.exp[b][p] == 0: ret.exp[b][p] = 1e-6
+        if ret.systMatrix is not None:
+            import numpy
+            row = numpy.zeros(len(ret.keyline))
+            row[cols] = vals
+            return ret.systMatrix.addRow(row, dict(asymm))
+        errline = SparseErrline(ret.bins)
+        for k,v in zip(cols,vals):
+            (b,p,s) = ret.keyline[k]
+            errline[b][p] = v
+        for k,r in asymm.iteritems():
+            (b,p,s) = ret.keyline[k]
+            errline[b][p] = list(r)
+        return errline
+
+    def record(self, ret, errline):
+        """Remember the non-null values of a freshly parsed nuisance line, to be stored in the cache"""
+        i = len(self.lines)-1
+        if ret.systMatrix is not None:
+            import numpy
+            row = ret.systMatrix.values[errline.row]
+            nonzero = numpy.flatnonzero(row)
+            self.cols += nonzero.tolist()
+            self.vals += row[nonzero].tolist()
+            if errline.row in ret.systMatrix.asymm: self.asymm[i] = dict(ret.systMatrix.asymm[errline.row])
+        else:
+            if self.columns is None: self.columns = dict([((b,p),k) for k,(b,p,s) in enumerate(ret.keyline)])
+            for k,r in sorted([ (self.columns[bp],r) for bp,r in nonZeroEffects(errline) ]):
+                if type(r) == list:
+                    if i not in self.asymm: self.asymm[i] = {}
+                    self.asymm[i][k] = list(r)
+                    r = r[1]
+                self.cols.append(k); self.vals.append(r)
+        self.lines.append(len(self.cols))
+
+    def store(self, ret):
+        import cPickle, numpy
+        try:
+            if not os.path.isdir(os.path.dirname(self.path)): os.makedirs(os.path.dirname(self.path))
+            # write to temporary files and rename them, so that concurrent jobs never see partial entries
+            tmp = "%s.tmp%d" % (self.path, os.getpid())
+            numpy.savez(open(tmp+".npz", "wb"), indptr=numpy.array(self.lines, dtype=numpy.int64),
+                        cols=numpy.array(self.cols, dtype=numpy.int32), vals=numpy.array(self.vals, dtype=float))
+            cPickle.dump(self.asymm, open(tmp+".pkl", "wb"), cPickle.HIGHEST_PROTOCOL)
+            os.rename(tmp+".npz", self.path+".npz")
+            os.rename(tmp+".pkl", self.path+".pkl")
+        except (IOError, OSError), e:
+            stderr.write("Warning: could not write datacard cache entry %s (%s)\n" % (self.path, e))
+
 def parseCard(file, options):
     if type(file) == type("str"):
         raise RuntimeError, "You should pass as argument to parseCards a file object, stream or a list of lines, not a string"
+    fileName = getattr(file,'name',None)
+    if fileName != None and fileName.endswith(".npz"):
+        from HiggsAnalysis.CombinedLimit.DatacardNpz import parseNpzCard
+        return parseNpzCard(file, options)
     ret = Datacard()
 
+    # with a cache directory, the nuisance effects are taken from the cache if this card was already parsed with the same options
+    cache = None
+    cacheDir = getattr(options,"datacardCache",os.environ.get("COMBINE_DATACARD_CACHE",None))
+    if cacheDir:
+        lines = file if type(file) == list else file.readlines()
+        cache = DatacardCacheEntry(os.path.join(cacheDir, datacardCacheKey("".join(lines), options)))
+        if cache.hit() and getattr(options,"verbose",0) > 0: stderr.write("Reading nuisances of %s from cache %s.npz\n" % (fileName, cache.path))
+        file = iter(lines) # the nuisances are read from where the loop on the header stopped
+
     # resetting these here to defaults, parseCard will fill them up
     ret.discretes=[]
     ret.groups={}
+    ret.groupLines=[]
 
     #
     nbins      = -1;
@@ -90,6 +255,8 @@ def parseCard(file, options):
 
     try: getattr(options,"evaluateEdits")
     except: setattr(options,"evaluateEdits",True)
+    try: getattr(options,"compactCard")
+    except: setattr(options,"compactCard",False)
 
     try:
         for lineNumber,l in enumerate(file):
@@ -167,11 +334,15 @@ def parseCard(file, options):
                     ret.exp[b][p] = float(r)
                 break # rate is the last line before nuisances
         # parse nuisances
+        if options.compactCard: ret.systMatrix = CompactSystematics(ret.keyline)
         for lineNumber,l in enumerate(file):
             if l.startswith("--"): continue
-            l  = re.sub("\\s*#.*","",l)
-            l = re.sub("(?<=\\s)-+(\\s|$)"," 0\\1",l);
-            f = l.split();
+            if cache is not None and cache.hit():
+                # the per bin/process effects come from the cache, so only the first words of the line are needed
+                f = l.split("#",1)[0].split(None,4)
+                if len(f) > 1 and f[1] not in cachedPdfs and not f[1].startswith("shape"): f = tokenizeLine(l)
+            else:
+                f = tokenizeLine(l)
             if len(f) <= 1: continue
             nofloat = False
             lsyst = f[0]; pdf = f[1]; args = []; numbers = f[2:];
@@ -208,10 +379,8 @@ def parseCard(file, options):
 	    	continue
             elif pdf == "rateParam":
 	        if ("*" in f[3]) or ("*" in f[2]): # all channels/processes
-		  for c in ret.processes:
-		   for b in ret.bins:
-		    if (not fnmatch.fnmatch(c, f[3])): continue
-		    if (not fnmatch.fnmatch(b, f[2])): continue
+		  for c in ret.namePatterns.processes(f[3]):
+		   for b in ret.namePatterns.bins(f[2]):
 		    f_tmp = f[:]
 		    f_tmp[2]=b
 		    f_tmp[3]=c
@@ -246,6 +415,7 @@ def parseCard(file, options):
                 if defTok not in defToks:
                     raise RuntimeError, "Syntax error for group '%s': first thing after 'group' is not '[+]=' but '%s'." % (groupName,defTok)
 
+                ret.groupLines.append((groupName,defTok,groupNuisances[:]))
                 if groupName not in ret.groups:
                     if defTok=='=':
                         ret.groups[groupName] = set(groupNuisances)
@@ -265,8 +435,7 @@ def parseCard(file, options):
 	        statHistMode = int(f[4]) if len(f) >= 5 else 1
 	        statFlags = (statThreshold, statIncludeSig, statHistMode)
 		if "*" in lsyst: 
-		  for b in ret.bins: 
-		    	if (not fnmatch.fnmatch(b, lsyst)): continue
+		  for b in ret.namePatterns.bins(lsyst): 
 		  	ret.binParFlags[b]=statFlags
     		else:
 		  if lsyst not in ret.bins: raise RuntimeError, " No such channel '%s', malformed line:\n   %s" % (lsyst,' '.join(f))
@@ -274,9 +443,15 @@ def parseCard(file, options):
                 continue
             else:
                 raise RuntimeError, "Unsupported pdf %s" % pdf
+            if cache is not None and cache.hit():
+                ret.systs.append([lsyst,nofloat,pdf,args,cache.replay(ret,pdf)])
+                continue
             if len(numbers) < len(ret.keyline): raise RuntimeError, "Malformed systematics line %s of length %d: while bins and process lines have length %d" % (lsyst, len(numbers), len(ret.keyline))
-            errline = dict([(b,{}) for b in ret.bins])
-            nonNullEntries = 0
+            if ret.systMatrix is not None:
+                ret.systs.append([lsyst,nofloat,pdf,args,parseCompactErrline(ret,pdf,lsyst,numbers)])
+                if cache is not None: cache.record(ret, ret.systs[-1][4])
+                continue
+            errline = SparseErrline(ret.bins)
             for (b,p,s),r in zip(ret.keyline,numbers):
                 if "/" in r: # "number/number"
                     if (pdf not in ["lnN","lnU"]) and ("?" not in pdf): raise RuntimeError, "Asymmetric errors are allowed only for Log-normals"
@@ -284,17 +459,19 @@ def parseCard(file, options):
                     for v in errline[b][p]:
                         if v <= 0.00: raise ValueError('Found "%s" in the nuisances affecting %s for %s. This would lead to NANs later on, so please fix it.'%(r,p,b))
                 else:
-                    errline[b][p] = float(r)
+                    v = float(r)
+                    if v != 0: errline[b][p] = v # only the non-null effects are stored
                     #values of 0.0 are treated as 1.0; scrap negative values.
-                    if pdf not in ["trG", "dFD", "dFD2"] and errline[b][p] < 0: raise ValueError('Found "%s" in the nuisances affecting %s in %s. This would lead to NANs later on, so please fix it.'%(r,p,b))
+                    if pdf not in ["trG", "dFD", "dFD2"] and v < 0: raise ValueError('Found "%s" in the nuisances affecting %s in %s. This would lead to NANs later on, so please fix it.'%(r,p,b))
                 # set the rate to epsilon for backgrounds with zero observed sideband events.
                 if pdf == "gmN" and ret.exp[b][p] == 0 and float(r) != 0: ret.exp[b][p] = 1e-6
+            if cache is not None: cache.record(ret, errline)
             ret.systs.append([lsyst,nofloat,pdf,args,errline])
     except Exception, ex:
         if lineNumber != None:
             msg = "Error reading line %d" % (lineNumber + 1)
-            if hasattr(file,'name'):
-                msg += " of file " + file.name
+            if fileName != None:
+                msg += " of file " + fileName
 
             msg += ": " + ex.args[0]
             ex.args = (msg, ) + ex.args[1:]
@@ -303,27 +480,10 @@ def parseCard(file, options):
 
 
     # check if there are bins with no rate
-    for b in ret.bins:
-        np_bin = sum([(ret.exp[b][p] != 0) for (b1,p,s) in ret.keyline if b1 == b])
-        ns_bin = sum([(ret.exp[b][p] != 0) for (b1,p,s) in ret.keyline if b1 == b and s == True])
-        nb_bin = sum([(ret.exp[b][p] != 0) for (b1,p,s) in ret.keyline if b1 == b and s != True])
-        if np_bin == 0: raise RuntimeError, "Bin %s has no processes contributing to it" % b
-        if ns_bin == 0 and not options.allowNoSignal: stderr.write("Warning: Bin %s has no signal processes contributing to it\n" % b)
-        if nb_bin == 0 and not options.allowNoBackground: raise RuntimeError, "Bin %s has no background processes contributing to it" % b
+    checkBinRates(ret, options)
     # cleanup systematics that have no effect to avoid zero derivatives
-    syst2 = []
-    for lsyst,nofloat,pdf,args,errline in ret.systs:
-        nonNullEntries = 0
-        if pdf == "param" or pdf=="discrete" or pdf=="rateParam": # this doesn't have an errline
-            syst2.append((lsyst,nofloat,pdf,args,errline))
-            continue
-        for (b,p,s) in ret.keyline:
-            r = errline[b][p]
-            nullEffect = (r == 0.0 or (pdf == "lnN" and r == 1.0))
-            if not nullEffect and ret.exp[b][p] != 0: nonNullEntries += 1 # is this a zero background?
-        if nonNullEntries != 0: syst2.append((lsyst,nofloat,pdf,args,errline))
-        elif nuisances != -1: nuisances -= 1 # remove from count of nuisances, since qe skipped it
-    ret.systs = syst2
+    dropped = dropNullEffectSysts(ret, options)
+    if nuisances != -1: nuisances -= dropped # remove from count of nuisances, since we skipped them
     # remove them if options.stat asks so
     if options.stat:
         nuisances = 0
@@ -335,9 +495,54 @@ def parseCard(file, options):
         raise RuntimeError, "Found %d systematics, expected %d" % (len(ret.systs), nuisances)
     # set boolean to know about shape
     ret.hasShapes = (len(ret.shapeMap) > 0)
+    if cache is not None and not cache.hit(): cache.store(ret)
     # return result
     return ret
 
+def checkBinRates(ret, options):
+    """Check that all bins have some process with a non-zero rate, in a single pass on the keyline"""
+    nproc = dict([(b,0) for b in ret.bins]); nsig = dict(nproc); nbkg = dict(nproc)
+    for (b,p,s) in ret.keyline:
+        if ret.exp[b][p] == 0: continue
+        nproc[b] += 1
+        if s == True: nsig[b] += 1
+        else:         nbkg[b] += 1
+    for b in ret.bins:
+        if nproc[b] == 0: raise RuntimeError, "Bin %s has no processes contributing to it" % b
+        if nsig[b] == 0 and not options.allowNoSignal: stderr.write("Warning: Bin %s has no signal processes contributing to it\n" % b)
+        if nbkg[b] == 0 and not options.allowNoBackground: raise RuntimeError, "Bin %s has no background processes contributing to it" % b
+
+def dropNullEffectSysts(ret, options):
+    """
+    Remove from ret.systs the nuisances that have no effect on any process with a non-zero rate (kappa 0, or 1 for lnN)
+    and return how many were removed. Rows of a compact datacard are all checked at once on the kappa matrix.
+    """
+    rates = [ ret.exp[b][p] for (b,p,s) in ret.keyline ]
+    nonZeroRates = set([ (b,p) for (b,p,s) in ret.keyline if ret.exp[b][p] != 0 ])
+    keep = [ True ] * len(ret.systs)
+    compactRows = []
+    for i,(lsyst,nofloat,pdf,args,errline) in enumerate(ret.systs):
+        if pdf == "param" or pdf=="discrete" or pdf=="rateParam": # this doesn't have an errline
+            continue
+        if isinstance(errline, ErrlineView):
+            compactRows.append(i)
+            continue
+        keep[i] = False
+        for (bp,r) in nonZeroEffects(errline):
+            if bp not in nonZeroRates: continue # is this a zero background?
+            if not (pdf == "lnN" and r == 1.0):
+                keep[i] = True
+                break
+    if compactRows:
+        counts = ret.systMatrix.countEffects([ret.systs[i][4].row for i in compactRows], [ret.systs[i][2] == "lnN" for i in compactRows], rates)
+        for i,n in zip(compactRows,counts): keep[i] = (n != 0)
+    dropped = [ s[0] for s,k in zip(ret.systs,keep) if not k ]
+    if dropped and getattr(options,"verbose",0) > 0:
+        stderr.write("Dropped %d nuisances with no effect on any process with non-zero rate\n" % len(dropped))
+        if getattr(options,"verbose",0) > 1: stderr.write("   %s\n" % " ".join(dropped))
+    ret.systs = [ tuple(s) for s,k in zip(ret.systs,keep) if k ]
+    return len(dropped)
+
 def FloatToString(inputValue):
     return ('%.10f' % inputValue).rstrip('0').rstrip('.')
 def FloatToStringScientific(inputValue,etype='g'):
@@ -1,7 +1,8 @@
 import ROOT
-import re, os, os.path
+import re, os, os.path, time
 from sys import stderr, stdout
 from math import *
+from contextlib import contextmanager
 ROOFIT_EXPR = "expr"
 ROOFIT_EXPR_PDF = "EXPR"
 
@@ -19,14 +20,145 @@ class SafeWorkspaceImporter():
         else:
             self.imp(*args)
 
+class PoissonRanges():
+    """Ranges of the Poisson constraints (gmN nuisances and the autoMCStats bins with createPoissonConstraint),
+       found with the same iterative search as before and remembered per (observed count, threshold), since
+       the same counts come up again and again in large models"""
+    def __init__(self):
+        self.expRanges = {}
+        self.obsRanges = {}
+    def expRange(self, n, threshold=1e-12):
+        """Range [minExp, maxExp] of the expected value of a Poisson with n observed events, outside of
+           which the probability of observing n falls below threshold"""
+        if (n,threshold) not in self.expRanges:
+            minExp = n+1 if n > 0 else 0;
+            while (ROOT.TMath.Poisson(n, minExp) > threshold) and minExp > 0:
+                minExp *= 0.8;
+            maxExp = n+1;
+            while (ROOT.TMath.Poisson(n, maxExp) > threshold):
+                maxExp *= 1.2;
+            self.expRanges[(n,threshold)] = (minExp, maxExp)
+        return self.expRanges[(n,threshold)]
+    def obsRange(self, n, threshold=1e-12):
+        """Range [minObs, maxObs] of the observed value of a Poisson with expected value n+1, outside of
+           which the probability falls below threshold"""
+        if (n,threshold) not in self.obsRanges:
+            minObs = n;
+            while minObs > 0 and (ROOT.TMath.Poisson(minObs, n+1) > threshold):
+                minObs -= (sqrt(n) if n > 10 else 1);
+            maxObs = n+2;
+            while (ROOT.TMath.Poisson(maxObs, n+1) > threshold):
+                maxObs += (sqrt(n) if n > 10 else 2);
+            self.obsRanges[(n,threshold)] = (minObs, maxObs)
+        return self.obsRanges[(n,threshold)]
+
+class GaussianConstraintBatch():
+    """Builds SimpleGaussianConstraint terms and their global observables directly as C++ objects, and imports
+       them in the workspace all at once with a single RooWorkspace::import of a RooArgSet when flushed,
+       instead of going through one RooWorkspace::factory string per nuisance.
+       If a blockName is given, the unit Gaussian constraints are instead collected in a single
+       SimpleGaussianConstraintBlock of that name, made by makeBlock after the last flush"""
+    def __init__(self,wsp,blockName=None):
+        self.wsp = wsp
+        self.pdfs = ROOT.RooArgSet()
+        self.objs = []
+        self.names = set()
+        self.blockName = blockName
+        self.blockVars = ROOT.RooArgList(); self.blockGlobalObs = ROOT.RooArgList()
+        self.blocked = set()
+    def __contains__(self,name):
+        return name in self.names or name in self.blocked
+    def add(self,name,lo,hi,sigma=1.0,mean=0.0,globalConstrained=False):
+        """Add the constraint <name>_Pdf of parameter <name> (taken from the workspace if it's already there, else
+           created with range [lo,hi]) with the constant global observable <name>_In[mean,lo,hi], and return the parameter.
+           The globalConstrained (nofloat) parameters, which the test statistics fix to their global observables, always get their own pdf"""
+        x = self.wsp.var(name)
+        if not x:
+            x = ROOT.RooRealVar(name,name,lo,hi)
+            self.objs.append(x)
+        x_In = ROOT.RooRealVar("%s_In" % name,"%s_In" % name,mean,lo,hi)
+        x_In.setConstant(True)
+        if self.blockName and sigma == 1.0 and mean == 0.0 and not globalConstrained:
+            x.setStringAttribute("constraintBlock", self.blockName) # so that combine knows there is no <name>_Pdf
+            self.objs.append(x_In)
+            self.pdfs.add(x); self.pdfs.add(x_In)
+            self.blockVars.add(x); self.blockGlobalObs.add(x_In)
+            self.blocked.add(name)
+            return x
+        pdf = ROOT.SimpleGaussianConstraint("%s_Pdf" % name,"%s_Pdf" % name,x,x_In,ROOT.RooFit.RooConst(sigma))
+        self.objs += [ x_In, pdf ]
+        self.pdfs.add(pdf)
+        self.names.add(name)
+        return x
+    def flush(self):
+        """Import all the pending constraints in the workspace"""
+        if not self.pdfs.getSize(): return
+        self.wsp._import(self.pdfs, ROOT.RooFit.RecycleConflictNodes(), ROOT.RooFit.Silence())
+        self.wsp.dont_delete.append(self.objs)
+        self.pdfs = ROOT.RooArgSet()
+        self.objs = []
+        self.names = set()
+    def makeBlock(self):
+        """Import the block of all the unit Gaussian constraints added so far (after flushing them), and return it (None if empty)"""
+        if not self.blocked: return None
+        xs = ROOT.RooArgList(); gobs = ROOT.RooArgList()
+        for i in xrange(self.blockVars.getSize()):
+            xs.add(self.wsp.var(self.blockVars.at(i).GetName()))
+            gobs.add(self.wsp.var(self.blockGlobalObs.at(i).GetName()))
+        block = ROOT.SimpleGaussianConstraintBlock(self.blockName, self.blockName, xs, gobs)
+        self.wsp._import(block, ROOT.RooFit.RecycleConflictNodes(), ROOT.RooFit.Silence())
+        return self.wsp.pdf(self.blockName)
+
+class PhaseProfiler():
+    """Records the wall time, CPU time, peak RSS and number of objects created in each phase of the building of a
+       model, e.g.  with profiler.phase("doNuisances"): builder.doNuisances()
+       Phases can be nested, in which case the time of the inner ones is also counted in the outer one."""
+    def __init__(self,enabled=True):
+        self.enabled = enabled
+        self.phases = []
+        self.countObjects = None # function giving the number of objects created so far, set by the model builder
+    def _snapshot(self):
+        import resource
+        t = os.times()
+        return { "wall" : time.time(), "cpu" : t[0]+t[1],
+                 "rss"  : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024., # kB -> MB
+                 "objects" : self.countObjects() if self.countObjects else 0 }
+    @contextmanager
+    def phase(self,name):
+        if not self.enabled:
+            yield
+            return
+        record = { "phase" : name }
+        self.phases.append(record) # in the order in which they start
+        before = self._snapshot()
+        yield
+        after = self._snapshot()
+        record.update({ "wallTime" : after["wall"] - before["wall"], "cpuTime" : after["cpu"] - before["cpu"],
+                        "peakRSS" : after["rss"], "peakRSSIncrease" : after["rss"] - before["rss"],
+                        "objectsCreated" : after["objects"] - before["objects"] })
+    def write(self,fname):
+        """Write the report as JSON to file fname"""
+        import json
+        out = open(fname, "w")
+        json.dump({ "phases" : self.phases }, out, indent=1)
+        out.write("\n")
+        out.close()
+    def report(self):
+        """Return a human readable summary of the report"""
+        lines = [ "%-28s %10s %10s %12s %10s" % ("phase", "wall [s]", "cpu [s]", "peak RSS [MB]", "objects") ]
+        for p in self.phases:
+            lines.append("%-28s %10.3f %10.3f %12.1f %10d" % (p["phase"], p["wallTime"], p["cpuTime"], p["peakRSS"], p["objectsCreated"]))
+        return "\n".join(lines)
+
 class ModelBuilderBase():
     """This class defines the basic stuff for a model builder, and it's an interface on top of RooWorkspace::factory or HLF files"""
     def __init__(self,options):
         self.options = options
         self.out = stdout
 	self.discrete_param_set = []
+        self.profiler = PhaseProfiler(enabled=False) # replaced by text2workspace.py with --profile-phases
         if options.bin:
-            if options.out == None: options.out = re.sub(".txt$","",options.fileName)+".root"
+            if options.out == None: options.out = re.sub(".(txt|npz)$","",options.fileName)+".root"
             options.baseDir = os.path.dirname(options.fileName)
             ROOT.gSystem.Load("libHiggsAnalysisCombinedLimit")
             ROOT.TH1.AddDirectory(False)
@@ -103,12 +235,18 @@ class ModelBuilder(ModelBuilderBase):
         self.selfNormBins = []
         self.extraNuisances = []
         self.extraGlobalObservables = []
+        self.lazyChannels = [] # (channel, RooWorkspace) written to their own directories of the output file
+        self.poissonRanges = PoissonRanges() # ranges of the Poisson constraints, shared by all the gmN and autoMCStats ones
+        if options.lazyBOnly:
+            if options.bin: options.noBOnly = True
+            else: options.lazyBOnly = False # the set of the signal yields is only saved in binary workspaces
     def setPhysics(self,physicsModel):
         self.physics = physicsModel
         self.physics.setModelBuilder(self)
     def doModel(self):
-        self.doObservables()
-        self.physics.doParametersOfInterest()
+        if self.options.bin: self.profiler.countObjects = self.countObjects
+        with self.profiler.phase("doObservables"): self.doObservables()
+        with self.profiler.phase("doParametersOfInterest"): self.physics.doParametersOfInterest()
 
         # set a group attribute on POI variables
         poiIter = self.out.set('POI').createIterator()
@@ -118,21 +256,25 @@ class ModelBuilder(ModelBuilderBase):
             poi = poiIter.Next()
 
         self.physics.preProcessNuisances(self.DC.systs)
-        self.doNuisances()
-	self.doExtArgs()
-	self.doRateParams()
-        self.doExpectedEvents()
-        self.doIndividualModels()
-        self.doNuisancesGroups() # this needs to be called after both doNuisances and doIndividualModels
-        self.doCombination()
+        with self.profiler.phase("doNuisances"): self.doNuisances()
+	with self.profiler.phase("doExtArgs"): self.doExtArgs()
+	with self.profiler.phase("doRateParams"): self.doRateParams()
+        with self.profiler.phase("doExpectedEvents"): self.doExpectedEvents()
+        with self.profiler.phase("doIndividualModels"): self.doIndividualModels()
+        with self.profiler.phase("doNuisancesGroups"): self.doNuisancesGroups() # this needs to be called after both doNuisances and doIndividualModels
+        with self.profiler.phase("doCombination"): self.doCombination()
 	self.runPostProcesses()
         self.physics.done()
         if self.options.bin:
-            self.doModelConfigs()
+            with self.profiler.phase("doModelConfigs"): self.doModelConfigs()
+            with self.profiler.phase("writeToFile"): self.writeModel()
             if self.options.verbose > 1: self.out.Print("tv")
             if self.options.verbose > 2:
                 self.out.pdf("model_s").graphVizTree(self.options.out+".dot", "\\n")
                 print "Wrote GraphVizTree of model_s to ",self.options.out+".dot"
+    def countObjects(self):
+        """Number of objects in the workspace and in the object store"""
+        return self.out.components().getSize() + len(self.objstore)
 
 
     def runPostProcesses(self):
@@ -267,6 +409,7 @@ class ModelBuilder(ModelBuilderBase):
         globalobs = []
 
         for cpar in self.DC.discretes: self.addDiscrete(cpar)
+        constraints = GaussianConstraintBatch(self.out, "nuisanceBlock_Pdf" if getattr(self.options,"nuisanceBlock",False) else None) if self.options.bin else None
         for (n,nofloat,pdf,args,errline) in self.DC.systs:
             is_func_scaled = False
             func_scaler = None
@@ -282,7 +425,11 @@ class ModelBuilder(ModelBuilderBase):
                     func_scaler = pf
                     if self.options.verbose > 1:
                         print 'Rescaling %s constraint (in group %s) as %s' % (n, pn, pf)
-            if pdf == "lnN" or (pdf.startswith("shape") and pdf != 'shapeU'):
+            isGaussian = (pdf == "lnN" or (pdf.startswith("shape") and pdf != 'shapeU'))
+            # the common case is built together with the other ones and imported at once, otherwise import the pending ones first
+            batched = self.options.bin and isGaussian and not (self.options.noOptimizePdf or is_func_scaled) and n not in constraints and not self.out.obj("%s_Pdf" % n)
+            if self.options.bin and not batched: constraints.flush()
+            if isGaussian:
                 r = "-4,4" if pdf == "shape" else "-7,7"
                 sig = 1.0;
                 for pn,pf in self.options.nuisancesToRescale:
@@ -290,6 +437,16 @@ class ModelBuilder(ModelBuilderBase):
                         sig = float(pf); sigscale = sig * (4 if pdf == "shape" else 7)
                         r = "-%g,%g" % (sigscale,sigscale)
                 sig = '%g' % sig
+                if batched:
+                    lo,hi = [float(v) for v in r.split(",")]
+                    x = constraints.add(n, lo, hi, float(sig), globalConstrained=nofloat)
+                    x.setVal(0)
+                    x.setError(1)
+                    globalobs.append("%s_In" % n)
+                    if self.options.optimizeBoundNuisances: x.setAttribute("optimizeBounds")
+                    if nofloat: x.setAttribute("globalConstrained",True)
+                    if n in self.DC.frozenNuisances: x.setConstant(True)
+                    continue
                 if is_func_scaled:
                     sig = func_scaler
                 r_exp = "" if self.out.var(n) else "[%s]"%r # Specify range to invoke factory to produce a RooRealVar only if it doesn't already exist
@@ -326,23 +483,8 @@ class ModelBuilder(ModelBuilderBase):
                     self.doObj("%s_Pdf" % n, "Poisson", "%s_In[%d,0,%d], %s[0,%d], 1" % (n,args[0],2*args[0]+5,n,2*args[0]+5))
                 else:
                     # new version, that creates a poisson with a narrower range (but still +/- 7 sigmas)
-                    #print "Searching for bounds for",n,"poisson with obs",args[0]
-                    minExp = args[0]+1 if args[0] > 0 else 0;
-                    while (ROOT.TMath.Poisson(args[0], minExp) > 1e-12) and minExp > 0:
-                        #print "Poisson(%d, minExp = %f) = %g > 1e-12" % (args[0], minExp, ROOT.TMath.Poisson(args[0], minExp))
-                        minExp *= 0.8;
-                    maxExp = args[0]+1;
-                    while (ROOT.TMath.Poisson(args[0], maxExp) > 1e-12):
-                        #print "Poisson(%d, maxExp = %f) = %g > 1e-12" % (args[0], maxExp, ROOT.TMath.Poisson(args[0], maxExp))
-                        maxExp *= 1.2;
-                    minObs = args[0];
-                    while minObs > 0 and (ROOT.TMath.Poisson(minObs, args[0]+1) > 1e-12):
-                        #print "Poisson(minObs = %d, %f) = %g > 1e-12" % (minObs, args[0]+1, ROOT.TMath.Poisson(minObs, args[0]+1))
-                        minObs -= (sqrt(args[0]) if args[0] > 10 else 1);
-                    maxObs = args[0]+2;
-                    while (ROOT.TMath.Poisson(maxObs, args[0]+1) > 1e-12):
-                        #print "Poisson(maxObs = %d, %f) = %g > 1e-12" % (maxObs, args[0]+1, ROOT.TMath.Poisson(maxObs, args[0]+1))
-                        maxObs += (sqrt(args[0]) if args[0] > 10 else 2);
+                    minExp, maxExp = self.poissonRanges.expRange(args[0])
+                    minObs, maxObs = self.poissonRanges.obsRange(args[0])
                     self.doObj("%s_Pdf" % n, "Poisson", "%s_In[%d,%f,%f], %s[%f,%f,%f], 1" % (n,args[0],minObs,maxObs,n,args[0]+1,minExp,maxExp))
                 globalobs.append("%s_In" % n)
                 if self.options.bin: self.out.var("%s_In" % n).setConstant(True)
@@ -456,11 +598,14 @@ class ModelBuilder(ModelBuilderBase):
             if n in self.DC.frozenNuisances:
                 self.out.var(n).setConstant(True)
         if self.options.bin:
+            constraints.flush()
             nuisPdfs = ROOT.RooArgList()
             nuisVars = ROOT.RooArgSet()
             for (n,nf,p,a,e) in self.DC.systs:
                 nuisVars.add(self.out.var(n))
-                nuisPdfs.add(self.out.pdf(n+"_Pdf"))
+                if n not in constraints.blocked: nuisPdfs.add(self.out.pdf(n+"_Pdf"))
+            block = constraints.makeBlock()
+            if block: nuisPdfs.add(block)
             self.out.defineSet("nuisances", nuisVars)
             self.out.nuisPdf = ROOT.RooProdPdf("nuisancePdf", "nuisancePdf", nuisPdfs)
             self.out._import(self.out.nuisPdf)
@@ -544,42 +689,40 @@ class ModelBuilder(ModelBuilderBase):
 		    if self.out.arg(argu): factors.append(argu)
 		    else: raise RuntimeError, "No rate parameter found %s, are you sure you defined it correctly in the datacard?"%(argu)
                 selfNormRate = 1.0
-                for (n,nofloat,pdf,args,errline) in self.DC.systs:
-                    if pdf == "param":continue
-                    if pdf == "rateParam":continue
-                    if not errline[b].has_key(p): continue
-                    if errline[b][p] == 0.0: continue
+                for (n,nofloat,pdf,args,value) in self.DC.nuisanceEffects.effects(b,p): # only the non-null effects on this bin and process
                     if pdf.startswith("shape") and pdf.endswith("?"): # might be a lnN in disguise
                         if not self.isShapeSystematic(b,p,n): pdf = "lnN"
                     if pdf.startswith("shape"): continue
-                    if pdf == "lnN" and errline[b][p] == 1.0: continue
+                    if pdf == "lnN" and value == 1.0: continue
                     if pdf == "lnN" or pdf == "lnU":
-                        if type(errline[b][p]) == list:
-                            elow, ehigh = errline[b][p];
+                        if type(value) == list:
+                            elow, ehigh = value;
                             alogNorms.append((elow, ehigh, n))
                         else:
-                            logNorms.append((errline[b][p], n))
+                            logNorms.append((value, n))
                     elif pdf == "gmM":
                         factors.append(n)
                     elif pdf == "trG" or pdf == "unif" or pdf == "dFD" or pdf == "dFD2":
                         myname = "n_exp_shift_bin%s_proc_%s_%s" % (b,p,n)
-                        self.doObj(myname, ROOFIT_EXPR, "'1+%f*@0', %s" % (errline[b][p], n));
+                        self.doObj(myname, ROOFIT_EXPR, "'1+%f*@0', %s" % (value, n));
                         factors.append(myname)
                     elif pdf == "gmN":
                         factors.append(n)
-                        if abs(errline[b][p] * args[0] - self.DC.exp[b][p]) > max(0.05 * max(self.DC.exp[b][p],1), errline[b][p]):
+                        if abs(value * args[0] - self.DC.exp[b][p]) > max(0.05 * max(self.DC.exp[b][p],1), value):
                             raise RuntimeError, "Values of N = %d, alpha = %g don't match with expected rate %g for systematics %s " % (
-                                                    args[0], errline[b][p], self.DC.exp[b][p], n)
+                                                    args[0], value, self.DC.exp[b][p], n)
                         if gamma != None:
                             raise RuntimeError, "More than one gmN uncertainty for the same bin and process (second one is %s)" % n
-                        gamma = n; nominal = errline[b][p]; 
+                        gamma = n; nominal = value; 
                         # The case with N=0 isn't relevant if the process provides its own normalisation,
                         # so we don't need to do anything special to handle it here.
                         if args[0] > 0:
                             selfNormRate = selfNormRate / args[0]
                     else: raise RuntimeError, "Unsupported pdf %s" % pdf
+                # normalization effects of the shape systematics
+                shapeNorms = self.getShapeNormEffects(b,p) # (kappaLo, kappaHi, RooAbsReal) as in AsymPow
                 # optimize constants
-                if len(factors) + len(logNorms) + len(alogNorms) == 0:
+                if len(factors) + len(logNorms) + len(alogNorms) + len(shapeNorms) == 0:
                     norm = selfNormRate if b in self.selfNormBins else self.DC.exp[b][p]
                     self.doVar("n_exp_bin%s_proc_%s[%g]" % (b, p, norm))
                 else:
@@ -588,6 +731,7 @@ class ModelBuilder(ModelBuilderBase):
                     procNorm = ROOT.ProcessNormalization("n_exp_bin%s_proc_%s" % (b,p), "", norm)
                     for kappa, thetaName in logNorms: procNorm.addLogNormal(kappa, self.out.function(thetaName))
                     for kappaLo, kappaHi, thetaName in alogNorms: procNorm.addAsymmLogNormal(kappaLo, kappaHi, self.out.function(thetaName))
+                    for kappaLo, kappaHi, thetaName in shapeNorms: procNorm.addAsymmLogNormal(kappaLo, kappaHi, self.out.function(thetaName), True)
                     for factorName in factors:
 		    	if self.out.function(factorName): procNorm.addOtherFactor(self.out.function(factorName))
 			else: procNorm.addOtherFactor(self.out.var(factorName))
@@ -628,15 +772,40 @@ class ModelBuilder(ModelBuilderBase):
                 mc.SetGlobalObservables(gObsSet)
             if self.options.verbose > 2: mc.Print("V")
             self.out._import(mc, mc.GetName())
-            if self.options.noBOnly: break
+            if self.options.noBOnly and (self.doModelBOnly or not self.options.lazyBOnly): break
+        if self.options.lazyBOnly and self.doModelBOnly:
+            self.doSignalYieldsSet()
         discparams = ROOT.RooArgSet("discreteParams")
         for cpar in self.discrete_param_set:
                 roocpar =  self.out.cat(cpar)
                 discparams.add(self.out.cat(cpar))
         self.out._import(discparams,discparams.GetName())
+    def writeModel(self):
+        """write the workspace (and the channels kept out of it) to the output file"""
         self.out.writeToFile(self.options.out)
+        if self.lazyChannels: self.writeLazyChannels()
+    def writeLazyChannels(self):
+        """write the workspace of each channel kept out of the model to the directory channels/<channel> of the output file"""
+        fout = ROOT.TFile.Open(self.options.out, "UPDATE")
+        top = fout.mkdir("channels")
+        for (b, channel) in self.lazyChannels:
+            top.mkdir(b).WriteTObject(channel, "channel")
+        fout.Close()
+        if self.options.verbose: stderr.write("Wrote %d channels to their own directories of %s\n" % (len(self.lazyChannels), self.options.out))
+    def doSignalYieldsSet(self):
+        """save the set of the signal yields of all channels: combine builds the background-only model setting them to zero"""
+        yields = ROOT.RooArgSet()
+        for b in self.DC.bins:
+            for p in self.DC.exp[b].keys():
+                if not self.DC.isSignal[p]: continue
+                # n_exp_final_bin<X>_proc_<Y> (if any) is a product with this term, so it becomes zero as well
+                arg = self.out.function("n_exp_bin%s_proc_%s" % (b,p))
+                if arg: yields.add(arg)
+        self.out.defineSet("signalYields", yields)
     def isShapeSystematic(self,channel,process,syst):
         return False
+    def getShapeNormEffects(self,channel,process):
+        return []
 
 class CountingModelBuilder(ModelBuilder):
     """ModelBuilder to make a counting experiment"""
@@ -662,28 +831,54 @@ class CountingModelBuilder(ModelBuilder):
                 self.out.data_obs = ROOT.RooDataSet(self.options.dataname,"observed data", self.out.set("observables"))
                 self.out.data_obs.add( self.out.set("observables") )
                 self.out._import(self.out.data_obs)
+    def useCountingPdf(self):
+        """all the bins are modelled by a single CMSCountingPdf instead of a product of one Poisson per bin (--X-counting-pdf)"""
+        return self.options.bin and self.options.countingPdf
     def doIndividualModels(self):
+        if self.useCountingPdf(): return # all the bins are made at once in doCombination
         self.doComment(" --- Expected events in each bin, total (S+B and B) ----")
         for b in self.DC.bins:
-            self.doObj("n_exp_bin%s_bonly" % b, "sum", ", ".join(["n_exp_bin%s_proc_%s" % (b,p) for p in self.DC.exp[b].keys() if self.DC.isSignal[p] == False]) )
+            if not self.options.lazyBOnly: self.doObj("n_exp_bin%s_bonly" % b, "sum", ", ".join(["n_exp_bin%s_proc_%s" % (b,p) for p in self.DC.exp[b].keys() if self.DC.isSignal[p] == False]) )
             self.doObj("n_exp_bin%s"       % b, "sum", ", ".join(["n_exp_bin%s_proc_%s" % (b,p) for p in self.DC.exp[b].keys()                        ]) )
             self.doObj("pdf_bin%s"       % b, "Poisson", "n_obs_bin%s, n_exp_bin%s, 1"       % (b,b))
-            self.doObj("pdf_bin%s_bonly" % b, "Poisson", "n_obs_bin%s, n_exp_bin%s_bonly, 1" % (b,b))
+            if not self.options.lazyBOnly: self.doObj("pdf_bin%s_bonly" % b, "Poisson", "n_obs_bin%s, n_exp_bin%s_bonly, 1" % (b,b))
     def doCombination(self):
         prefix = "modelObs" if len(self.DC.systs) else "model" # if no systematics, we build directly the model
         nbins = len(self.DC.bins)
-        if nbins > 50:
+        if self.useCountingPdf():
+            stderr.write("Modelling the %d bins with a single CMSCountingPdf (--X-counting-pdf)\n" % nbins)
+            self.doCountingPdf("%s_s" % prefix, True)
+            if not self.options.lazyBOnly: self.doCountingPdf("%s_b" % prefix, False)
+        elif nbins > 50:
             from math import ceil
             nblocks = int(ceil(nbins/10.))
             for i in range(nblocks):
                 self.doObj("%s_s_%d" % (prefix,i), "PROD", ",".join(["pdf_bin%s"       % self.DC.bins[j] for j in range(10*i,min(nbins,10*i+10))]))
-                self.doObj("%s_b_%d" % (prefix,i), "PROD", ",".join(["pdf_bin%s_bonly" % self.DC.bins[j] for j in range(10*i,min(nbins,10*i+10))]))
+                if not self.options.lazyBOnly: self.doObj("%s_b_%d" % (prefix,i), "PROD", ",".join(["pdf_bin%s_bonly" % self.DC.bins[j] for j in range(10*i,min(nbins,10*i+10))]))
             self.doObj("%s_s" % prefix, "PROD", ",".join([prefix+"_s_%d" % i for i in range(nblocks)]))
-            self.doObj("%s_b" % prefix, "PROD", ",".join([prefix+"_b_%d" % i for i in range(nblocks)]))
+            if not self.options.lazyBOnly: self.doObj("%s_b" % prefix, "PROD", ",".join([prefix+"_b_%d" % i for i in range(nblocks)]))
         else:
             self.doObj("%s_s" % prefix, "PROD", ",".join(["pdf_bin%s"       % b for b in self.DC.bins]))
-            self.doObj("%s_b" % prefix, "PROD", ",".join(["pdf_bin%s_bonly" % b for b in self.DC.bins]))
-        if len(self.DC.systs): # multiply by nuisances if needed
+            if not self.options.lazyBOnly: self.doObj("%s_b" % prefix, "PROD", ",".join(["pdf_bin%s_bonly" % b for b in self.DC.bins]))
+        if len(self.DC.systs) and self.useCountingPdf(): # a RooProdPdf would underflow taking the log of the product
+            self.doLogProdPdf("model_s", [ "modelObs_s", "nuisancePdf" ])
+            if not self.options.lazyBOnly: self.doLogProdPdf("model_b", [ "modelObs_b", "nuisancePdf" ])
+        elif len(self.DC.systs): # multiply by nuisances if needed
             self.doObj("model_s", "PROD", "modelObs_s, nuisancePdf")
-            self.doObj("model_b", "PROD", "modelObs_b, nuisancePdf")
+            if not self.options.lazyBOnly: self.doObj("model_b", "PROD", "modelObs_b, nuisancePdf")
+    def doLogProdPdf(self,name,factors):
+        pdfs = ROOT.RooArgList()
+        for f in factors: pdfs.add(self.out.pdf(f))
+        self.out._import(ROOT.CMSLogProdPdf(name, "", pdfs), ROOT.RooFit.RecycleConflictNodes(), ROOT.RooFit.Silence())
+    def doCountingPdf(self,name,withSignal):
+        """make the CMSCountingPdf of all the bins, summing the expected yields of the processes (only the backgrounds if not withSignal)"""
+        obs = ROOT.RooArgList(); yields = ROOT.RooArgList(); bins = ROOT.std.vector('int')()
+        for i,b in enumerate(self.DC.bins):
+            obs.add(self.out.var("n_obs_bin%s" % b))
+            for p in self.DC.exp[b].keys():
+                if self.DC.isSignal[p] and not withSignal: continue
+                yields.add(self.out.arg("n_exp_bin%s_proc_%s" % (b,p)))
+                bins.push_back(i)
+        pdf = ROOT.CMSCountingPdf(name, "", obs, yields, bins)
+        self.out._import(pdf, ROOT.RooFit.RecycleConflictNodes(), ROOT.RooFit.Silence())
 
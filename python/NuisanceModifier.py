@@ -1,6 +1,7 @@
 import re
 import sys
 from math import log,exp,hypot
+from HiggsAnalysis.CombinedLimit.Datacard import SparseErrline
 
 def quadratureAdd(pdf, val1, val2, context=None):
     if type(val1) == list and len(val1) != 2: raise RuntimeError("{} is a list of length != 2".format(val1))
@@ -20,21 +21,25 @@ def quadratureAdd(pdf, val1, val2, context=None):
     else:
         raise RuntimeError, "Quadrature add not implemented for pdf %s (at %s)" % (pdf, context)
 
+def newErrline(datacard):
+    if datacard.systMatrix is not None: return datacard.systMatrix.addRow()
+    return SparseErrline(datacard.bins)
+
 def doAddNuisance(datacard, args):
     if len(args) < 5:
         raise RuntimeError, "Missing arguments: the syntax is: nuisance edit add process channel name pdf value [ options ]"
     (process, channel, name, pdf, value) = args[:5]
-    if process != "*": cprocess = re.compile(process)
-    if channel != "*": cchannel = re.compile(channel.replace("+","\+"))
+    if process != "*": procs = datacard.namePatterns.processSet(process)
+    if channel != "*": bins = datacard.namePatterns.binSet(channel.replace("+","\+"))
     opts = args[5:]
     found = False
-    errline = dict([(b,dict([(p,0) for p in datacard.exp[b]])) for b in datacard.bins])
     for lsyst,nofloat,pdf0,args0,errline0 in datacard.systs:
         if lsyst == name:
             if pdf != pdf0: raise RuntimeError, "Can't add nuisance %s with pdf %s ad it already exists as %s" % (name,pdf,pdf0)
             found = True
             errline = errline0
     if not found:
+        errline = newErrline(datacard)
         datacard.systs.append([name,False,pdf,[],errline])
     if isinstance(value, (int, float, list)):
         pass
@@ -44,10 +49,10 @@ def doAddNuisance(datacard, args):
         value = float(value)
     foundChann, foundProc = False, False
     for b in errline.keys():
-        if channel == "*" or cchannel.search(b):
+        if channel == "*" or b in bins:
             foundChann = True
             for p in datacard.exp[b]:
-                if process == "*" or cprocess.search(p):
+                if process == "*" or p in procs:
                     foundProc = True
                     if value in [ 0.0, 1.0 ]:
                         pass   #do nothing, there's nothing to add
@@ -69,17 +74,17 @@ def doDropNuisance(datacard, args):
     if len(args) < 3:
         raise RuntimeError, "Missing arguments: the syntax is: nuisance edit drop process channel name [ options ]"
     (process, channel, name) = args[:3]
-    if process != "*": cprocess = re.compile(process)
-    if channel != "*": cchannel = re.compile(channel.replace("+","\+"))
+    if process != "*": procs = datacard.namePatterns.processSet(process)
+    if channel != "*": bins = datacard.namePatterns.binSet(channel.replace("+","\+"))
     opts = args[3:]
     foundProc = False
     for lsyst,nofloat,pdf,args0,errline in datacard.systs:
         if re.match(name,lsyst):
             for b in errline.keys():
-                if channel == "*" or cchannel.search(b):
+                if channel == "*" or b in bins:
                     #if channel != "*": foundProc = False
                     for p in datacard.exp[b]:
-                        if process == "*" or cprocess.search(p):
+                        if process == "*" or p in procs:
                             foundProc = True
                             errline[b][p] = 0
             #if channel != "*" and foundProc == False:
@@ -121,8 +126,8 @@ def doRenameNuisance(datacard, args):
     if len(args) < 4:
         raise RuntimeError, "Missing arguments: the syntax is: nuisance edit rename process channel oldname newname"
     (process, channel, oldname, newname) = args[:4]
-    if process != "*": cprocess = re.compile(process)
-    if channel != "*": cchannel = re.compile(channel.replace("+","\+"))
+    if process != "*": procs = datacard.namePatterns.processSet(process, "match")
+    if channel != "*": bins = datacard.namePatterns.binSet(channel.replace("+","\+"), "match")
     opts = args[4:]
     foundChann, foundProc = False, False
     for lsyst,nofloat,pdf0,args0,errline0 in datacard.systs[:]:
@@ -130,20 +135,20 @@ def doRenameNuisance(datacard, args):
         lsystnew = re.sub(oldname,newname,lsyst)
         if lsystnew != lsyst:
             found = False
-            errline2 = dict([(b,dict([(p,0) for p in datacard.exp[b]])) for b in datacard.bins])
             for lsyst2,nofloat2,pdf2,args2,errline2b in datacard.systs:
                 if lsyst2 == lsystnew:
                     found = True
                     errline2 = errline2b
                     if pdf2 != pdf0 and pdf2 not in ['lnN']: raise RuntimeError, "Can't rename nuisance %s with pdf %s to name %s which already exists as %s" % (lsyst,pdf0,lsystnew,pdf2)
             if not found:
+                errline2 = newErrline(datacard)
                 datacard.systs.append([lsystnew,nofloat,pdf0,args0,errline2])
             for b in errline0.keys():
-                if channel == "*" or cchannel.match(b):
+                if channel == "*" or b in bins:
                     foundChann = True
                     if channel != "*": foundProc = False
                     for p in datacard.exp[b].keys():
-                        if process == "*" or cprocess.match(p):
+                        if process == "*" or p in procs:
                             foundProc = True
                             if errline0[b][p] in [0.0]:
                                 continue
@@ -210,17 +215,17 @@ def doMergeNuisance(datacard, args):
     if len(args) < 4:
         raise RuntimeError("Missing arguments: the syntax is: nuisance edit merge process channel name1 name2 [ options ]")
     (process, channel, name1, name2) = args[:4]
-    if process != "*": cprocess = re.compile(process)
-    if channel != "*": cchannel = re.compile(channel.replace("+","\+"))
+    if process != "*": procs = datacard.namePatterns.processSet(process)
+    if channel != "*": bins = datacard.namePatterns.binSet(channel.replace("+","\+"))
     opts = args[4:]
     foundProc = False
 
     for lsyst2,nofloat2,pdf2,args02,errline2 in datacard.systs:
         if re.match(name2, lsyst2):
             for b in errline2.keys():
-                if channel == "*" or cchannel.search(b):
+                if channel == "*" or b in bins:
                     for p in datacard.exp[b]:
-                        if process == "*" or cprocess.search(p):
+                        if process == "*" or p in procs:
                             foundProc = True
                             doAddNuisance(datacard, [p+"$", b+"$", name1, pdf2, errline2[b][p], "addq"])
                             errline2[b][p] = 0
@@ -236,16 +241,16 @@ def doSplitNuisance(datacard, args):
     if len(args) < 7:
         raise RuntimeError, "Missing arguments: the syntax is: nuisance edit split process channel oldname newname1 newname2 value1 value2"
     (process, channel, oldname, newname1, newname2, value1, value2) = args[:7]
-    if process != "*": cprocess = re.compile(process)
-    if channel != "*": cchannel = re.compile(channel.replace("+","\+"))
+    if process != "*": procs = datacard.namePatterns.processSet(process)
+    if channel != "*": bins = datacard.namePatterns.binSet(channel.replace("+","\+"))
     opts = args[7:]
     foundProc = False
     for lsyst,nofloat,pdf,args0,errline in datacard.systs:
         if re.match(oldname,lsyst):
             for b in errline.keys():
-                if channel == "*" or cchannel.search(b):
+                if channel == "*" or b in bins:
                     for p in datacard.exp[b]:
-                        if process == "*" or cprocess.search(p):
+                        if process == "*" or p in procs:
                             foundProc = True
                             if errline[b][p] not in [0., 1.]:
                                 doAddNuisance(datacard, [p, b, newname1, pdf, value1, "overwrite"])
@@ -289,8 +294,8 @@ def doFlipNuisance(datacard,args):
     if len(args) < 3:
         raise RuntimeError, "Missing arguments: the syntax is: nuisance edit flip process channel name [options: ifexists, p2n (only positive to negative), n2p (only negative to positive)]"
     (process, channel, name) = args[:3]
-    if process != "*": cprocess = re.compile(process)
-    if channel != "*": cchannel = re.compile(channel.replace("+","\+"))
+    if process != "*": procs = datacard.namePatterns.processSet(process)
+    if channel != "*": bins = datacard.namePatterns.binSet(channel.replace("+","\+"))
     opts = args[3:]
     if "n2p" not in opts and "p2n" not in opts:
         raise RuntimeError, "Error: nuisance edit flip %s missed option n2p and/or p2n" % (args)
@@ -300,9 +305,9 @@ def doFlipNuisance(datacard,args):
             if pdf not in ["lnN"]:
                 raise RuntimeError, "Error: nuisance edit flip %s currently not support pdftype %s" % (args,pdf)
             for b in errline.keys():
-                if channel == "*" or cchannel.search(b):
+                if channel == "*" or b in bins:
                     for p in datacard.exp[b]:
-                        if process == "*" or cprocess.search(p):
+                        if process == "*" or p in procs:
                             foundProc = True
                             if errline[b][p] not in [0., 1.]:
                                 if type(errline[b][p]) is list:
@@ -345,4 +350,5 @@ def doEditNuisance(datacard, command, args):
         doFlipNuisance(datacard, args)
     else:
         raise RuntimeError, "Error, unknown nuisance edit command %s (args %s)" % (command, args)
+    datacard.nuisanceEffects.reset()
         
@@ -1,6 +1,10 @@
 from sys import stdout, stderr
 import os.path
 import ROOT
+try:
+    import numpy
+except ImportError:
+    numpy = None # the templates are then read and copied bin by bin
 from math import *
 
 RooArgSet_add_original = ROOT.RooArgSet.add
@@ -11,7 +15,121 @@ def RooArgSet_add_patched(self, obj, *args, **kwargs):
         return RooArgSet_add_original(self, obj, *args, **kwargs)
 ROOT.RooArgSet.add = RooArgSet_add_patched
 
-from HiggsAnalysis.CombinedLimit.ModelTools import ModelBuilder
+from HiggsAnalysis.CombinedLimit.ModelTools import ModelBuilder, SafeWorkspaceImporter, GaussianConstraintBatch
+
+class LRUCache():
+    """Cache of bounded total size that drops the least recently used entries when full.
+       The size of each entry is given by sizeof (1 by default, i.e. the bound is on the number of entries);
+       entries with size None, or pinned explicitly, are never dropped. A maxSize <= 0 means no bound.
+       Dropped values are passed to onEvict; the values themselves stay valid for whoever still holds them."""
+    def __init__(self, name, maxSize=0, sizeof=None, onEvict=None):
+        from collections import OrderedDict
+        self.name = name
+        self.maxSize = maxSize
+        self.sizeof = sizeof if sizeof else (lambda value : 1)
+        self.onEvict = onEvict
+        self._entries = OrderedDict() # key -> (value, size), from the least to the most recently used
+        self._pinned = {}
+        self.size = 0
+        self.hits = 0; self.misses = 0; self.evictions = 0
+    def __contains__(self, key):
+        return key in self._entries or key in self._pinned
+    def get(self, key):
+        """Return the value for key (and mark it as the most recently used), or None if it is not in the cache"""
+        if key in self._pinned:
+            self.hits += 1
+            return self._pinned[key]
+        if key in self._entries:
+            self.hits += 1
+            entry = self._entries.pop(key)
+            self._entries[key] = entry
+            return entry[0]
+        self.misses += 1
+        return None
+    def __setitem__(self, key, value):
+        if key in self: self.discard(key)
+        size = self.sizeof(value)
+        if size == None:
+            self._pinned[key] = value
+            return
+        self._entries[key] = (value, size)
+        self.size += size
+        while self.maxSize > 0 and self.size > self.maxSize and len(self._entries) > 1:
+            (oldkey, (oldvalue, oldsize)) = self._entries.popitem(last=False)
+            self.size -= oldsize
+            self.evictions += 1
+            if self.onEvict: self.onEvict(oldvalue)
+    def discard(self, key):
+        if key in self._pinned: del self._pinned[key]
+        elif key in self._entries: self.size -= self._entries.pop(key)[1]
+    def pin(self, key):
+        """Never drop the entry for key from now on"""
+        if key in self._entries:
+            (value, size) = self._entries.pop(key)
+            self.size -= size
+            self._pinned[key] = value
+    def __len__(self):
+        return len(self._entries) + len(self._pinned)
+    def stats(self):
+        return "%s: %d entries (%d pinned), %d hits, %d misses, %d evictions" % (self.name, len(self), len(self._pinned), self.hits, self.misses, self.evictions)
+
+def _closeShapeFile(file):
+    if file: file.Close()
+
+def _shapeBytes(shape):
+    """Approximate memory used by a template (TH1 contents and errors); None for the other objects, which are kept"""
+    if not shape or not shape.InheritsFrom("TH1"): return None
+    return 8 * shape.GetNcells() * (2 if shape.GetSumw2N() else 1)
+
+## caches of ShapeBuilder.getShape: open files, and shapes by (channel, process, syst); their bounds are set from the options
+_shapeFileCache = LRUCache("shape files", onEvict=_closeShapeFile)
+_shapeCache = LRUCache("shapes", sizeof=_shapeBytes)
+
+## bump this whenever the way the channel models are built changes, to invalidate the entries of the model cache
+FRAGMENT_CACHE_VERSION = 4
+
+## builder whose channel models are made by the worker processes of ShapeBuilder.doIndividualModelsInParallel
+_channelModelBuilder = None
+
+def _writeChannelModelsJob((first, last, fname)):
+    return _channelModelBuilder.writeChannelModels(first, last, fname)
+
+def _readShapeObjects((fname, objnames)):
+    """Read the objects with the given names from a ROOT file, for ShapeBuilder.prefetchShapes (in a worker process)"""
+    ROOT.TH1.AddDirectory(False)
+    file = ROOT.TFile.Open(fname)
+    if not file: return []
+    ret = []
+    for objname in objnames:
+        obj = file.Get(objname)
+        if obj: ret.append((objname, obj))
+    file.Close()
+    return ret
+
+def _arrayView(buf, n, dtype):
+    """NumPy array on the first n elements of a C array returned by PyROOT, without copying them"""
+    if hasattr(buf, "SetSize"): buf.SetSize(n)
+    else: buf.reshape((n,))
+    return numpy.frombuffer(buf, dtype=dtype, count=n)
+
+def th1Contents(h):
+    """Zero-copy NumPy view of the contents of all the bins of a TH1, including underflow and overflow.
+       The array of a TProfile holds the sums of the values rather than the bin contents, so these are read bin by bin."""
+    if h.InheritsFrom("TProfile"): return numpy.array([ h.GetBinContent(i) for i in xrange(h.GetNcells()) ])
+    for (cls, dtype) in (("TH1D","f8"), ("TH1F","f4"), ("TH1I","i4"), ("TH1S","i2"), ("TH1C","i1")):
+        if h.InheritsFrom(cls): return _arrayView(h.GetArray(), h.GetNcells(), dtype)
+    raise RuntimeError, "Unsupported histogram class %s for %s" % (h.ClassName(), h.GetName())
+
+def th1Errors(h):
+    """Errors of all the bins of a TH1, including underflow and overflow, as TH1::GetBinError gives them"""
+    if h.GetBinErrorOption() != ROOT.TH1.kNormal or h.InheritsFrom("TProfile"): return numpy.array([ h.GetBinError(i) for i in xrange(h.GetNcells()) ])
+    if h.GetSumw2N(): return numpy.sqrt(_arrayView(h.GetSumw2().GetArray(), h.GetNcells(), "f8"))
+    return numpy.sqrt(numpy.abs(th1Contents(h).astype("f8")))
+
+def th1FilledBins(h):
+    """Bins 1..GetNbinsX() of a TH1 with a positive content"""
+    if numpy is None: return [ i for i in xrange(1, h.GetNbinsX()+1) if h.GetBinContent(i) > 0 ]
+    return (numpy.flatnonzero(th1Contents(h)[1:h.GetNbinsX()+1] > 0) + 1).tolist()
 
 class ShapeBuilder(ModelBuilder):
     def __init__(self,datacard,options):
@@ -23,11 +141,24 @@ class ShapeBuilder(ModelBuilder):
                 ROOT.gSystem.Load(lib)
     	self.wspnames = {}
     	self.wsp = None
+        _shapeFileCache.maxSize = getattr(options, "shapeFileCacheSize", 0)
+        _shapeCache.maxSize = getattr(options, "shapeCacheMB", 0) * 1024 * 1024
     	self.extraImports = []
 	self.norm_rename_map = {}
+        self.fragments = None # staging workspace of the channel models taken from the model cache
+        self.fileDigests = None # {path : [size, mtime, md5]} of the shape files, read from the model cache when first needed
+        if getattr(options, "lazyChannels", False) and options.lazyBOnly:
+            # combine can't set to zero the signal yields inside the channels it has not read, so the background-only model is built here
+            stderr.write("Warning: --X-lazy-b-only is ignored with --X-lazy-channels, the background-only model is saved in the workspace\n")
+            options.lazyBOnly = False
+            options.noBOnly = False
     ## ------------------------------------------
     ## -------- ModelBuilder interface ----------
     ## ------------------------------------------
+    def doModel(self):
+        ModelBuilder.doModel(self)
+        if self.options.verbose > 0:
+            for cache in _shapeFileCache, _shapeCache: stderr.write("Cache of %s\n" % cache.stats())
     def doObservables(self):
         if (self.options.verbose > 2): stderr.write("Using shapes: qui si parra' la tua nobilitate\n")
         self.prepareAllShapes();
@@ -47,108 +178,22 @@ class ShapeBuilder(ModelBuilder):
         self.doSet("observables",self.out.obs)
         if len(self.DC.obs) != 0: 
             self.doCombinedDataset()
-    def doIndividualModels(self):
+    def doIndividualModels(self,channels=None):
+        """create pdf_bin<X> and pdf_bin<X>_bonly for each bin (or for the given (index, bin) channels only)"""
+        lazyChannels = getattr(self.options, "lazyChannels", False) and self.options.bin
+        if channels == None and getattr(self.options, "modelJobs", 1) > 1 and len(self.DC.bins) > 1 and not lazyChannels:
+            return self.doIndividualModelsInParallel(self.options.modelJobs)
         if self.options.verbose:
             stderr.write("Creating pdfs for individual modes (%d): " % len(self.DC.bins));
             stderr.flush()
-        for i,b in enumerate(self.DC.bins):
-            #print "  + Getting model for bin %s" % (b)
-            pdfs   = ROOT.RooArgList(); bgpdfs   = ROOT.RooArgList()
-            coeffs = ROOT.RooArgList(); bgcoeffs = ROOT.RooArgList()
-            sigcoeffs = []
-            binconstraints = ROOT.RooArgList()
-            bbb_args = None
-            channelBinParFlag = b in self.DC.binParFlags.keys()
-            if channelBinParFlag:
-                print 'Channel %s will use autoMCStats with settings: event-threshold=%g, include-signal=%i, hist-mode=%i' % ((b,)+self.DC.binParFlags[b])
-            for p in self.DC.exp[b].keys(): # so that we get only self.DC.processes contributing to this bin
-                if self.DC.exp[b][p] == 0: continue
-                if self.physics.getYieldScale(b,p) == 0: continue # exclude really the pdf
-                #print "  +--- Getting pdf for %s in bin %s" % (p,b)
-                (pdf,coeff) = (self.getPdf(b,p), self.out.function("n_exp_bin%s_proc_%s" % (b,p)))
-                if self.options.optimizeExistingTemplates:
-                    pdf1 = self.optimizeExistingTemplates(pdf)
-                    if (pdf1 != pdf):
-                        self.out.dont_delete.append(pdf1)
-                        pdf = pdf1
-                extranorm = self.getExtraNorm(b,p)
-                if extranorm:
-                    prodset = ROOT.RooArgList(self.out.function("n_exp_bin%s_proc_%s" % (b,p)))
-                    for X in extranorm:
-                    	# X might already be in the workspace (e.g. _norm term)...
-                    	if self.out.function(X):
-                    		prodset.add(self.out.function(X))
-                    	# ... but usually it's only in our object store (e.g. AsymPow for shape systs)
-                    	else:
-                    		prodset.add(self.getObj(X))
-                    coeff = self.addObj(ROOT.RooProduct, "n_exp_final_bin%s_proc_%s" % (b,p), "", prodset)
-                pdf.setStringAttribute("combine.process", p)
-                pdf.setStringAttribute("combine.channel", b)
-                pdf.setAttribute("combine.signal", self.DC.isSignal[p])
-                if channelBinParFlag and self.DC.isSignal[p] and not self.DC.binParFlags[b][1]:
-                    pdf.setAttribute('skipForErrorSum')
-                coeff.setStringAttribute("combine.process", p)
-                coeff.setStringAttribute("combine.channel", b)
-                coeff.setAttribute("combine.signal", self.DC.isSignal[p])
-                pdfs.add(pdf); coeffs.add(coeff)
-                if not self.DC.isSignal[p]:
-                    bgpdfs.add(pdf); bgcoeffs.add(coeff)
-                else:
-                    sigcoeffs.append(coeff)
-            if self.options.verbose > 1: print "Creating RooAddPdf %s with %s elements" % ("pdf_bin"+b, coeffs.getSize())
-            if channelBinParFlag: 
-                prop = self.addObj(ROOT.CMSHistErrorPropagator, "prop_bin%s" % b, "", pdfs.at(0).getXVar(), pdfs, coeffs)
-                prop.setAttribute('CachingPdf_Direct', True)
-                if self.DC.binParFlags[b][0] >= 0.:
-                    bbb_args = prop.setupBinPars(self.DC.binParFlags[b][0])
-                    for bidx in range(bbb_args.getSize()):
-                        arg = bbb_args.at(bidx)
-                        n = arg.GetName()
-                        parname = n
-                        self.out._import(arg)
-                        if arg.getAttribute("createGaussianConstraint"):
-                            self.doObj("%s_Pdf" % n, "SimpleGaussianConstraint", "%s, %s_In[0,%s], %s" % (n, n, '-7,7', '1.0'), True)
-                            self.out.var(n).setVal(0)
-                            self.out.var(n).setError(1)
-                            if self.options.optimizeBoundNuisances: self.out.var(n).setAttribute("optimizeBounds")
-                        elif arg.getAttribute("createPoissonConstraint"):
-                            nom = arg.getVal()
-                            pval = ROOT.Math.normal_cdf_c(7)
-                            minObs = nom
-                            while minObs > 0 and (ROOT.TMath.Poisson(minObs, nom + 1) > pval):
-                                minObs -= (sqrt(nom) if nom > 10 else 1)
-                            maxObs = nom + 2
-                            while (ROOT.TMath.Poisson(maxObs, nom + 1) > pval):
-                                #print "Poisson(maxObs = %d, %f) = %g > 1e-12" % (maxObs, args[0]+1, ROOT.TMath.Poisson(maxObs, args[0]+1))
-                                maxObs += (sqrt(nom) if nom > 10 else 2)
-                            self.doObj("%s_Pdf" % n, "Poisson", "%s_In[%d,%f,%f], %s, 1" % (n, nom, minObs, maxObs, n))
-                            if n.endswith('_prod'):
-                                parname = n[:-5]
-                        binconstraints.add(self.out.pdf('%s_Pdf' % n))
-                        self.out.var("%s_In" % n).setConstant(True)
-                        self.extraNuisances.append(self.out.var("%s" % parname))
-                        self.extraGlobalObservables.append(self.out.var("%s_In" % n))
-                if not self.out.var('ONE'):
-                    self.doVar('ONE[1.0]')
-                sum_s = self.addObj(ROOT.RooRealSumPdf, "pdf_bin%s"       % b,  "", ROOT.RooArgList(prop),   ROOT.RooArgList(self.out.var('ONE')), True)
-                if not self.options.noBOnly:
-                    if not self.out.var('ZERO'):
-                        self.doVar('ZERO[0.0]')
-                    customizer = ROOT.RooCustomizer(prop, "")
-                    for arg in sigcoeffs:
-                        customizer.replaceArg(arg, self.out.var('ZERO'))
-                    prop_b = customizer.build(True)
-                    if len(sigcoeffs):
-                        prop_b.SetName("prop_bin%s_bonly" % b)
-                    self.objstore[prop_b.GetName()] = prop_b
-                    sum_b = self.addObj(ROOT.RooRealSumPdf, "pdf_bin%s_bonly"       % b,  "", ROOT.RooArgList(prop_b),   ROOT.RooArgList(self.out.var('ONE')), True)
-            else:
-                sum_s = self.addObj(ROOT.RooAddPdf,"pdf_bin%s"       % b,  "",  pdfs,   coeffs)
-                if not self.options.noBOnly: sum_b = self.addObj(ROOT.RooAddPdf, "pdf_bin%s_bonly" % b, "", bgpdfs, bgcoeffs)
+        for i,b in (enumerate(self.DC.bins) if channels == None else channels):
+            (sum_s, sum_b, binconstraints, wrappers) = self.getChannelSums(b)
             sum_s.setAttribute("MAIN_MEASUREMENT") # useful for plain ROOFIT optimization on ATLAS side
             if b in self.pdfModes: 
                 sum_s.setAttribute('forceGen'+self.pdfModes[b].title())
                 if not self.options.noBOnly: sum_b.setAttribute('forceGen'+self.pdfModes[b].title())
+            if lazyChannels and b not in self.DC.binParFlags.keys():
+                (sum_s, sum_b) = self.makeLazyChannel(b, sum_s, sum_b)
             addSyst = False
             if    self.options.moreOptimizeSimPdf == "none":   addSyst = True
             elif  self.options.moreOptimizeSimPdf == "lhchcg": addSyst = (i > 1)
@@ -191,15 +236,327 @@ class ShapeBuilder(ModelBuilder):
                     if i > 0: stderr.write("\b\b\b\b\b");
                     stderr.write(". %4d" % (i+1))
                     stderr.flush()
-            if channelBinParFlag and not self.options.noBOnly:
-                for idx in xrange(pdfs.getSize()):
-                    wrapper = ROOT.CMSHistFuncWrapper(pdfs[idx].GetName() + '_wrapper', '', pdfs.at(idx).getXVar(), pdfs.at(idx), prop, idx)
-                    wrapper.setStringAttribute("combine.process", pdfs.at(idx).getStringAttribute("combine.process"))
-                    wrapper.setStringAttribute("combine.channel", pdfs.at(idx).getStringAttribute("combine.channel"))
-                    self.extraImports.append(wrapper)
+            self.extraImports += wrappers
 
         if self.options.verbose:
             stderr.write("\b\b\b\bdone.\n"); stderr.flush()
+    def doChannelSums(self,b):
+        """build the sum over the processes of channel b (pdf_bin<b> and pdf_bin<b>_bonly, before the constraints are multiplied in),
+           returning them with the autoMCStats constraints of the channel and the wrappers to import for it"""
+        #print "  + Getting model for bin %s" % (b)
+        pdfs   = ROOT.RooArgList(); bgpdfs   = ROOT.RooArgList()
+        coeffs = ROOT.RooArgList(); bgcoeffs = ROOT.RooArgList()
+        sigcoeffs = []
+        binconstraints = ROOT.RooArgList()
+        bbb_args = None
+        channelBinParFlag = b in self.DC.binParFlags.keys()
+        if channelBinParFlag:
+            print 'Channel %s will use autoMCStats with settings: event-threshold=%g, include-signal=%i, hist-mode=%i' % ((b,)+self.DC.binParFlags[b])
+        for p in self.DC.exp[b].keys(): # so that we get only self.DC.processes contributing to this bin
+            if self.DC.exp[b][p] == 0: continue
+            if self.physics.getYieldScale(b,p) == 0: continue # exclude really the pdf
+            #print "  +--- Getting pdf for %s in bin %s" % (p,b)
+            (pdf,coeff) = (self.getPdf(b,p), self.out.function("n_exp_bin%s_proc_%s" % (b,p)))
+            if self.options.optimizeExistingTemplates:
+                pdf1 = self.optimizeExistingTemplates(pdf)
+                if (pdf1 != pdf):
+                    self.out.dont_delete.append(pdf1)
+                    pdf = pdf1
+            extranorm = self.getExtraNorm(b,p)
+            if extranorm:
+                prodset = ROOT.RooArgList(self.out.function("n_exp_bin%s_proc_%s" % (b,p)))
+                for X in extranorm:
+		    prodset.add(self.out.function(X))
+                coeff = self.addObj(ROOT.RooProduct, "n_exp_final_bin%s_proc_%s" % (b,p), "", prodset)
+            pdf.setStringAttribute("combine.process", p)
+            pdf.setStringAttribute("combine.channel", b)
+            pdf.setAttribute("combine.signal", self.DC.isSignal[p])
+            if channelBinParFlag and self.DC.isSignal[p] and not self.DC.binParFlags[b][1]:
+                pdf.setAttribute('skipForErrorSum')
+            coeff.setStringAttribute("combine.process", p)
+            coeff.setStringAttribute("combine.channel", b)
+            coeff.setAttribute("combine.signal", self.DC.isSignal[p])
+            pdfs.add(pdf); coeffs.add(coeff)
+            if not self.DC.isSignal[p]:
+                bgpdfs.add(pdf); bgcoeffs.add(coeff)
+            else:
+                sigcoeffs.append(coeff)
+        if self.options.verbose > 1: print "Creating RooAddPdf %s with %s elements" % ("pdf_bin"+b, coeffs.getSize())
+        if channelBinParFlag: 
+            prop = self.addObj(ROOT.CMSHistErrorPropagator, "prop_bin%s" % b, "", pdfs.at(0).getXVar(), pdfs, coeffs)
+            prop.setAttribute('CachingPdf_Direct', True)
+            if self.DC.binParFlags[b][0] >= 0.:
+                bbb_args = prop.setupBinPars(self.DC.binParFlags[b][0])
+                self.out._import(ROOT.RooArgSet(bbb_args))
+                constraints = GaussianConstraintBatch(self.out)
+                for bidx in range(bbb_args.getSize()):
+                    arg = bbb_args.at(bidx)
+                    n = arg.GetName()
+                    if arg.getAttribute("createGaussianConstraint"):
+                        if self.out.obj("%s_Pdf" % n): continue
+                        x = constraints.add(n, -7, 7)
+                        x.setVal(0)
+                        x.setError(1)
+                        if self.options.optimizeBoundNuisances: x.setAttribute("optimizeBounds")
+                    elif arg.getAttribute("createPoissonConstraint"):
+                        nom = arg.getVal()
+                        pval = ROOT.Math.normal_cdf_c(7)
+                        minObs, maxObs = self.poissonRanges.obsRange(nom, pval)
+                        self.doObj("%s_Pdf" % n, "Poisson", "%s_In[%d,%f,%f], %s, 1" % (n, nom, minObs, maxObs, n))
+                constraints.flush()
+                for bidx in range(bbb_args.getSize()):
+                    arg = bbb_args.at(bidx)
+                    n = arg.GetName()
+                    parname = n
+                    if arg.getAttribute("createPoissonConstraint") and n.endswith('_prod'):
+                        parname = n[:-5]
+                    binconstraints.add(self.out.pdf('%s_Pdf' % n))
+                    self.out.var("%s_In" % n).setConstant(True)
+                    self.extraNuisances.append(self.out.var("%s" % parname))
+                    self.extraGlobalObservables.append(self.out.var("%s_In" % n))
+            if not self.out.var('ONE'):
+                self.doVar('ONE[1.0]')
+            sum_s = self.addObj(ROOT.RooRealSumPdf, "pdf_bin%s"       % b,  "", ROOT.RooArgList(prop),   ROOT.RooArgList(self.out.var('ONE')), True)
+            if not self.options.noBOnly:
+                if not self.out.var('ZERO'):
+                    self.doVar('ZERO[0.0]')
+                customizer = ROOT.RooCustomizer(prop, "")
+                for arg in sigcoeffs:
+                    customizer.replaceArg(arg, self.out.var('ZERO'))
+                prop_b = customizer.build(True)
+                if len(sigcoeffs):
+                    prop_b.SetName("prop_bin%s_bonly" % b)
+                self.objstore[prop_b.GetName()] = prop_b
+                sum_b = self.addObj(ROOT.RooRealSumPdf, "pdf_bin%s_bonly"       % b,  "", ROOT.RooArgList(prop_b),   ROOT.RooArgList(self.out.var('ONE')), True)
+        else:
+            sum_s = self.addObj(ROOT.RooAddPdf,"pdf_bin%s"       % b,  "",  pdfs,   coeffs)
+            if not self.options.noBOnly: sum_b = self.addObj(ROOT.RooAddPdf, "pdf_bin%s_bonly" % b, "", bgpdfs, bgcoeffs)
+        wrappers = []
+        if channelBinParFlag and (self.options.lazyBOnly or not self.options.noBOnly):
+            for idx in xrange(pdfs.getSize()):
+                wrapper = ROOT.CMSHistFuncWrapper(pdfs[idx].GetName() + '_wrapper', '', pdfs.at(idx).getXVar(), pdfs.at(idx), prop, idx)
+                wrapper.setStringAttribute("combine.process", pdfs.at(idx).getStringAttribute("combine.process"))
+                wrapper.setStringAttribute("combine.channel", pdfs.at(idx).getStringAttribute("combine.channel"))
+                wrappers.append(wrapper)
+        return (sum_s, None if self.options.noBOnly else sum_b, binconstraints, wrappers)
+    def getChannelSums(self,b):
+        """return the result of doChannelSums for channel b, taking it from the model cache (--X-model-cache) when possible"""
+        cacheDir = getattr(self.options, "modelCache", None)
+        if not cacheDir: return self.doChannelSums(b)
+        path = os.path.join(cacheDir, self.channelFragmentKey(b))
+        if os.path.exists(path+".json"):
+            ret = self.loadChannelFragment(b, path)
+            if ret: return ret
+        nuis, globs = len(self.extraNuisances), len(self.extraGlobalObservables)
+        flatParams = set([ n for (n,warn) in self.DC.flatParamNuisances.iteritems() if not warn ])
+        ret = self.doChannelSums(b)
+        self.storeChannelFragment(b, path, ret, self.extraNuisances[nuis:], self.extraGlobalObservables[globs:],
+                                  [ n for (n,warn) in self.DC.flatParamNuisances.iteritems() if not warn and n not in flatParams ])
+        return ret
+    def channelFragmentKey(self,b):
+        """hash of everything that goes in the sums of channel b: rates, nuisance effects, shapes (and the content of their files), options"""
+        import hashlib
+        processes = []
+        for p in sorted(self.DC.exp[b].keys()):
+            processes.append((p, self.DC.exp[b][p], self.DC.isSignal[p], self.physics.getYieldScale(b,p),
+                              [ (n,pdf,args,value) for (n,nofloat,pdf,args,value) in self.DC.nuisanceEffects.effects(b,p) ]))
+        shapeMap = [ (ch, sorted(self.DC.shapeMap[ch].items())) for ch in (b, "*") if ch in self.DC.shapeMap ]
+        files = set()
+        for (p, rate, isSignal, scale, effects) in processes:
+            shapeNames = [ self.getShapeNames(b,p) ] + [ self.getShapeNames(b,p,n+s,allowNoSyst=True) for (n,pdf,args,value) in effects if "shape" in pdf for s in ("Up","Down") ]
+            for x in shapeNames:
+                if x != None: files.add(self.getShapeFileName(x[1][0]))
+        digests = [ (os.path.basename(fname), self.shapeFileDigest(fname)) for fname in sorted(files) ]
+        opts = [ getattr(self.options, o, None) for o in ("mass", "physModel", "physOpt", "noBOnly", "lazyBOnly", "noOptimizePdf", "useHistPdf", "defMorph",
+                                                          "optimizeTemplateBins", "optimizeExistingTemplates", "optimizeBoundNuisances", "modelparams", "dataname") ]
+        content = (FRAGMENT_CACHE_VERSION, b, processes, shapeMap, digests, self.DC.binParFlags.get(b), self.pdfModes.get(b),
+                   getattr(self.out, "maxbins", None), self.TH1Observables.get(b),
+                   sorted([ (k,v) for (k,v) in self.DC.systematicsShapeMap.iteritems() if k[1] == b ]), opts)
+        return hashlib.md5(repr(content)).hexdigest()
+    def shapeFileDigest(self,fname):
+        """md5 of the content of a shape file. The digests are kept in files.json in the model cache together with the
+           size and modification time of the files, and a file is hashed again only if one of them changed"""
+        import hashlib, json
+        index = os.path.join(self.options.modelCache, "files.json")
+        if self.fileDigests == None:
+            try:
+                self.fileDigests = json.load(open(index))
+            except (IOError, ValueError):
+                self.fileDigests = {}
+        path = os.path.abspath(fname)
+        stat = os.stat(path)
+        entry = self.fileDigests.get(path)
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime: return entry[2]
+        digest = hashlib.md5()
+        with open(path, "rb") as f:
+            for block in iter(lambda : f.read(1<<20), ""): digest.update(block)
+        self.fileDigests[path] = [ stat.st_size, stat.st_mtime, digest.hexdigest() ]
+        # write to a temporary file and rename it, so that concurrent runs never see a partial index
+        if not os.path.isdir(self.options.modelCache): os.makedirs(self.options.modelCache)
+        tmp = "%s.%d.tmp" % (index, os.getpid())
+        json.dump(self.fileDigests, open(tmp, "w"))
+        os.rename(tmp, index)
+        return digest.hexdigest()
+    def storeChannelFragment(self,b,path,sums,extraNuisances,extraGlobalObservables,foundFlatParams):
+        """write the sums of channel b (as returned by doChannelSums) to path.root, and the names that go with them to path.json"""
+        import json
+        (sum_s, sum_b, binconstraints, wrappers) = sums
+        fragment = ROOT.RooWorkspace("fragment","fragment")
+        fragment._import = SafeWorkspaceImporter(fragment)
+        args = [ sum_s ] + ([ sum_b ] if sum_b else []) + wrappers
+        for arg in args + [ binconstraints.at(i) for i in xrange(binconstraints.getSize()) ]:
+            fragment._import(arg, ROOT.RooFit.RecycleConflictNodes(), ROOT.RooFit.Silence())
+        meta = { "args"                   : [ a.GetName() for a in args ],
+                 "wrappers"               : [ a.GetName() for a in wrappers ],
+                 "binconstraints"         : [ binconstraints.at(i).GetName() for i in xrange(binconstraints.getSize()) ],
+                 "extraNuisances"         : [ a.GetName() for a in extraNuisances ],
+                 "extraGlobalObservables" : [ a.GetName() for a in extraGlobalObservables ],
+                 "foundFlatParams"        : foundFlatParams }
+        # write to temporary files and rename them, so that concurrent runs never see a partial entry
+        if not os.path.isdir(os.path.dirname(path)): os.makedirs(os.path.dirname(path))
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        fragment.writeToFile(tmp+".root")
+        json.dump(meta, open(tmp+".json", "w"))
+        os.rename(tmp+".root", path+".root")
+        os.rename(tmp+".json", path+".json")
+    def loadChannelFragment(self,b,path):
+        """read the sums of channel b stored by storeChannelFragment; they are imported in a staging workspace,
+           and the final import in doCombination recycles the normalizations and the nuisances of the current model"""
+        import json
+        try:
+            meta = json.load(open(path+".json"))
+        except ValueError, e:
+            stderr.write("Warning: ignoring unreadable model cache entry %s (%s)\n" % (path, e))
+            return None
+        fin = ROOT.TFile.Open(path+".root")
+        fragment = fin.Get("fragment") if fin else None
+        if not fragment:
+            stderr.write("Warning: ignoring unreadable model cache entry %s\n" % path)
+            return None
+        # the objects that the model already has (e.g. the normalizations) replace those of the same name in the fragment
+        # when it is imported, so they must be the same as when the fragment was made
+        shared = ROOT.RooArgList(fragment.allFunctions())
+        shared.add(fragment.allPdfs())
+        for k in xrange(shared.getSize()):
+            existing = self.out.arg(shared.at(k).GetName())
+            if existing and self.argDefinition(existing) != self.argDefinition(shared.at(k)):
+                stderr.write("Warning: ignoring model cache entry %s, as %s differs from the one in the model\n" % (path, existing.GetName()))
+                fin.Close()
+                return None
+        if self.fragments == None:
+            self.fragments = ROOT.RooWorkspace("fragments","fragments")
+            self.fragments._import = SafeWorkspaceImporter(self.fragments)
+        for n in meta["args"]:
+            self.fragments._import(fragment.arg(n), ROOT.RooFit.RecycleConflictNodes(), ROOT.RooFit.Silence())
+        binconstraints = ROOT.RooArgList()
+        for n in meta["binconstraints"]:
+            self.out._import(fragment.pdf(n), ROOT.RooFit.RecycleConflictNodes(), ROOT.RooFit.Silence())
+            binconstraints.add(self.out.pdf(n))
+        for n in meta["extraNuisances"]: self.extraNuisances.append(self.out.var(n))
+        for n in meta["extraGlobalObservables"]: self.extraGlobalObservables.append(self.out.var(n))
+        for n in meta["foundFlatParams"]: self.DC.flatParamNuisances[n] = False
+        fin.Close()
+        if self.options.verbose > 1: stderr.write("Model of channel %s taken from %s\n" % (b, path))
+        sum_s = self.objstore["pdf_bin%s" % b] = self.fragments.pdf("pdf_bin%s" % b)
+        sum_b = None
+        if not self.options.noBOnly: sum_b = self.objstore["pdf_bin%s_bonly" % b] = self.fragments.pdf("pdf_bin%s_bonly" % b)
+        return (sum_s, sum_b, binconstraints, [ self.fragments.arg(n) for n in meta["wrappers"] ])
+    def makeLazyChannel(self,b,sum_s,sum_b):
+        """put the sums of channel b in a workspace of their own, written to the directory channels/<b> of the output file,
+           and return the CMSLazyChannelPdfs that stand for them in the model (combine reads the channel when it first needs it)"""
+        channel = ROOT.RooWorkspace("channel","channel")
+        channel._import = SafeWorkspaceImporter(channel)
+        importArgs = [ ROOT.RooFit.RecycleConflictNodes(), ROOT.RooFit.Silence() ]
+        if len(self.DC.systematicsParamMap):
+            # the same renaming of the variables (e.g. for "param") as for the combined pdf in doCombination
+            importArgs.append(ROOT.RooFit.RenameVariable(",".join(self.DC.systematicsParamMap.values()), ",".join(self.DC.systematicsParamMap.keys())))
+        ret = []
+        for pdf in sum_s, sum_b:
+            if pdf == None:
+                ret.append(None); continue
+            channel._import(pdf, *importArgs)
+            lazy = ROOT.CMSLazyChannelPdf(pdf.GetName(), "", pdf, ROOT.RooArgList(pdf.getObservables(self.out.obs)), self.options.out, "channels/%s" % b)
+            for attr in pdf.attributes(): lazy.setAttribute(attr)
+            self.objstore[lazy.GetName()] = lazy
+            ret.append(lazy)
+        self.lazyChannels.append((b, channel))
+        return tuple(ret)
+    def doIndividualModelsInParallel(self,jobs):
+        """build the channel models in jobs worker processes, each one for a contiguous block of channels,
+           and import them in the workspace from the files that the workers write"""
+        global _channelModelBuilder
+        import tempfile, shutil
+        from multiprocessing import Pool
+        nbins = len(self.DC.bins); jobs = min(jobs, nbins)
+        if self.options.verbose:
+            stderr.write("Creating pdfs for individual modes (%d) in %d processes\n" % (nbins, jobs)); stderr.flush()
+        tmpdir = tempfile.mkdtemp(prefix="text2workspace")
+        try:
+            blocks = [ (k*nbins/jobs, (k+1)*nbins/jobs, os.path.join(tmpdir, "channels%d.root" % k)) for k in xrange(jobs) ]
+            _channelModelBuilder = self # the forked workers start from the current state of the builder
+            pool = Pool(processes=jobs, maxtasksperchild=1)
+            try:
+                results = pool.map(_writeChannelModelsJob, blocks)
+                pool.close()
+            finally:
+                pool.terminate()
+                pool.join()
+                _channelModelBuilder = None
+            for (first, last, fname), result in zip(blocks, results):
+                self.importChannelModels(first, last, fname, result)
+        finally:
+            shutil.rmtree(tmpdir)
+    def writeChannelModels(self,first,last,fname):
+        """build the models of channels [first, last) and write them to a workspace in file fname,
+           returning the names of the other objects that the parent builder needs to know about"""
+        bins = self.DC.bins[first:last]
+        self.doIndividualModels([ (i, self.DC.bins[i]) for i in xrange(first, last) ])
+        channels = ROOT.RooWorkspace("channels","channels")
+        channels._import = SafeWorkspaceImporter(channels)
+        dupObjs = set(); dupNames = set()
+        for postfix in ([""] if self.options.noBOnly else ["", "_bonly"]):
+            for b in bins:
+                pdfi = self.getObj("pdf_bin%s%s" % (b,postfix))
+                self.RenameDupObjs(dupObjs, dupNames, pdfi, b)
+                channels._import(pdfi, ROOT.RooFit.RecycleConflictNodes(), ROOT.RooFit.Silence())
+        for arg in self.extraImports:
+            channels._import(arg, ROOT.RooFit.RecycleConflictNodes(), ROOT.RooFit.Silence())
+        channels.writeToFile(fname)
+        return { "extraImports"           : [ a.GetName() for a in self.extraImports ],
+                 "extraNuisances"         : [ a.GetName() for a in self.extraNuisances ],
+                 "extraGlobalObservables" : [ a.GetName() for a in self.extraGlobalObservables ],
+                 "foundFlatParams"        : [ n for (n,warn) in self.DC.flatParamNuisances.iteritems() if not warn ] }
+    def importChannelModels(self,first,last,fname,result):
+        """import the models of channels [first, last) written by writeChannelModels in file fname"""
+        fin = ROOT.TFile.Open(fname)
+        channels = fin.Get("channels") if fin else None
+        if not channels: raise RuntimeError, "Failed to read the models of channels %s from %s" % (",".join(self.DC.bins[first:last]), fname)
+        for postfix in ([""] if self.options.noBOnly else ["", "_bonly"]):
+            for b in self.DC.bins[first:last]:
+                pdfi = channels.pdf("pdf_bin%s%s" % (b,postfix))
+                # objects of other blocks with the same name are recycled if they have the same definition, and renamed as doCombination does otherwise
+                branchNodes = ROOT.RooArgList()
+                pdfi.branchNodeServerList(branchNodes)
+                for k in xrange(1, branchNodes.getSize()):
+                    arg = branchNodes.at(k)
+                    existing = self.out.arg(arg.GetName())
+                    if existing and self.argDefinition(existing) != self.argDefinition(arg):
+                        print 'Object %s is duplicated' % arg.GetName()
+                        arg.SetName(arg.GetName() + '_%s' % b)
+                self.out._import(pdfi, ROOT.RooFit.RecycleConflictNodes(), ROOT.RooFit.Silence())
+                self.objstore["pdf_bin%s%s" % (b,postfix)] = self.out.pdf("pdf_bin%s%s" % (b,postfix))
+        for n in result["extraImports"]:
+            if not self.out.arg(n): self.out._import(channels.arg(n), ROOT.RooFit.RecycleConflictNodes(), ROOT.RooFit.Silence())
+            self.extraImports.append(self.out.arg(n))
+        for n in result["extraNuisances"]: self.extraNuisances.append(self.out.var(n))
+        for n in result["extraGlobalObservables"]: self.extraGlobalObservables.append(self.out.var(n))
+        for n in result["foundFlatParams"]: self.DC.flatParamNuisances[n] = False
+        fin.Close()
+    def argDefinition(self,arg):
+        """class, servers (by proxy) and current value of a function or pdf, to tell whether two objects with the same name are the same"""
+        servers = ROOT.std.stringstream()
+        arg.printArgs(servers)
+        return (arg.ClassName(), servers.str(), arg.getVal() if arg.InheritsFrom("RooAbsReal") else None)
     def doCombination(self):
         ## Contrary to Number-counting models, here each channel PDF already contains the nuisances
         ## So we just have to build the combined pdf
@@ -268,8 +625,65 @@ class ShapeBuilder(ModelBuilder):
     ## --------------------------------------
     ## -------- High level helpers ----------
     ## --------------------------------------
+    def prefetchShapes(self,jobs,massIndependentOnly=False):
+        """Read all the histograms (nominal and shape systematics) that the model will need, one file per task
+           in a pool of jobs processes, and put them in the cache of getShape (only those whose names don't
+           depend on $MASS if massIndependentOnly, to share them among the workspaces of several masses: these
+           are also rebinned, padded to the largest number of bins among them)"""
+        fileObjs = {}
+        for b in self.DC.bins:
+            for p in [self.options.dataname]+self.DC.exp[b].keys():
+                if len(self.DC.obs) == 0 and p == self.options.dataname: continue
+                if p != self.options.dataname and self.DC.exp[b][p] == 0: continue
+                systs = [""]
+                if p != self.options.dataname:
+                    for (syst,nofloat,pdf,args,value) in self.DC.nuisanceEffects.effects(b,p):
+                        if "shape" not in pdf: continue
+                        if (syst,b,p) in self.DC.systematicsShapeMap.keys(): syst = self.DC.systematicsShapeMap[(syst,b,p)]
+                        systs += [syst+"Up", syst+"Down"]
+                for syst in systs:
+                    if (b,p,syst) in _shapeCache: continue
+                    names = self.getShapeNames(b,p,syst,allowNoSyst=True)
+                    if names == None: continue
+                    if massIndependentOnly and "$MASS" in "".join(names[0]): continue
+                    (fname, objname) = names[1]
+                    if ":" in objname: continue # workspaces, trees: left to getShape
+                    fname = self.getShapeFileName(fname)
+                    if fname not in fileObjs: fileObjs[fname] = {}
+                    if objname not in fileObjs[fname]: fileObjs[fname][objname] = []
+                    fileObjs[fname][objname].append((b,p,syst))
+        if not fileObjs: return
+        tasks = [ (fname, objs.keys()) for (fname, objs) in fileObjs.iteritems() ]
+        if self.options.verbose > 1: stderr.write("Reading %d shapes from %d files with %d processes\n" % (sum([len(o) for (f,o) in tasks]), len(tasks), jobs))
+        if jobs > 1 and len(tasks) > 1:
+            from multiprocessing import Pool
+            pool = Pool(processes=min(jobs,len(tasks)))
+            try:
+                results = pool.map(_readShapeObjects, tasks)
+                pool.close()
+            finally:
+                pool.terminate()
+        else:
+            results = map(_readShapeObjects, tasks)
+        for (fname, objnames), objs in zip(tasks, results):
+            for (objname, obj) in objs:
+                for (channel,process,syst) in fileObjs[fname][objname]:
+                    # each entry has its own copy, as when reading it in getShape
+                    ret = obj.Clone() if len(fileObjs[fname][objname]) > 1 else obj
+                    postFix="Sig" if (process in self.DC.isSignal and self.DC.isSignal[process]) else "Bkg"
+                    ret.SetName("shape%s_%s_%s%s" % (postFix,process,channel, "_"+syst if syst else ""))
+                    ROOT.SetOwnership(ret, True)
+                    _shapeCache[(channel,process,syst)] = ret
+        if massIndependentOnly:
+            # rebinH1 makes them again only for the masses whose own templates have more bins
+            shapes = [ _shapeCache.get(key) for fname in fileObjs for keys in fileObjs[fname].values() for key in keys ]
+            shapes = [ shape for shape in shapes if shape != None and shape.InheritsFrom("TH1") and shape.GetDimension() == 1 ]
+            if shapes:
+                maxbins = max([ shape.GetNbinsX() for shape in shapes ])
+                for shape in shapes: self.rebinH1(shape, maxbins)
     def prepareAllShapes(self):
         shapeTypes = []; shapeBins = {}; shapeObs = {}
+        if getattr(self.options, "prefetchShapes", 0) > 0: self.prefetchShapes(self.options.prefetchShapes)
         self.pdfModes = {}
         for ib,b in enumerate(self.DC.bins):
             databins = {}; bgbins = {}
@@ -300,11 +714,9 @@ class ShapeBuilder(ModelBuilder):
                             self.pdfModes[b] = 'poisson'
                         else:
                             self.pdfModes[b] = 'binned'
-                        for i in xrange(1, shape.GetNbinsX()+1):
-                            if shape.GetBinContent(i) > 0: databins[i] = True
+                        for i in th1FilledBins(shape): databins[i] = True
                     elif not self.DC.isSignal[p]:
-                        for i in xrange(1, shape.GetNbinsX()+1):
-                            if shape.GetBinContent(i) > 0: bgbins[i] = True
+                        for i in th1FilledBins(shape): bgbins[i] = True
                 elif shape.InheritsFrom("RooDataHist"):
                     shapeTypes.append("RooDataHist"); 
                     #if doPadding: shapeBins[b] = shape.numEntries() --> Not clear this is needed at all for RooDataHists so just ignore
@@ -416,11 +828,9 @@ class ShapeBuilder(ModelBuilder):
     ## -------------------------------------
     ## -------- Low level helpers ----------
     ## -------------------------------------
-    def getShape(self,channel,process,syst="",_fileCache={},_cache={},allowNoSyst=False):
-        if _cache.has_key((channel,process,syst)): 
-            if self.options.verbose > 2: print "recyling (%s,%s,%s) -> %s\n" % (channel,process,syst,_cache[(channel,process,syst)].GetName())
-            return _cache[(channel,process,syst)];
-        postFix="Sig" if (process in self.DC.isSignal and self.DC.isSignal[process]) else "Bkg"
+    def getShapeNames(self,channel,process,syst="",allowNoSyst=False):
+        """Return the patterns and the final names [file, object] of the shape of process in channel (for the given syst),
+           or None for a FAKE shape or a missing syst allowed by allowNoSyst"""
         bentry = None
         if self.DC.shapeMap.has_key(channel): bentry = self.DC.shapeMap[channel]
         elif self.DC.shapeMap.has_key("*"):   bentry = self.DC.shapeMap["*"]
@@ -447,15 +857,30 @@ class ShapeBuilder(ModelBuilder):
 	   protected_kwords =  ["PROCESS","CHANNEL","SYSTEMATIC","MASS"]
 	   if mpname in protected_kwords: raise RuntimeError, "Cannot use the following keywords (already assigned in combine): $"+" $".join(protected_kwords) 
            finalNames = [ fn.replace("$%s"%mpname,mpv) for fn in finalNames ]
-        if not _fileCache.has_key(finalNames[0]): 
-            trueFName = finalNames[0]
-            if not os.path.exists(trueFName) and not os.path.isabs(trueFName) and os.path.exists(self.options.baseDir+"/"+trueFName):
-                trueFName = self.options.baseDir+"/"+trueFName;
-            _fileCache[finalNames[0]] = ROOT.TFile.Open(trueFName)
-        file = _fileCache[finalNames[0]]; objname = finalNames[1]
+        return (names, finalNames)
+    def getShapeFileName(self,fname):
+        """Actual path of a shape file, that can be given relative to the directory of the datacard"""
+        if not os.path.exists(fname) and not os.path.isabs(fname) and os.path.exists(self.options.baseDir+"/"+fname):
+            return self.options.baseDir+"/"+fname
+        return fname
+    def getShape(self,channel,process,syst="",_fileCache=_shapeFileCache,_cache=_shapeCache,allowNoSyst=False):
+        ret = _cache.get((channel,process,syst))
+        if ret is not None: 
+            if self.options.verbose > 2: print "recyling (%s,%s,%s) -> %s\n" % (channel,process,syst,ret.GetName())
+            return ret;
+        postFix="Sig" if (process in self.DC.isSignal and self.DC.isSignal[process]) else "Bkg"
+        shapeNames = self.getShapeNames(channel,process,syst,allowNoSyst)
+        if shapeNames == None: return None
+        (names, finalNames) = shapeNames
+        file = _fileCache.get(finalNames[0])
+        if file is None: 
+            file = ROOT.TFile.Open(self.getShapeFileName(finalNames[0]))
+            _fileCache[finalNames[0]] = file
+        objname = finalNames[1]
         if not file: raise RuntimeError, "Cannot open file %s (from pattern %s)" % (finalNames[0],names[0])
         if ":" in objname: # workspace:obj or ttree:xvar or th1::xvar
             (wname, oname) = objname.split(":")
+            _fileCache.pin(finalNames[0]) # the objects taken from workspaces and trees still need their file
             if (file,wname) not in self.wspnames : 
 		self.wspnames[(file,wname)] = file.Get(wname)
 	    self.wsp = self.wspnames[(file,wname)]
@@ -518,6 +943,7 @@ class ShapeBuilder(ModelBuilder):
                 if allowNoSyst: return None
                 raise RuntimeError, "Failed to find %s in file %s (from pattern %s, %s)" % (objname,finalNames[0],names[1],names[0])
             ret.SetName("shape%s_%s_%s%s" % (postFix,process,channel, "_"+syst if syst else ""))
+            ROOT.SetOwnership(ret, True) # not attached to the file, so freed once neither the cache nor the caller hold it
             if self.options.verbose > 2: print "import (%s,%s) -> %s\n" % (finalNames[0],objname,ret.GetName())
             _cache[(channel,process,syst)] = ret
             return ret
@@ -531,9 +957,8 @@ class ShapeBuilder(ModelBuilder):
         if shapeNominal == None: return nominalPdf # no point morphing a fake shape
         morphs = []; shapeAlgo = None
 	channelBinParFlag = channel in self.DC.binParFlags.keys()
-        for (syst,nofloat,pdf,args,errline) in self.DC.systs:
+        for (syst,nofloat,pdf,args,value) in self.DC.nuisanceEffects.effects(channel,process):
             if not "shape" in pdf: continue
-            if errline[channel][process] == 0: continue
             allowNoSyst = (pdf[-1] == "?")
             pdf = pdf.replace("?","")
             if pdf[-1] == "U": pdf = pdf[:-1]
@@ -542,7 +967,7 @@ class ShapeBuilder(ModelBuilder):
                 errmsg =  "ERROR for channel %s, process %s. " % (channel,process)
                 errmsg += "Requesting morphing %s  for systematic %s after having requested %s. " % (pdf, syst, shapeAlgo)
                 raise RuntimeError, errmsg+" One can use only one morphing algorithm for a given shape";
-            if errline[channel][process] != 0:
+            if value != 0:
                 if allowNoSyst and not self.isShapeSystematic(channel,process,syst): continue
 		systShapeName = syst
 		if (syst,channel,process) in self.DC.systematicsShapeMap.keys(): systShapeName = self.DC.systematicsShapeMap[(syst,channel,process)]
@@ -551,9 +976,9 @@ class ShapeBuilder(ModelBuilder):
                 if shapeUp.ClassName()   != shapeNominal.ClassName(): raise RuntimeError, "Mismatched shape types for channel %s, process %s, syst %s" % (channel,process,syst)
                 if shapeDown.ClassName() != shapeNominal.ClassName(): raise RuntimeError, "Mismatched shape types for channel %s, process %s, syst %s" % (channel,process,syst)
                 if self.options.useHistPdf == "always":
-                    morphs.append((syst,errline[channel][process],self.shape2Pdf(shapeUp,channel,process),self.shape2Pdf(shapeDown,channel,process)))
+                    morphs.append((syst,value,self.shape2Pdf(shapeUp,channel,process),self.shape2Pdf(shapeDown,channel,process)))
                 else:
-                    morphs.append((syst,errline[channel][process],shapeUp,shapeDown))
+                    morphs.append((syst,value,shapeUp,shapeDown))
         if len(morphs) == 0:
             if self.options.useHistPdf == "always":
                 return nominalPdf
@@ -662,12 +1087,13 @@ class ShapeBuilder(ModelBuilder):
         shapeUp = self.getShape(channel,process,systShapeName+"Up",allowNoSyst=True)    
         return shapeUp != None
     def getExtraNorm(self,channel,process):
+        """multiplicative normalization terms of a parametric shape (the _norm term); the normalization
+           effects of the template shape systematics are in the ProcessNormalization, see getShapeNormEffects"""
         if channel in self.selfNormBins and self.DC.binParFlags[channel][2] in [2]:
             if self.options.verbose > 1:
                 print 'Skipping getExtraNorm for (%s,%s)' % (channel, process)
             return None
         postFix="Sig" if (process in self.DC.isSignal and self.DC.isSignal[process]) else "Bkg"
-        terms = []
         shapeNominal = self.getShape(channel,process)
         if shapeNominal == None: 
             # FIXME no extra norm for dummy pdfs (could be changed)
@@ -676,15 +1102,21 @@ class ShapeBuilder(ModelBuilder):
             # return nominal multiplicative normalization constant
             normname = "shape%s_%s_%s%s_norm" % (postFix,process,channel, "_")
             if self.out.arg(normname): return [ normname ]
-            else: return None
+        return None
+    def getShapeNormEffects(self,channel,process):
+        """(kappaLo, kappaHi, nuisance) for the change in normalization of the template shape systematics of this process"""
+        if channel in self.selfNormBins and self.DC.binParFlags[channel][2] in [2]: return []
+        shapeNominal = self.getShape(channel,process)
+        if shapeNominal == None: return []
         normNominal = 0
         if shapeNominal.InheritsFrom("TH1"): normNominal = shapeNominal.Integral()
         elif shapeNominal.InheritsFrom("RooDataHist"): normNominal = shapeNominal.sumEntries()
-        else: return None    
+        else: return []
         if normNominal == 0: raise RuntimeError, "Null norm for channel %s, process %s" % (channel,process)
-        for (syst,nofloat,pdf,args,errline) in self.DC.systs:
+        effects = []
+        for (syst,nofloat,pdf,args,value) in self.DC.nuisanceEffects.effects(channel,process):
             if "shape" not in pdf: continue
-            if errline[channel][process] != 0:
+            if value != 0:
                 if pdf[-1] == "?" and not self.isShapeSystematic(channel,process,syst): continue
 		systShapeName = syst
 	        if (syst,channel,process) in self.DC.systematicsShapeMap.keys(): systShapeName = self.DC.systematicsShapeMap[(syst,channel,process)]
@@ -701,31 +1133,38 @@ class ShapeBuilder(ModelBuilder):
                 if not kappaDown > 0: raise RuntimeError, "Bogus norm %r for channel %s, process %s, systematic %s Down" % (kappaDown, channel,process,syst)
                 kappaUp /=normNominal; kappaDown /= normNominal
                 if abs(kappaUp-1) < 1e-3 and abs(kappaDown-1) < 1e-3: continue
-                # if errline[channel][process] == <x> it means the gaussian should be scaled by <x> before doing pow
-                # for convenience, we scale the kappas
-                kappasScaled = [ pow(x, errline[channel][process]) for x in kappaDown,kappaUp ]
-                obj_kappaDown = self.addObj(ROOT.RooConstVar, '%f' %  kappasScaled[0], "", float('%f' %  kappasScaled[0]))
-                obj_kappaUp = self.addObj(ROOT.RooConstVar, '%f' %  kappasScaled[1], "", float('%f' %  kappasScaled[1]))
-                obj_var = self.out.var(syst)
-                self.addObj(ROOT.AsymPow, "systeff_%s_%s_%s" % (channel,process,syst), "", obj_kappaDown, obj_kappaUp, obj_var)
-                terms.append( "systeff_%s_%s_%s" % (channel,process,syst) )
-        return terms if terms else None;
+                # if value == <x> it means the gaussian should be scaled by <x> before doing pow
+                # for convenience, we scale the kappas; they are rounded as the constants of the AsymPow terms
+                # that used to model these effects, so that the yields don't change
+                kappasScaled = [ float('%f' % pow(x, value)) for x in kappaDown,kappaUp ]
+                effects.append((kappasScaled[0], kappasScaled[1], syst))
+        return effects
 
-    def rebinH1(self,shape):
-    	
+    def rebinH1(self,shape,maxbins=None):
+        """copy of shape with unit bins, padded to maxbins (default: self.out.maxbins) bins with --X-optimize-bins;
+           it is kept with the shape, and made again only if the number of bins changes"""
 	if self.options.optimizeTemplateBins:
-          rebinh1 = ROOT.TH1F(shape.GetName()+"_rebin", "", self.out.maxbins, 0.0, float(self.out.maxbins))
-          for i in range(1,min(shape.GetNbinsX(),self.out.maxbins)+1): 
-            rebinh1.SetBinContent(i, shape.GetBinContent(i))
-            rebinh1.SetBinError(i, shape.GetBinError(i))
-          rebinh1._original_bins = shape.GetNbinsX()
+          if maxbins == None: maxbins = self.out.maxbins
 	else :
-	  shapeNbins = shape.GetNbinsX()
-          rebinh1 = ROOT.TH1F(shape.GetName()+"_rebin", "", shapeNbins, 0.0, float(shapeNbins))
-          for i in range(1,shapeNbins+1): 
-            rebinh1.SetBinContent(i, shape.GetBinContent(i))
-            rebinh1.SetBinError(i, shape.GetBinError(i))
-          rebinh1._original_bins = shapeNbins
+	  maxbins = shape.GetNbinsX()
+        rebinh1 = getattr(shape, "_rebinned", None)
+        if rebinh1 != None and rebinh1.GetNbinsX() == maxbins: return rebinh1
+        rebinh1 = ROOT.TH1F(shape.GetName()+"_rebin", "", maxbins, 0.0, float(maxbins))
+        ncopy = min(shape.GetNbinsX(),maxbins)
+        rebinh1._original_bins = shape.GetNbinsX()
+        if ncopy > 0 and numpy is None:
+            for i in xrange(1,ncopy+1):
+                rebinh1.SetBinContent(i, shape.GetBinContent(i))
+                rebinh1.SetBinError(i, shape.GetBinError(i))
+        elif ncopy > 0:
+            # copy the contents and errors of bins 1..ncopy at once, leaving the padding bins empty
+            contents = numpy.zeros(rebinh1.GetNcells()); errors = numpy.zeros(rebinh1.GetNcells())
+            contents[1:ncopy+1] = th1Contents(shape)[1:ncopy+1]
+            errors[1:ncopy+1] = th1Errors(shape)[1:ncopy+1]
+            rebinh1.SetContent(contents)
+            rebinh1.SetError(errors)
+            rebinh1.SetEntries(ncopy) # as many as SetBinContent calls
+        shape._rebinned = rebinh1
         return rebinh1;
 	   
     def shape2Data(self,shape,channel,process,_cache={}):
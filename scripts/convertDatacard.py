@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+import os.path
+from sys import stdout, exit
+from optparse import OptionParser
+
+## set up the option parser
+parser = OptionParser(usage="usage: %prog [options] INPUT OUTPUT",
+                      description="Convert a datacard between the text format and the binary .npz format, in either direction. The output is written in the binary format if its name ends with .npz, and as a text datacard otherwise ('-' for the standard output). Nuisance edits are kept as they are, and evaluated only when the converted datacard is read.")
+(options, args) = parser.parse_args()
+## check number of arguments; in case print usage
+if len(args) != 2 :
+    parser.print_usage()
+    exit(1)
+
+options.bin = True # parse shape lines
+options.stat = False
+options.nuisancesToExclude = []
+options.verbose = 0
+options.allowNoSignal = True
+options.allowNoBackground = True
+options.evaluateEdits = False
+options.noJMax = False
+options.channelVetos = []
+options.channelIncludes = []
+options.shape = False
+
+from HiggsAnalysis.CombinedLimit.DatacardParser import parseCard
+from HiggsAnalysis.CombinedLimit.DatacardCombiner import relabelCard, CardCombination
+
+(input, output) = args
+DC = parseCard(open(input, "rb" if input.endswith(".npz") else "r"), options)
+if output.endswith(".npz"):
+    DC.writeNpz(output)
+else:
+    ## write it as combineCards.py does for a single datacard keeping its bin names (label '.'), with the paths of the
+    ## shape files left as they are in the input
+    combination = CardCombination()
+    combination.add(relabelCard(os.path.basename(input), ".", options, DC))
+    combination.write(stdout if output == "-" else open(output, "w"), [input])
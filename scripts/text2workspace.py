@@ -1,5 +1,5 @@
 #!/usr/bin/env python
-import re
+import re, os
 from sys import argv, stdout, stderr, exit, modules
 from optparse import OptionParser
 
@@ -15,39 +15,43 @@ from HiggsAnalysis.CombinedLimit.ModelTools import *
 from HiggsAnalysis.CombinedLimit.ShapeTools import *
 from HiggsAnalysis.CombinedLimit.PhysicsModel import *
 
-parser = OptionParser(usage="usage: %prog [options] datacard.txt -o output \nrun with --help to get list of options")
+parser = OptionParser(usage="usage: %prog [options] datacard.txt -o output \n       %prog [options] label1=datacard1.txt label2=datacard2.txt ... -o output \nrun with --help to get list of options")
 addDatacardParserOptions(parser)
 parser.add_option("-P", "--physics-model", dest="physModel", default="HiggsAnalysis.CombinedLimit.PhysicsModel:defaultModel",  type="string", help="Physics model to use. It should be in the form (module name):(object name)")
 parser.add_option("--PO", "--physics-option", dest="physOpt", default=[],  type="string", action="append", help="Pass a given option to the physics model (can specify multiple times)")
 parser.add_option("", "--dump-datacard", dest="dumpCard", default=False, action='store_true',  help="Print to screen the DataCard as a python config and exit")
+parser.add_option("", "--profile-phases", dest="profilePhases", default=False, action='store_true',  help="Record wall time, CPU time, peak memory and number of objects created in each phase, and write them as JSON next to the output workspace")
 (options, args) = parser.parse_args()
+profiler = PhaseProfiler(enabled=options.profilePhases)
 
 if len(args) == 0:
     parser.print_usage()
     exit(1)
 
-options.fileName = args[0]
-if options.fileName.endswith(".gz"):
-    import gzip
-    file = gzip.open(options.fileName, "rb")
-    options.fileName = options.fileName[:-3]
+if len(args) > 1 or "=" in args[0]:
+    ## Combine the datacards (label=datacard.txt, as for combineCards.py) directly in memory
+    from HiggsAnalysis.CombinedLimit.DatacardCombiner import combineDatacards
+    if options.out == None: raise RuntimeError, "An output file (-o) must be specified when building a workspace from several datacards"
+    options.fileName = os.path.basename(re.sub(".root$","",options.out))+".txt"
+    with profiler.phase("parse"): DC = combineDatacards(args, options)
 else:
-    file = open(options.fileName, "r")
+    options.fileName = args[0]
+    if options.fileName.endswith(".gz"):
+        import gzip
+        file = gzip.open(options.fileName, "rb")
+        options.fileName = options.fileName[:-3]
+    elif options.fileName.endswith(".npz"):
+        file = open(options.fileName, "rb")
+    else:
+        file = open(options.fileName, "r")
 
-## Parse text file 
-DC = parseCard(file, options)
+    ## Parse text file 
+    with profiler.phase("parse"): DC = parseCard(file, options)
 
 if options.dumpCard:
     DC.print_structure()
     exit()
 
-## Load tools to build workspace
-MB = None
-if DC.hasShapes:
-    MB = ShapeBuilder(DC, options)
-else:
-    MB = CountingModelBuilder(DC, options)
-
 ## Load physics model
 (physModMod, physModName) = options.physModel.split(":")
 __import__(physModMod)
@@ -57,6 +61,46 @@ if mod     == None: raise RuntimeError, "Physics model module %s not found" % ph
 if physics == None or not isinstance(physics, PhysicsModelBase): 
     raise RuntimeError, "Physics model %s in module %s not found, or not inheriting from PhysicsModelBase" % (physModName, physModMod)
 physics.setPhysicsOptions(options.physOpt)
-## Attach to the tools, and run
-MB.setPhysics(physics)
-MB.doModel()
+
+def makeBuilder():
+    ## Load tools to build workspace
+    MB = None
+    if DC.hasShapes:
+        MB = ShapeBuilder(DC, options)
+    else:
+        MB = CountingModelBuilder(DC, options)
+    ## Attach to the tools
+    MB.setPhysics(physics)
+    MB.profiler = profiler
+    return MB
+
+def buildWorkspace(MB):
+    MB.doModel()
+    if options.profilePhases and options.bin:
+        profileFile = re.sub(".root$","",options.out)+"_phases.json"
+        profiler.write(profileFile)
+        stderr.write("%s\nWrote the timing report of the phases to %s\n" % (profiler.report(), profileFile))
+
+if options.masses:
+    ## One workspace per mass, all from the same builder: it reads and rebins here the templates that don't depend
+    ## on $MASS, and each workspace is built by a copy of it in a child process, that inherits these templates and
+    ## reads only the ones of its mass, so that nothing else is carried over from one mass to the next
+    from multiprocessing import Process
+    if options.out == None: raise RuntimeError, "An output file (-o) must be specified when building workspaces for several masses"
+    masses = [ float(m) for m in options.masses.split(",") ]
+    outPattern = options.out
+    options.mass = masses[0]
+    MB = makeBuilder()
+    if DC.hasShapes and options.bin:
+        MB.prefetchShapes(max(options.prefetchShapes, 1), massIndependentOnly=True)
+    for mass in masses:
+        options.mass = mass
+        strmass = "%d" % mass if mass % 1 == 0 else str(mass)
+        options.out = outPattern.replace("$MASS", strmass) if "$MASS" in outPattern else re.sub("(\\.root)?$", ".mH%s.root" % strmass, outPattern, count=1)
+        stdout.flush(); stderr.flush()
+        job = Process(target=buildWorkspace, args=(MB,))
+        job.start(); job.join()
+        if job.exitcode != 0: raise RuntimeError, "Failed to build the workspace for mass %s" % strmass
+        if options.verbose: stderr.write("Wrote the workspace for mass %s to %s\n" % (strmass, options.out))
+else:
+    buildWorkspace(makeBuilder())
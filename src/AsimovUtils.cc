@@ -8,6 +8,7 @@
 #include <RooProdPdf.h>
 #include <RooUniform.h>
 #include "HiggsAnalysis/CombinedLimit/interface/utils.h"
+#include "HiggsAnalysis/CombinedLimit/interface/SimpleGaussianConstraintBlock.h"
 #include "HiggsAnalysis/CombinedLimit/interface/ToyMCSamplerOpt.h"
 #include "HiggsAnalysis/CombinedLimit/interface/CloseCoutSentry.h"
 #include "HiggsAnalysis/CombinedLimit/interface/CascadeMinimizer.h"
@@ -98,6 +99,15 @@ RooAbsData *asimovutils::asimovDatasetWithFit(RooStats::ModelConfig *mc, RooAbsD
                 if (!cterm) throw std::logic_error("AsimovUtils: a factor of the nuisance pdf is not a Pdf!");
                 if (!cterm->dependsOn(nuis)) continue; // dummy constraints
                 if (typeid(*cterm) == typeid(RooUniform)) continue;
+                if (typeid(*cterm) == typeid(SimpleGaussianConstraintBlock)) {
+                    // each global observable goes to the value of its own parameter
+                    const SimpleGaussianConstraintBlock *block = static_cast<const SimpleGaussianConstraintBlock *>(cterm);
+                    for (int i = 0, n = block->xList().getSize(); i < n; ++i) {
+                        RooRealVar *gob = dynamic_cast<RooRealVar *>(gobs.find(block->meanList().at(i)->GetName()));
+                        if (gob) gob->setVal(static_cast<RooAbsReal *>(block->xList().at(i))->getVal());
+                    }
+                    continue;
+                }
                 std::auto_ptr<RooArgSet> cpars(cterm->getParameters(&gobs));
                 std::auto_ptr<RooArgSet> cgobs(cterm->getObservables(&gobs));
                 if (cgobs->getSize() != 1) {
@@ -0,0 +1,124 @@
+#include "HiggsAnalysis/CombinedLimit/interface/CMSCountingPdf.h"
+#include <cmath>
+#include <algorithm>
+#include <limits>
+#include <string>
+#include <stdexcept>
+#include "RooRealVar.h"
+#include "RooRandom.h"
+
+CMSCountingPdf::CMSCountingPdf() : initialized_(false) {}
+
+CMSCountingPdf::CMSCountingPdf(const char* name, const char* title,
+                               RooArgList const& obs, RooArgList const& yields,
+                               std::vector<int> const& bins)
+    : RooAbsPdf(name, title),
+      obs_("obs", "", this),
+      yields_("yields", "", this),
+      bins_(bins),
+      initialized_(false) {
+  if (int(bins.size()) != yields.getSize()) {
+    throw std::invalid_argument(std::string("CMSCountingPdf ") + name + ": the numbers of yields and bin indices differ");
+  }
+  for (unsigned i = 0; i < bins.size(); ++i) {
+    if (bins[i] < 0 || bins[i] >= obs.getSize()) {
+      throw std::invalid_argument(std::string("CMSCountingPdf ") + name + ": bin index out of range");
+    }
+  }
+  obs_.add(obs);
+  yields_.add(yields);
+}
+
+CMSCountingPdf::CMSCountingPdf(CMSCountingPdf const& other, const char* name)
+    : RooAbsPdf(other, name),
+      obs_("obs", this, other.obs_),
+      yields_("yields", this, other.yields_),
+      bins_(other.bins_),
+      initialized_(false) {}
+
+void CMSCountingPdf::initialize() const {
+  if (initialized_) return;
+  vobs_.resize(obs_.getSize());
+  vyields_.resize(yields_.getSize());
+  expected_.resize(obs_.getSize());
+  for (unsigned i = 0; i < vobs_.size(); ++i) {
+    vobs_[i] = dynamic_cast<RooAbsReal*>(obs_.at(i));
+  }
+  for (unsigned i = 0; i < vyields_.size(); ++i) {
+    vyields_[i] = dynamic_cast<RooAbsReal*>(yields_.at(i));
+  }
+  initialized_ = true;
+}
+
+void CMSCountingPdf::updateExpected() const {
+  initialize();
+  std::fill(expected_.begin(), expected_.end(), 0.);
+  for (unsigned i = 0; i < vyields_.size(); ++i) {
+    expected_[bins_[i]] += vyields_[i]->getVal();
+  }
+}
+
+double CMSCountingPdf::getLogValFast() const {
+  updateExpected();
+  double ret = 0;
+  for (unsigned b = 0; b < vobs_.size(); ++b) {
+    double n = vobs_[b]->getVal(), mu = expected_[b];
+    if (mu <= 0) {
+      if (n == 0) continue;
+      return -std::numeric_limits<double>::infinity();
+    }
+    ret += n * std::log(mu) - mu - std::lgamma(n + 1);
+  }
+  return ret;
+}
+
+Double_t CMSCountingPdf::evaluate() const {
+  return std::exp(getLogValFast());
+}
+
+Int_t CMSCountingPdf::getAnalyticalIntegral(RooArgSet& allVars, RooArgSet& analVars,
+                                            const char* /*rangeName*/) const {
+  // the product of the Poisson terms integrates to one over all the non-negative counts;
+  // integrating out only some of the observables is left to RooFit
+  for (int i = 0, n = obs_.getSize(); i < n; ++i) {
+    if (!allVars.find(obs_.at(i)->GetName())) return 0;
+  }
+  analVars.add(obs_);
+  return 1;
+}
+
+Double_t CMSCountingPdf::analyticalIntegral(Int_t code, const char* /*rangeName*/) const {
+  if (code != 1) throw std::logic_error("CMSCountingPdf: unknown integration code");
+  return 1.0;
+}
+
+Int_t CMSCountingPdf::getGenerator(const RooArgSet& directVars, RooArgSet& generateVars,
+                                   Bool_t /*staticInitOK*/) const {
+  for (int i = 0, n = obs_.getSize(); i < n; ++i) {
+    if (!directVars.find(obs_.at(i)->GetName())) return 0;
+  }
+  generateVars.add(obs_);
+  return 1;
+}
+
+void CMSCountingPdf::generateEvent(Int_t /*code*/) {
+  updateExpected();
+  for (unsigned b = 0; b < vobs_.size(); ++b) {
+    static_cast<RooRealVar*>(vobs_[b])->setVal(RooRandom::randomGenerator()->Poisson(expected_[b]));
+  }
+}
+
+void CMSCountingPdf::setToExpected() {
+  updateExpected();
+  for (unsigned b = 0; b < vobs_.size(); ++b) {
+    static_cast<RooRealVar*>(vobs_[b])->setVal(expected_[b]);
+  }
+}
+
+Bool_t CMSCountingPdf::redirectServersHook(const RooAbsCollection& newServerList, Bool_t mustReplaceAll,
+                                          Bool_t nameChange, Bool_t isRecursive) {
+  initialized_ = false;  // the cached pointers to the servers are no longer valid
+  return RooAbsPdf::redirectServersHook(newServerList, mustReplaceAll, nameChange, isRecursive);
+}
+
+ClassImp(CMSCountingPdf)
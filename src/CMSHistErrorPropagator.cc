@@ -12,6 +12,7 @@
 #include "RooAbsData.h"
 #include "RooConstVar.h"
 #include "RooGaussian.h"
+#include "HiggsAnalysis/CombinedLimit/interface/SimpleGaussianConstraintBlock.h"
 #include "RooProduct.h"
 #include "vectorized.h"
 
@@ -262,6 +263,11 @@ void CMSHistErrorPropagator::setAnalyticBarlowBeeston(bool flag) const {
               auto gobs = dynamic_cast<RooAbsReal*>(as_gauss->findServer(TString(vbinpars_[j][0]->GetName())+"_In"));
               if (gobs) gobs_val = gobs->getVal();
             }
+            auto as_block = dynamic_cast<SimpleGaussianConstraintBlock*>(arg);
+            if (as_block) {
+              int idx = as_block->xList().index(vbinpars_[j][0]->GetName());
+              if (idx >= 0) gobs_val = static_cast<RooAbsReal*>(as_block->meanList().at(idx))->getVal();
+            }
           }
         }
         bb_.gobs.push_back(gobs_val);
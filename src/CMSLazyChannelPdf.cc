@@ -0,0 +1,123 @@
+#include "HiggsAnalysis/CombinedLimit/interface/CMSLazyChannelPdf.h"
+#include <memory>
+#include <set>
+#include <string>
+#include <stdexcept>
+#include "RooWorkspace.h"
+#include "TDirectory.h"
+#include "TFile.h"
+#include "TIterator.h"
+
+CMSLazyChannelPdf::CMSLazyChannelPdf()
+    : extended_(0), pdf_(0), channel_(0), normSet_(0), source_(0) {}
+
+CMSLazyChannelPdf::CMSLazyChannelPdf(const char* name, const char* title, RooAbsPdf const& pdf,
+                                     RooArgList const& obs, const char* fileName, const char* dirName)
+    : RooAbsPdf(name, title),
+      obs_("obs", "", this),
+      params_("params", "", this),
+      fileName_(fileName),
+      dirName_(dirName),
+      pdfName_(pdf.GetName()),
+      extended_(pdf.extendMode()),
+      pdf_(0),
+      channel_(0),
+      normSet_(0),
+      source_(0) {
+  obs_.add(obs);
+  RooArgSet obsSet(obs);
+  std::auto_ptr<RooArgSet> params(pdf.getParameters(obsSet));
+  params_.add(*params);
+}
+
+CMSLazyChannelPdf::CMSLazyChannelPdf(CMSLazyChannelPdf const& other, const char* name)
+    : RooAbsPdf(other, name),
+      obs_("obs", this, other.obs_),
+      params_("params", this, other.params_),
+      fileName_(other.fileName_),
+      dirName_(other.dirName_),
+      pdfName_(other.pdfName_),
+      extended_(other.extended_),
+      pdf_(0),
+      channel_(0),
+      normSet_(0),
+      source_(other.source_) {}
+
+CMSLazyChannelPdf::~CMSLazyChannelPdf() {
+  delete normSet_;
+  delete channel_;
+}
+
+RooAbsPdf* CMSLazyChannelPdf::channelPdf() const {
+  if (pdf_) return pdf_;
+  TDirectory* dir = source_;
+  std::auto_ptr<TFile> file;
+  if (dir == 0) {
+    file.reset(TFile::Open(fileName_));
+    if (file.get() == 0 || file->IsZombie()) {
+      throw std::runtime_error(std::string("CMSLazyChannelPdf ") + GetName() + ": can't open " + fileName_.Data());
+    }
+    dir = file.get();
+  }
+  channel_ = dynamic_cast<RooWorkspace*>(dir->Get(dirName_ + "/channel"));
+  if (channel_ == 0) {
+    throw std::runtime_error(std::string("CMSLazyChannelPdf ") + GetName() + ": no workspace 'channel' in directory " + dirName_.Data());
+  }
+  RooAbsPdf* pdf = channel_->pdf(pdfName_);
+  if (pdf == 0) {
+    throw std::runtime_error(std::string("CMSLazyChannelPdf ") + GetName() + ": no pdf " + pdfName_.Data() + " in directory " + dirName_.Data());
+  }
+  // make the model depend on the observables and parameters of the workspace, instead of the copies stored with it
+  RooArgSet servers(obs_);
+  servers.add(params_);
+  pdf->recursiveRedirectServers(servers);
+  normSet_ = new RooArgSet(obs_);
+  pdf_ = pdf;
+  return pdf_;
+}
+
+RooAbsPdf* CMSLazyChannelPdf::resolve(RooAbsPdf* pdf) {
+  CMSLazyChannelPdf* lazy = dynamic_cast<CMSLazyChannelPdf*>(pdf);
+  return lazy ? lazy->channelPdf() : pdf;
+}
+
+Double_t CMSLazyChannelPdf::evaluate() const {
+  RooAbsPdf* pdf = channelPdf();
+  return pdf->getVal(normSet_);
+}
+
+Double_t CMSLazyChannelPdf::expectedEvents(const RooArgSet* nset) const {
+  RooAbsPdf* pdf = channelPdf();
+  return pdf->expectedEvents(nset ? nset : normSet_);
+}
+
+Int_t CMSLazyChannelPdf::getAnalyticalIntegral(RooArgSet& allVars, RooArgSet& analVars,
+                                               const char* /*rangeName*/) const {
+  // the value is already normalized over all the observables of the channel
+  std::set<std::string> names;
+  std::unique_ptr<TIterator> iter(allVars.createIterator());
+  for (RooAbsArg* a = (RooAbsArg*)iter->Next(); a != 0; a = (RooAbsArg*)iter->Next()) names.insert(a->GetName());
+  for (int i = 0, n = obs_.getSize(); i < n; ++i) {
+    if (names.count(obs_.at(i)->GetName()) == 0) return 0;
+  }
+  analVars.add(obs_);
+  return 1;
+}
+
+Double_t CMSLazyChannelPdf::analyticalIntegral(Int_t code, const char* /*rangeName*/) const {
+  if (code != 1) throw std::logic_error("CMSLazyChannelPdf: unknown integration code");
+  return 1.0;
+}
+
+Bool_t CMSLazyChannelPdf::redirectServersHook(const RooAbsCollection& newServerList, Bool_t mustReplaceAll,
+                                              Bool_t nameChange, Bool_t isRecursive) {
+  // a model already read depends on the old observables and parameters: move it to the new ones too
+  if (pdf_) {
+    pdf_->recursiveRedirectServers(newServerList, false, nameChange);
+    delete normSet_;
+    normSet_ = new RooArgSet(obs_);
+  }
+  return RooAbsPdf::redirectServersHook(newServerList, mustReplaceAll, nameChange, isRecursive);
+}
+
+ClassImp(CMSLazyChannelPdf)
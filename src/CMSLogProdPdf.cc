@@ -0,0 +1,13 @@
+#include "HiggsAnalysis/CombinedLimit/interface/CMSLogProdPdf.h"
+#include "RooLinkedListIter.h"
+
+Double_t CMSLogProdPdf::getLogVal(const RooArgSet* set) const {
+  double ret = 0;
+  RooFIter iter = pdfList().fwdIterator();
+  for (RooAbsArg* a = iter.next(); a != 0; a = iter.next()) {
+    ret += static_cast<RooAbsPdf*>(a)->getLogVal(set);
+  }
+  return ret;
+}
+
+ClassImp(CMSLogProdPdf)
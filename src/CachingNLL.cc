@@ -13,6 +13,8 @@
 #include <HiggsAnalysis/CombinedLimit/interface/CMSHistFunc.h>
 #include <HiggsAnalysis/CombinedLimit/interface/CMSHistErrorPropagator.h>
 #include <HiggsAnalysis/CombinedLimit/interface/CMSHistFuncWrapper.h>
+#include <HiggsAnalysis/CombinedLimit/interface/CMSLazyChannelPdf.h>
+#include <HiggsAnalysis/CombinedLimit/interface/RooSimultaneousOpt.h>
 #include <HiggsAnalysis/CombinedLimit/interface/VectorizedGaussian.h>
 #include <HiggsAnalysis/CombinedLimit/interface/VectorizedCB.h>
 #include <HiggsAnalysis/CombinedLimit/interface/VectorizedSimplePdfs.h>
@@ -909,6 +911,10 @@ cacheutils::CachingSimNLL::setup_()
                 constrainPdfsFastPoisson_.push_back(static_cast<SimplePoissonConstraint *>(pdfi));
                 constrainPdfsFastPoissonOwned_.push_back(false);
                 constrainZeroPointsFastPoisson_.push_back(0);
+            } else if (typeid(*pdfi) == typeid(SimpleGaussianConstraintBlock)) {
+                // always use the log of the block, as its normalized value would underflow
+                constrainPdfsFastBlock_.push_back(static_cast<SimpleGaussianConstraintBlock *>(pdfi));
+                constrainZeroPointsFastBlock_.push_back(0);
             } else if (FastConstraints) {
                 if (typeid(*pdfi) == typeid(RooGaussian)) {
                      RooAbsPdf *opt = SimpleGaussianConstraint::make(static_cast<RooGaussian&>(*pdfi));
@@ -958,6 +964,7 @@ cacheutils::CachingSimNLL::setup_()
     
     std::auto_ptr<RooAbsCategoryLValue> catClone((RooAbsCategoryLValue*) simpdf->indexCat().Clone());
     pdfs_.resize(catClone->numBins(NULL), 0);
+    lazyPdfs_.resize(pdfs_.size(), 0);
     //dataSets_.reset(dataOriginal_->split(pdfOriginal_->indexCat(), true));
     datasets_.resize(pdfs_.size(), 0);
     splitWithWeights(*dataOriginal_, simpdf->indexCat(), true);
@@ -970,18 +977,51 @@ cacheutils::CachingSimNLL::setup_()
             //RooAbsData *data = (RooAbsData *) dataSets_->FindObject(catClone->getLabel());
             //std::cout << "   bin " << ib << " (label " << catClone->getLabel() << ") has pdf " << pdf->GetName() << " of type " << pdf->ClassName() << " and " << (data ? data->numEntries() : -1) << " dataset entries" << std::endl;
             if (data == 0) { throw std::logic_error("Error: no data"); }
-            bool includeZeroWeights = (runtimedef::get("ADDNLL_ROOREALSUM_BASICINT") && runtimedef::get("ADDNLL_ROOREALSUM_KEEPZEROS") && (dynamic_cast<RooRealSumPdf*>(pdf)!=0));
-            pdfs_[ib] = new CachingAddNLL(catClone->getLabel(), "", pdf, data, includeZeroWeights);
-            params_.add(pdfs_[ib]->params(), /*silent=*/true); 
+            CMSLazyChannelPdf *lazy = dynamic_cast<CMSLazyChannelPdf *>(pdf);
+            if (lazy != 0 && !lazy->isLoaded()) {
+                // the channel is read below, unless it is masked
+                lazyPdfs_[ib] = lazy;
+                std::auto_ptr<RooArgSet> params(lazy->getParameters(*data));
+                params_.add(*params, /*silent=*/true);
+                continue;
+            }
+            setupChannel_(ib, catClone->getLabel(), CMSLazyChannelPdf::resolve(pdf));
         } else { 
             pdfs_[ib] = 0; 
             //std::cout << "   bin " << ib << " (label " << catClone->getLabel() << ") has no pdf" << std::endl;
         }
     }   
+    RooSimultaneousOpt *simopt = dynamic_cast<RooSimultaneousOpt *>(pdfOriginal_);
+    if (simopt) setupLazyChannels_(simopt->channelMasks());
+    else setupLazyChannels_(RooArgList());
 
     setValueDirty();
 }
 
+void
+cacheutils::CachingSimNLL::setupChannel_(int ib, const char *label, RooAbsPdf *pdf)
+{
+    RooAbsData *data = (RooAbsData *) datasets_[ib];
+    bool includeZeroWeights = (runtimedef::get("ADDNLL_ROOREALSUM_BASICINT") && runtimedef::get("ADDNLL_ROOREALSUM_KEEPZEROS") && (dynamic_cast<RooRealSumPdf*>(pdf)!=0));
+    pdfs_[ib] = new CachingAddNLL(label, "", pdf, data, includeZeroWeights);
+    params_.add(pdfs_[ib]->params(), /*silent=*/true); 
+}
+
+void
+cacheutils::CachingSimNLL::setupLazyChannels_(const RooArgList &masks)
+{
+    // read the channels that are not masked (masks is empty or aligned with the vector of pdfs)
+    std::auto_ptr<RooAbsCategoryLValue> catClone((RooAbsCategoryLValue*) pdfOriginal_->indexCat().Clone());
+    for (int ib = 0, nb = lazyPdfs_.size(); ib < nb; ++ib) {
+        if (lazyPdfs_[ib] == 0) continue;
+        if (ib < masks.getSize() && static_cast<RooAbsReal*>(masks.at(ib))->getVal() != 0.) continue;
+        catClone->setBin(ib);
+        CMSLazyChannelPdf *lazy = lazyPdfs_[ib];
+        lazyPdfs_[ib] = 0;
+        setupChannel_(ib, catClone->getLabel(), lazy->channelPdf());
+    }
+}
+
 Double_t 
 cacheutils::CachingSimNLL::evaluate() const 
 {
@@ -997,19 +1037,22 @@ cacheutils::CachingSimNLL::evaluate() const
     DefaultAccumulator<double> ret = 0;
     unsigned idx = 0;
     for (std::vector<CachingAddNLL*>::const_iterator it = pdfs_.begin(), ed = pdfs_.end(); it != ed; ++it, ++idx) {
+        if (channelMasks_.size() > 0 && channelMasks_[idx]->getVal() != 0.) {
+            // std::cout << "Channel " << (*it)->GetName() << " will be masked as " 
+            //     << channelMasks_[idx]->GetName() << " evalutes to " 
+            //     << channelMasks_[idx]->getVal() << "\n";
+            continue;
+        }
+        if (*it == 0 && lazyPdfs_[idx] != 0) {
+            throw std::logic_error(std::string("CachingSimNLL: channel ") + lazyPdfs_[idx]->GetName() + " was masked when it was set up and has not been read: set the channel masks again after unmasking it");
+        }
         if (*it != 0) {
-            if (channelMasks_.size() > 0 && channelMasks_[idx]->getVal() != 0.) {
-                // std::cout << "Channel " << (*it)->GetName() << " will be masked as " 
-                //     << channelMasks_[idx]->GetName() << " evalutes to " 
-                //     << channelMasks_[idx]->getVal() << "\n";
-                continue;
-            }
             double nllval = (*it)->getVal();
             // what sanity check could I put here?
             ret += nllval;
         }
     }
-    if (!constrainPdfs_.empty() || !constrainPdfsFast_.empty()) {
+    if (!constrainPdfs_.empty() || !constrainPdfsFast_.empty() || !constrainPdfsFastBlock_.empty()) {
         DefaultAccumulator<double> ret2 = 0;
         /// ============= GENERIC CONSTRAINTS  =========
         std::vector<double>::const_iterator itz = constrainZeroPoints_.begin();
@@ -1038,6 +1081,11 @@ cacheutils::CachingSimNLL::evaluate() const
             //std::cout << "pdf " << (*it)->GetName() << " = " << logpdfval << std::endl;
             ret2 += (logpdfval + *itz);
         }
+        /// ============= BLOCKS OF FAST GAUSSIAN CONSTRAINTS  =========
+        itz = constrainZeroPointsFastBlock_.begin();
+        for (std::vector<SimpleGaussianConstraintBlock*>::const_iterator it = constrainPdfsFastBlock_.begin(), ed = constrainPdfsFastBlock_.end(); it != ed; ++it, ++itz) { 
+            ret2 += ((*it)->getLogValFast() + *itz);
+        }
         ret -= ret2.sum();
     }
 #ifdef TRACE_NLL_EVALS
@@ -1137,6 +1185,10 @@ void cacheutils::CachingSimNLL::setZeroPoint() {
         double logpdfval = (*it)->getLogValFast();
         *itz = -logpdfval;
     }
+    itz = constrainZeroPointsFastBlock_.begin();
+    for (std::vector<SimpleGaussianConstraintBlock*>::const_iterator it = constrainPdfsFastBlock_.begin(), ed = constrainPdfsFastBlock_.end(); it != ed; ++it, ++itz) {
+        *itz = -(*it)->getLogValFast();
+    }
     setValueDirty();
 }
 
@@ -1147,6 +1199,7 @@ void cacheutils::CachingSimNLL::clearZeroPoint() {
     std::fill(constrainZeroPoints_.begin(), constrainZeroPoints_.end(), 0.0);
     std::fill(constrainZeroPointsFast_.begin(), constrainZeroPointsFast_.end(), 0.0);
     std::fill(constrainZeroPointsFastPoisson_.begin(), constrainZeroPointsFastPoisson_.end(), 0.0);
+    std::fill(constrainZeroPointsFastBlock_.begin(), constrainZeroPointsFastBlock_.end(), 0.0);
     setValueDirty();
 }
 
@@ -1169,6 +1222,7 @@ void cacheutils::CachingSimNLL::setChannelMasks(const RooArgList &args) {
         vars.push_back(var);
     }
     channelMasks_ = vars;
+    setupLazyChannels_(args);
 }
 
 void cacheutils::CachingSimNLL::setAnalyticBarlowBeeston(bool flag) {
@@ -1178,7 +1232,7 @@ void cacheutils::CachingSimNLL::setAnalyticBarlowBeeston(bool flag) {
         printf(">> Disabling analytic minimisation of bin-wise statistical uncertainty parameters\n");
     }
     for (int ib = 0, nb = pdfs_.size(); ib < nb; ++ib) {
-        pdfs_[ib]->setAnalyticBarlowBeeston(flag);
+        if (pdfs_[ib] != 0) pdfs_[ib]->setAnalyticBarlowBeeston(flag);
     }
 }
 
@@ -55,6 +55,8 @@
 #include "HiggsAnalysis/CombinedLimit/interface/utils.h"
 #include "HiggsAnalysis/CombinedLimit/interface/CloseCoutSentry.h"
 #include "HiggsAnalysis/CombinedLimit/interface/RooSimultaneousOpt.h"
+#include "HiggsAnalysis/CombinedLimit/interface/SimpleGaussianConstraintBlock.h"
+#include "HiggsAnalysis/CombinedLimit/interface/CMSLazyChannelPdf.h"
 #include "HiggsAnalysis/CombinedLimit/interface/ToyMCSamplerOpt.h"
 #include "HiggsAnalysis/CombinedLimit/interface/AsimovUtils.h"
 #include "HiggsAnalysis/CombinedLimit/interface/CascadeMinimizer.h"
@@ -304,6 +306,13 @@ void Combine::run(TString hlfFile, const std::string &dataset, double &limit, do
         std::cerr << "Could not find workspace '" << workspaceName_ << "' in file " << fileToLoad << std::endl; fIn->ls(); 
         throw std::invalid_argument("Missing Workspace"); 
     }
+    // channels stored in their own directories of the file (text2workspace.py --X-lazy-channels) are read from it when first needed
+    RooArgSet allPdfs(w->allPdfs());
+    std::auto_ptr<TIterator> iterPdfs(allPdfs.createIterator());
+    for (RooAbsArg *a = (RooAbsArg *) iterPdfs->Next(); a != 0; a = (RooAbsArg *) iterPdfs->Next()) {
+        CMSLazyChannelPdf *lazy = dynamic_cast<CMSLazyChannelPdf *>(a);
+        if (lazy) lazy->setSource(fIn);
+    }
 
 
     if (verbose > 3) { std::cout << "Input workspace '" << workspaceName_ << "': \n"; w->Print("V"); }
@@ -336,7 +345,9 @@ void Combine::run(TString hlfFile, const std::string &dataset, double &limit, do
         mc->SetPdf(*optpdf);
     }
     if (mc_bonly == 0 && !noMCbonly_) {
-        std::cerr << "Missing background ModelConfig '" << modelConfigNameB_ << "' in workspace '" << workspaceName_ << "' in file " << fileToLoad << std::endl;
+        // text2workspace does not build the background-only model, but saves the signal yields to set to zero to get it
+        const RooArgSet *signalYields = (defineBackgroundOnlyModelParameterExpression_ == "" ? w->set("signalYields") : 0);
+        if (signalYields == 0 || verbose > 1) std::cerr << "Missing background ModelConfig '" << modelConfigNameB_ << "' in workspace '" << workspaceName_ << "' in file " << fileToLoad << std::endl;
         RooCustomizer make_model_s(*mc->GetPdf(),"_model_bonly_");
 
         if (defineBackgroundOnlyModelParameterExpression_ != "") {
@@ -357,6 +368,13 @@ void Combine::run(TString hlfFile, const std::string &dataset, double &limit, do
 		std::cerr << "   " << expr << " to " << expval << std::endl;
 	    }
 	  }
+        } else if (signalYields != 0) {
+          if (verbose > 1) std::cerr << "Will make one from the signal ModelConfig '" << modelConfigName_ << "' setting the " << signalYields->getSize() << " signal yields to zero" << std::endl;
+          w->factory("_zero_[0]");
+          std::auto_ptr<TIterator> iter(signalYields->createIterator());
+          for (RooAbsArg *a = (RooAbsArg*) iter->Next(); a != 0; a = (RooAbsArg*) iter->Next()) {
+              make_model_s.replaceArg(*a, *w->var("_zero_"));
+          }
         } else {
 
 	  std::cerr << "Will make one from the signal ModelConfig '" << modelConfigName_ << "' setting signal strenth '" << POI->first()->GetName() << "' to zero"  << std::endl;
@@ -548,6 +566,7 @@ void Combine::run(TString hlfFile, const std::string &dataset, double &limit, do
 	arg->setConstant(0);
 	// also set ignoreConstraint flag for constraint PDF 
 	if ( w->pdf(Form("%s_Pdf",arg->GetName())) ) w->pdf(Form("%s_Pdf",arg->GetName()))->setAttribute("ignoreConstraint");
+	else if ( arg->getStringAttribute("constraintBlock") && dynamic_cast<SimpleGaussianConstraintBlock *>(w->pdf(arg->getStringAttribute("constraintBlock"))) ) dynamic_cast<SimpleGaussianConstraintBlock *>(w->pdf(arg->getStringAttribute("constraintBlock")))->ignoreConstraint(*arg);
       }
       if (verbose > 0) { std::cout << "Redefining the POIs to be: "; newPOIs.Print(""); }
       mc->SetParametersOfInterest(newPOIs);
@@ -655,7 +655,8 @@ void FitterAlgoBase::optimizeBounds(const RooWorkspace *w, const RooStats::Model
             RooRealVar *rrv = dynamic_cast<RooRealVar *>(a);
             if (rrv != 0) {
                 RooAbsPdf *pdf = w->pdf((std::string(a->GetName())+"_Pdf").c_str());
-                if (pdf != 0 && dynamic_cast<RooGaussian *>(pdf) != 0) {
+                // the unit Gaussian constraints can also be in a SimpleGaussianConstraintBlock, which marks its parameters
+                if ((pdf != 0 && dynamic_cast<RooGaussian *>(pdf) != 0) || rrv->getStringAttribute("constraintBlock") != 0) {
                     rrv->removeMin();
                     rrv->removeMax();
                 }
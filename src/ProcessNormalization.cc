@@ -43,8 +43,8 @@ void ProcessNormalization::addLogNormal(double kappa, RooAbsReal &theta) {
     }
 }
 
-void ProcessNormalization::addAsymmLogNormal(double kappaLo, double kappaHi, RooAbsReal &theta) {
-    if (fabs(kappaLo*kappaHi - 1) < 1e-5) {
+void ProcessNormalization::addAsymmLogNormal(double kappaLo, double kappaHi, RooAbsReal &theta, bool exact) {
+    if (!exact && fabs(kappaLo*kappaHi - 1) < 1e-5) {
         addLogNormal(kappaHi, theta);
     } else {
         logAsymmKappa_.push_back(std::make_pair(std::log(kappaLo), std::log(kappaHi)));
@@ -0,0 +1,162 @@
+#include "HiggsAnalysis/CombinedLimit/interface/SimpleGaussianConstraintBlock.h"
+
+#include <cmath>
+#include <algorithm>
+#include <memory>
+#include <set>
+#include <string>
+#include <stdexcept>
+#include <RooRealVar.h>
+#include <RooRandom.h>
+#include "Math/ProbFuncMathCore.h"
+
+namespace {
+    /// true if set contains all the elements of list (by name)
+    bool containsAll(const RooAbsCollection &set, const RooArgList &list) {
+        if (list.getSize() == 0 || set.getSize() < list.getSize()) return false;
+        std::set<std::string> names;
+        std::auto_ptr<TIterator> iter(set.createIterator());
+        for (RooAbsArg *a = (RooAbsArg *) iter->Next(); a != 0; a = (RooAbsArg *) iter->Next()) names.insert(a->GetName());
+        for (int i = 0, n = list.getSize(); i < n; ++i) {
+            if (names.count(list.at(i)->GetName()) == 0) return false;
+        }
+        return true;
+    }
+}
+
+SimpleGaussianConstraintBlock::SimpleGaussianConstraintBlock(const char *name, const char *title, const RooArgList &x, const RooArgList &mean) :
+    RooAbsPdf(name,title),
+    x_("x","nuisances",this),
+    mean_("mean","global observables",this),
+    initialized_(false)
+{
+    if (x.getSize() != mean.getSize()) {
+        throw std::invalid_argument(std::string("SimpleGaussianConstraintBlock created with different numbers of parameters and global observables: ") + name);
+    }
+    x_.add(x);
+    mean_.add(mean);
+}
+
+SimpleGaussianConstraintBlock::SimpleGaussianConstraintBlock(const SimpleGaussianConstraintBlock& other, const char* name) :
+    RooAbsPdf(other, name),
+    x_("x",this,other.x_),
+    mean_("mean",this,other.mean_),
+    ignored_(other.ignored_),
+    initialized_(false)
+{
+}
+
+void SimpleGaussianConstraintBlock::initialize() const {
+    if (initialized_) return;
+    unsigned int n = x_.getSize();
+    vx_.resize(n); vmean_.resize(n);
+    xvals_.resize(n); meanvals_.resize(n);
+    weights_.assign(n, 1.0);
+    for (unsigned int i = 0; i < n; ++i) {
+        vx_[i] = dynamic_cast<RooAbsReal *>(x_.at(i));
+        vmean_[i] = dynamic_cast<RooAbsReal *>(mean_.at(i));
+        if (vx_[i] == 0 || vmean_[i] == 0) throw std::invalid_argument(std::string("SimpleGaussianConstraintBlock with a non-real parameter: ") + GetName());
+    }
+    for (std::vector<int>::const_iterator it = ignored_.begin(), ed = ignored_.end(); it != ed; ++it) weights_[*it] = 0.0;
+    // as for separate constraint pdfs, the attribute ignoreConstraint (here set on the parameter) drops the constraint
+    for (unsigned int i = 0; i < n; ++i) {
+        if (vx_[i]->getAttribute("ignoreConstraint")) weights_[i] = 0.0;
+    }
+    initialized_ = true;
+}
+
+double SimpleGaussianConstraintBlock::evaluateLog() const {
+    initialize();
+    const unsigned int n = vx_.size();
+    if (n == 0) return 0;
+    for (unsigned int i = 0; i < n; ++i) {
+        xvals_[i] = vx_[i]->getVal();
+        meanvals_[i] = vmean_[i]->getVal();
+    }
+    // plain loop over contiguous arrays, which the compiler can vectorize
+    const double *x = &xvals_[0], *mean = &meanvals_[0], *w = &weights_[0];
+    double ret = 0;
+    for (unsigned int i = 0; i < n; ++i) {
+        double d = x[i] - mean[i];
+        ret += w[i]*d*d;
+    }
+    return -0.5*ret;
+}
+
+Double_t SimpleGaussianConstraintBlock::evaluate() const {
+    return std::exp(getLogValFast());
+}
+
+Double_t SimpleGaussianConstraintBlock::getLogVal(const RooArgSet* set) const {
+    // the normalization is computed in log space, as the product of the integrals of many terms easily overflows
+    if (set == 0) return getLogValFast();
+    std::auto_ptr<RooArgSet> deps(getObservables(set));
+    if (deps->getSize() == 0) return getLogValFast();
+    RooArgSet anal;
+    Int_t code = getAnalyticalIntegral(*deps, anal, normRange());
+    if (code == 0) return RooAbsPdf::getLogVal(set);
+    initialize();
+    double logNorm = 0;
+    const RooArgList &vars = (code == 1 ? x_ : mean_), &others = (code == 1 ? mean_ : x_);
+    for (int i = 0, n = vars.getSize(); i < n; ++i) {
+        if (weights_[i] == 0) continue;
+        const RooRealVar &v = static_cast<const RooRealVar &>(*vars.at(i));
+        double c = static_cast<const RooAbsReal &>(*others.at(i)).getVal();
+        logNorm += std::log(std::sqrt(2*M_PI)*(ROOT::Math::normal_cdf(v.getMax(normRange())-c) - ROOT::Math::normal_cdf(v.getMin(normRange())-c)));
+    }
+    return getLogValFast() - logNorm;
+}
+
+Int_t SimpleGaussianConstraintBlock::getAnalyticalIntegral(RooArgSet& allVars, RooArgSet& analVars, const char* rangeName) const {
+    // either over all the parameters, or over all the global observables (the other variables being constants then)
+    if (allVars.getSize() == x_.getSize() && containsAll(allVars, x_)) { analVars.add(x_); return 1; }
+    if (allVars.getSize() == mean_.getSize() && containsAll(allVars, mean_)) { analVars.add(mean_); return 2; }
+    return 0;
+}
+
+Double_t SimpleGaussianConstraintBlock::analyticalIntegral(Int_t code, const char* rangeName) const {
+    initialize();
+    const RooArgList &vars = (code == 1 ? x_ : mean_), &others = (code == 1 ? mean_ : x_);
+    double ret = 1;
+    for (int i = 0, n = vars.getSize(); i < n; ++i) {
+        if (weights_[i] == 0) continue;
+        const RooRealVar &v = static_cast<const RooRealVar &>(*vars.at(i));
+        double c = static_cast<const RooAbsReal &>(*others.at(i)).getVal();
+        ret *= std::sqrt(2*M_PI)*(ROOT::Math::normal_cdf(v.getMax(rangeName)-c) - ROOT::Math::normal_cdf(v.getMin(rangeName)-c));
+    }
+    return ret;
+}
+
+Int_t SimpleGaussianConstraintBlock::getGenerator(const RooArgSet& directVars, RooArgSet &generateVars, Bool_t staticInitOK) const {
+    if (containsAll(directVars, mean_)) { generateVars.add(mean_); return 1; }
+    if (containsAll(directVars, x_)) { generateVars.add(x_); return 2; }
+    return 0;
+}
+
+void SimpleGaussianConstraintBlock::generateEvent(Int_t code) {
+    RooListProxy &vars = (code == 1 ? mean_ : x_), &others = (code == 1 ? x_ : mean_);
+    for (int i = 0, n = vars.getSize(); i < n; ++i) {
+        RooRealVar &v = static_cast<RooRealVar &>(vars[i]);
+        double c = static_cast<RooAbsReal &>(others[i]).getVal();
+        double val;
+        do { val = RooRandom::randomGenerator()->Gaus(c, 1.0); } while (val < v.getMin() || val > v.getMax());
+        v.setVal(val);
+    }
+}
+
+bool SimpleGaussianConstraintBlock::ignoreConstraint(const RooAbsArg &x) {
+    int i = x_.index(x.GetName());
+    if (i < 0) return false;
+    if (std::find(ignored_.begin(), ignored_.end(), i) == ignored_.end()) ignored_.push_back(i);
+    x_.at(i)->setAttribute("ignoreConstraint");
+    initialized_ = false;
+    setValueDirty();
+    return true;
+}
+
+Bool_t SimpleGaussianConstraintBlock::redirectServersHook(const RooAbsCollection& newServerList, Bool_t mustReplaceAll, Bool_t nameChange, Bool_t isRecursive) {
+    initialized_ = false; // the cached pointers to the parameters are no longer valid
+    return RooAbsPdf::redirectServersHook(newServerList, mustReplaceAll, nameChange, isRecursive);
+}
+
+ClassImp(SimpleGaussianConstraintBlock)
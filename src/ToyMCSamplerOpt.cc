@@ -14,6 +14,9 @@
 #include <RooDataSet.h>
 #include <RooRandom.h>
 #include <HiggsAnalysis/CombinedLimit/interface/ProfilingTools.h>
+#include <HiggsAnalysis/CombinedLimit/interface/CMSCountingPdf.h>
+#include <HiggsAnalysis/CombinedLimit/interface/CMSLazyChannelPdf.h>
+#include <HiggsAnalysis/CombinedLimit/interface/RooSimultaneousOpt.h>
 #include "RooStats/DetailedOutputAggregator.h"
 
 using namespace std;
@@ -269,11 +272,14 @@ toymcoptutils::SinglePdfGenInfo::generateCountingAsimov()
     RooArgSet obs(observables_);
     RooProdPdf *prod = dynamic_cast<RooProdPdf *>(pdf_);
     RooPoisson *pois = 0;
+    CMSCountingPdf *counting = 0;
     if (prod != 0) {
         setToExpected(*prod, observables_);
     } else if ((pois = dynamic_cast<RooPoisson *>(pdf_)) != 0) {
         setToExpected(*pois, observables_);
-    } else throw std::logic_error("A counting model pdf must be either a RooProdPdf or a RooPoisson");
+    } else if ((counting = dynamic_cast<CMSCountingPdf *>(pdf_)) != 0) {
+        counting->setToExpected();
+    } else throw std::logic_error("A counting model pdf must be either a RooProdPdf, a RooPoisson or a CMSCountingPdf");
     RooDataSet *ret = new RooDataSet(TString::Format("%sData", pdf_->GetName()), "", obs);
     ret->add(obs);
     return ret;
@@ -286,12 +292,15 @@ toymcoptutils::SinglePdfGenInfo::setToExpected(RooProdPdf &prod, RooArgSet &obs)
     for (RooAbsArg *a = (RooAbsArg *) iter->Next(); a != 0; a = (RooAbsArg *) iter->Next()) {
         if (!a->dependsOn(obs)) continue;
         RooPoisson *pois = 0;
+        CMSCountingPdf *counting = 0;
         if ((pois = dynamic_cast<RooPoisson *>(a)) != 0) {
             setToExpected(*pois, obs);
+        } else if ((counting = dynamic_cast<CMSCountingPdf *>(a)) != 0) {
+            counting->setToExpected();
         } else {
             RooProdPdf *subprod = dynamic_cast<RooProdPdf *>(a);
             if (subprod) setToExpected(*subprod, obs);
-            else throw std::logic_error("Illegal term in counting model: depends on observables, but not Poisson or Product");
+            else throw std::logic_error("Illegal term in counting model: depends on observables, but not Poisson, CMSCountingPdf or Product");
         }
     }
 }
@@ -331,10 +340,17 @@ toymcoptutils::SimPdfGenInfo::SimPdfGenInfo(RooAbsPdf &pdf, const RooArgSet& obs
         int nbins = cat_->numBins((const char *)0);
         pdfs_.resize(nbins, 0);
         RooArgList dummy;
+        RooSimultaneousOpt *simOpt = dynamic_cast<RooSimultaneousOpt *>(simPdf);
         for (int ic = 0; ic < nbins; ++ic) {
             cat_->setBin(ic);
             RooAbsPdf *pdfi = simPdf->getPdf(cat_->getLabel());
             if (pdfi == 0) throw std::logic_error(std::string("Unmapped category state: ") + cat_->getLabel());
+            CMSLazyChannelPdf *lazy = dynamic_cast<CMSLazyChannelPdf *>(pdfi);
+            if (lazy != 0 && !lazy->isLoaded() && simOpt != 0 && ic < simOpt->channelMasks().getSize() && 
+                    static_cast<RooAbsReal *>(simOpt->channelMasks().at(ic))->getVal() != 0.) {
+                continue; // a masked channel that was not read: no events are generated for it, as the NLL skips it
+            }
+            pdfi = CMSLazyChannelPdf::resolve(pdfi); // toys are generated from the model of the channel itself
             RooAbsPdf *newpdf = utils::factorizePdf(observables, *pdfi, dummy);
             pdfs_[ic] = new SinglePdfGenInfo(*newpdf, observables, preferBinned);
             if (newpdf != 0 && newpdf != pdfi) {
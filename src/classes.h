@@ -27,6 +27,7 @@
 #include "HiggsAnalysis/CombinedLimit/interface/RooMultiPdf.h"
 #include "HiggsAnalysis/CombinedLimit/interface/RooBernsteinFast.h"
 #include "HiggsAnalysis/CombinedLimit/interface/SimpleGaussianConstraint.h"
+#include "HiggsAnalysis/CombinedLimit/interface/SimpleGaussianConstraintBlock.h"
 #include "HiggsAnalysis/CombinedLimit/interface/SimplePoissonConstraint.h"
 #include "HiggsAnalysis/CombinedLimit/interface/AtlasPdfs.h"
 #include "HiggsAnalysis/CombinedLimit/interface/FastTemplateFunc.h"
@@ -52,6 +53,9 @@
 #include "HiggsAnalysis/CombinedLimit/interface/CMSHistFunc.h"
 #include "HiggsAnalysis/CombinedLimit/interface/CMSHistErrorPropagator.h"
 #include "HiggsAnalysis/CombinedLimit/interface/CMSHistFuncWrapper.h"
+#include "HiggsAnalysis/CombinedLimit/interface/CMSCountingPdf.h"
+#include "HiggsAnalysis/CombinedLimit/interface/CMSLogProdPdf.h"
+#include "HiggsAnalysis/CombinedLimit/interface/CMSLazyChannelPdf.h"
 
 #include "HiggsAnalysis/CombinedLimit/interface/RooPiecewisePolynomial.h"
 
@@ -1,5 +1,6 @@
 #include "HiggsAnalysis/CombinedLimit/interface/utils.h"
 #include "HiggsAnalysis/CombinedLimit/interface/RooSimultaneousOpt.h"
+#include "HiggsAnalysis/CombinedLimit/interface/CMSLogProdPdf.h"
 
 #include <cstdio>
 #include <iostream>
@@ -111,7 +112,7 @@ void utils::printPdf(RooWorkspace *w, const char *pdfName) {
 RooAbsPdf *utils::factorizePdf(const RooArgSet &observables, RooAbsPdf &pdf, RooArgList &constraints) {
     assert(&pdf);
     const std::type_info & id = typeid(pdf);
-    if (id == typeid(RooProdPdf)) {
+    if (id == typeid(RooProdPdf) || id == typeid(CMSLogProdPdf)) {
         //std::cout << " pdf is product pdf " << pdf.GetName() << std::endl;
         RooProdPdf *prod = dynamic_cast<RooProdPdf *>(&pdf);
         RooArgList newFactors; RooArgSet newOwned;
@@ -190,7 +191,7 @@ void utils::factorizePdf(RooStats::ModelConfig &model, RooAbsPdf &pdf, RooArgLis
 void utils::factorizePdf(const RooArgSet &observables, RooAbsPdf &pdf, RooArgList &obsTerms, RooArgList &constraints, bool debug) {
     assert(&pdf);
     const std::type_info & id = typeid(pdf);
-    if (id == typeid(RooProdPdf)) {
+    if (id == typeid(RooProdPdf) || id == typeid(CMSLogProdPdf)) {
         RooProdPdf *prod = dynamic_cast<RooProdPdf *>(&pdf);
         RooArgList list(prod->pdfList());
         for (int i = 0, n = list.getSize(); i < n; ++i) {
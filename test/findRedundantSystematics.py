@@ -20,7 +20,7 @@ from operator import div
 # You can get the matrix by parsing the datacard in python (simplest
 # example is test/datacardDump.py) and then looping on DC.systs which is
 # a tuple (lsyst,nofloat,pdf,pdfargs,errline); lsyst is the name,
-# errline is a map that gives you kappa[channel][process].
+# errline is a map that gives you kappa[channel][process] (0 if there is no effect).
 
 def filterForPDFType(allSysts, type):
     filteredSysts = filter(lambda x: x[2] == type, allSysts)
@@ -97,7 +97,7 @@ def asymDivideMixed(elementAndList):
 
 
     
-def lnN_redundancies(allSysts):
+def lnN_redundancies(allSysts, exp):
     systs = filterForPDFType(allSysts,'lnN')
 
     systsDict = dict(
@@ -108,8 +108,8 @@ def lnN_redundancies(allSysts):
         )
 
     nuisNames = [ s[0] for s in systs ]
-    channelNames = systs[0][4].keys()
-    processNames = systs[0][4][channelNames[0]].keys()
+    # channels and processes are taken from the rates: an errline may keep only the processes with a non-null effect
+    channelNames = exp.keys()
 
     nuisPairs = combinations(nuisNames, 2)
 
@@ -121,7 +121,7 @@ def lnN_redundancies(allSysts):
         #print 'Checking', pair 
         kappaRatios[pair] = list()
         for channel in channelNames:
-            for process in processNames:
+            for process in exp[channel].keys():
                 kappas = map(lambda nuis: systsDict[nuis][channel][process], pair)
 
                 #print 'Kappas in ', channel, process
@@ -204,6 +204,6 @@ if __name__ == '__main__':
         
     DC = parseCard(file, options)
 
-    lnN_redundancies(DC.systs)
+    lnN_redundancies(DC.systs, DC.exp)
     
 
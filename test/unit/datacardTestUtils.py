@@ -0,0 +1,26 @@
+# Helpers shared by the python unit tests of the datacards: parse a card with the datacard options of the command line
+# tools, and list its nuisance effects in the same way whatever the storage of their errlines.
+import os
+from optparse import OptionParser
+from HiggsAnalysis.CombinedLimit.DatacardParser import addDatacardParserOptions, parseCard
+
+top = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+tutorials = os.path.join(top, "data", "tutorials")
+
+def script(name):
+    return os.path.join(top, "scripts", name)
+
+def parse(fname, args=[]):
+    """Parse a datacard file (binary if its name ends with .npz) with the datacard options given as command line arguments"""
+    parser = OptionParser()
+    addDatacardParserOptions(parser)
+    (options, rest) = parser.parse_args(args)
+    return parseCard(open(fname, "rb" if fname.endswith(".npz") else "r"), options)
+
+def effects(errline):
+    """{ (bin, process) : effect } of the non-null effects of a nuisance line, or the arguments of a param line"""
+    if type(errline) == list: return errline # param lines
+    return dict([ ((b,p),(map(float,v) if type(v) == list else float(v))) for b in errline for (p,v) in errline[b].items() if v != 0 ])
+
+def nuisances(dc):
+    return [ (n,nf,pdf,args,effects(e)) for (n,nf,pdf,args,e) in dc.systs ]
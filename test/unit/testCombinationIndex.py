@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# The combination index of combineCards.py (--index): combining again with the index must give the same card as a
+# combination from scratch, parsing only the cards that changed, and all of them if a changed card brings other
+# processes or nuisances, or if the list of cards changed.
+# Run as: python test/unit/testCombinationIndex.py
+import os, shutil, tempfile, unittest
+from optparse import Values
+from cStringIO import StringIO
+from datacardTestUtils import tutorials
+import HiggsAnalysis.CombinedLimit.DatacardCombiner as DatacardCombiner
+
+inputs = [ "counting/realistic-multi-channel.txt", "shapes/simple-shapes-TH1.txt", "counting/simple-counting-experiment.txt" ]
+
+class TestCombinationIndex(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        for f in inputs: shutil.copy(os.path.join(tutorials, f), self.dir)
+        self.cards = [ (os.path.join(self.dir, os.path.basename(f)), label) for (f,label) in zip(inputs, "abc") ]
+        self.index = os.path.join(self.dir, "index")
+        # the options set by combineCards.py
+        self.options = Values(dict(bin=True, stat=False, shape=False, nuisancesToExclude=[], verbose=0, allowNoSignal=True, allowNoBackground=True,
+                                   evaluateEdits=False, noJMax=False, channelVetos=[], channelIncludes=[], datacardCache=None))
+        self.parsed = []
+        self.relabelCard = DatacardCombiner.relabelCard
+        def relabelCard(fname, label, options, DC=None):
+            self.parsed.append(label)
+            return self.relabelCard(fname, label, options, DC)
+        DatacardCombiner.relabelCard = relabelCard
+
+    def tearDown(self):
+        DatacardCombiner.relabelCard = self.relabelCard
+        shutil.rmtree(self.dir)
+
+    def text(self, combination):
+        out = StringIO()
+        combination.write(out, [ "%s=%s" % (l,f) for (f,l) in self.cards ])
+        return out.getvalue()
+
+    def combine(self, parsed):
+        """Combine with the index, checking the labels of the cards that are parsed, and return the combined card"""
+        self.parsed = []
+        text = self.text(DatacardCombiner.CombinationIndex(self.index, self.options).combine(self.cards))
+        self.assertEqual(self.parsed, parsed)
+        combination = DatacardCombiner.CardCombination()
+        for card in DatacardCombiner.relabelCards(self.cards, self.options): combination.add(card)
+        self.assertEqual(text, self.text(combination))
+        return text
+
+    def edit(self, label, old, new):
+        fname = dict([ (l,f) for (f,l) in self.cards ])[label]
+        content = open(fname).read()
+        self.assertTrue(old in content)
+        open(fname, "w").write(content.replace(old, new))
+
+    def columns(self):
+        return sorted([ f for f in os.listdir(self.dir) if f.startswith("index.columns.") ])
+
+    def testIncremental(self):
+        first = self.combine([ "a", "b", "c" ])
+        self.assertEqual(self.combine([]), first)
+        self.edit("c", "rate           4.76  1.47", "rate           4.76  2.50")
+        self.edit("c", "deltaB  lnN      -   1.50", "deltaB  lnN      -   1.35")
+        self.assertNotEqual(self.combine([ "c" ]), first)
+        self.edit("a", "lumi    lnN   1.11     -", "lumi    lnN   1.12345678     -")
+        self.combine([ "a" ])
+        self.assertEqual(self.columns(), [ "index.columns.1" ])
+
+    def testRebuild(self):
+        self.combine([ "a", "b", "c" ])
+        # a new nuisance
+        self.edit("c", "kmax 2", "kmax 3")
+        self.edit("c", "deltaB  lnN      -   1.50", "deltaB  lnN      -   1.50\ndeltaC  lnN    1.1     -")
+        self.combine([ "c", "a", "b" ])
+        self.assertEqual(self.columns(), [ "index.columns.2" ])
+        # a new process
+        self.edit("c", "ggh4G  Bckg ", "ggh4G  Bckg2")
+        self.combine([ "c", "a", "b" ])
+        # other cards
+        self.cards = self.cards[:2]
+        self.combine([ "a", "b" ])
+        self.assertEqual(self.columns(), [ "index.columns.4" ])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# The combined datacard written by combineCards.py must have, for every input card, the same observations, rates and
+# nuisance effects under the relabelled bin names; parsing the input cards in parallel (-j) must not change the output,
+# and the binary output (--npz) must be the same datacard as the text one.
+# Run as: python test/unit/testCombineCards.py
+import os, shutil, subprocess, sys, tempfile, unittest
+from datacardTestUtils import tutorials, script, parse, nuisances
+
+cards = [ ("a", "counting/realistic-multi-channel.txt"), ("b", "shapes/simple-shapes-TH1.txt"), ("c", "counting/simple-counting-experiment.txt") ]
+
+def combineCards(*args):
+    return subprocess.check_output([ sys.executable, script("combineCards.py") ] + list(args) + [ "%s=%s" % lc for lc in cards ], cwd=tutorials)
+
+def effectsByName(dc):
+    """{ (nuisance, pdf, bin, process) : effect } of the non-null effects, and the param lines"""
+    ret = {}
+    for (n,nf,pdf,args,e) in nuisances(dc):
+        if pdf == "param": ret[(n,pdf)] = e; continue
+        for (b,p),v in e.iteritems(): ret[(n,pdf,b,p)] = v
+    return ret
+
+class TestCombineCards(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.text = combineCards()
+        self.card = os.path.join(self.dir, "combined.txt")
+        open(self.card, "w").write(self.text)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testContent(self):
+        combined = parse(self.card)
+        cceffects = effectsByName(combined)
+        bins = []
+        for (label, card) in cards:
+            dc = parse(os.path.join(tutorials, card))
+            rename = dict([ (b, label if len(dc.bins) == 1 else "%s_%s" % (label,b)) for b in dc.bins ])
+            bins += [ rename[b] for b in dc.bins ]
+            for b in dc.bins:
+                self.assertEqual(combined.obs[rename[b]], dc.obs[b])
+                self.assertEqual(sorted(combined.exp[rename[b]].keys()), sorted(dc.exp[b].keys()))
+                for p in dc.exp[b]: self.assertAlmostEqual(combined.exp[rename[b]][p], dc.exp[b][p], places=6)
+                for p in dc.exp[b]: self.assertEqual(combined.isSignal[p], dc.isSignal[p])
+            for (n,pdf,b,p),v in [ (k,v) for k,v in effectsByName(dc).iteritems() if k[1] != "param" ]:
+                self.assertEqual(cceffects.pop((n,pdf,rename[b],p)), v, msg="%s %s %s" % (n,b,p))
+        self.assertEqual(combined.bins, bins)
+        self.assertEqual(cceffects, {}) # no effect that was not in the inputs
+
+    def testJobs(self):
+        self.assertEqual(combineCards("-j", "2"), self.text)
+
+    def testNpz(self):
+        npz = os.path.join(self.dir, "combined.npz")
+        combineCards("--npz", npz)
+        text, binary = parse(self.card), parse(npz)
+        for attr in "bins", "obs", "processes", "isSignal", "exp":
+            self.assertEqual(getattr(binary, attr), getattr(text, attr), msg=attr)
+        self.assertEqual(effectsByName(binary), effectsByName(text))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+# The compact backend of the datacard parser (--X-compact-datacard), which keeps the nuisance effects in a
+# columnar store, must give the same datacard as the default one made of nested dicts.
+# Run as: python test/unit/testCompactDatacard.py
+import os, unittest
+from datacardTestUtils import tutorials, parse, nuisances
+
+class TestCompactDatacard(unittest.TestCase):
+    def compare(self, card):
+        ref, compact = parse(os.path.join(tutorials, card)), parse(os.path.join(tutorials, card), [ "--X-compact-datacard" ])
+        self.assertTrue(compact.systMatrix is not None)
+        for attr in "bins", "obs", "processes", "signals", "isSignal", "keyline", "exp", "shapeMap", "flatParamNuisances", "rateParams", "groups":
+            self.assertEqual(getattr(compact, attr), getattr(ref, attr), msg="%s: %s" % (card, attr))
+        self.assertEqual(nuisances(compact), nuisances(ref), msg=card)
+        # effects edited after parsing must show up the same way
+        for dc in ref, compact:
+            (lsyst,nofloat,pdf,pdfargs,errline) = dc.systs[0]
+            b = dc.bins[0]; p = dc.exp[b].keys()[0]
+            errline[b][p] = 1.5
+        self.assertEqual(nuisances(compact), nuisances(ref), msg=card)
+
+    def testCounting(self):
+        self.compare("counting/realistic-multi-channel.txt")
+
+    def testShapes(self):
+        self.compare("shapes/simple-shapes-TH1.txt")
+
+    def testRateParams(self):
+        self.compare("rate_params/signal_region.txt")
+
+    def testGroups(self):
+        self.compare("groups/myanalysis.dc.txt")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+// Compare a SimpleGaussianConstraintBlock with the product of the separate SimpleGaussianConstraint terms it replaces:
+// log of the value, normalized over the parameters or over the global observables (also in a normalization range),
+// the NLL of CachingSimNLL, and the dropping of constraints with ignoreConstraint.
+#include <cmath>
+#include <cstdio>
+#include <memory>
+#include <vector>
+#include <TString.h>
+#include <RooRealVar.h>
+#include <RooArgList.h>
+#include <RooArgSet.h>
+#include <RooConstVar.h>
+#include <RooProdPdf.h>
+#include <RooAddPdf.h>
+#include <RooUniform.h>
+#include <RooCategory.h>
+#include <RooSimultaneous.h>
+#include <RooDataSet.h>
+#include <RooRandom.h>
+#include <RooStats/RooStatsUtils.h>
+#include "HiggsAnalysis/CombinedLimit/interface/SimpleGaussianConstraint.h"
+#include "HiggsAnalysis/CombinedLimit/interface/SimpleGaussianConstraintBlock.h"
+#include "HiggsAnalysis/CombinedLimit/interface/CachingNLL.h"
+
+int failures = 0;
+
+void check(const char *what, double block, double product, double tolerance = 1e-9) {
+    bool ok = std::abs(block - product) <= tolerance * std::max(1.0, std::abs(product));
+    printf("%-50s block %+.12g product %+.12g  %s\n", what, block, product, ok ? "OK" : "FAIL");
+    if (!ok) failures++;
+}
+
+int main(int argc, char **argv) {
+    const int n = 50;
+    RooArgList xs, gobs, terms;
+    RooArgSet xset, gobsset;
+    std::vector<RooRealVar *> vars;
+    for (int i = 0; i < n; ++i) {
+        RooRealVar *x = new RooRealVar(Form("x%d", i), "", 0, -7, 7);
+        RooRealVar *g = new RooRealVar(Form("x%d_In", i), "", 0, -7, 7);
+        g->setConstant(true);
+        x->setRange("narrow", -2, 3);
+        g->setRange("narrow", -2, 3);
+        xs.add(*x); gobs.add(*g); xset.add(*x); gobsset.add(*g);
+        terms.add(*new SimpleGaussianConstraint(Form("x%d_Pdf", i), "", *x, *g, RooFit::RooConst(1.0)));
+        vars.push_back(x);
+    }
+    SimpleGaussianConstraintBlock block("block", "", xs, gobs);
+
+    for (int k = 0; k < 5; ++k) {
+        for (int i = 0; i < n; ++i) {
+            vars[i]->setVal(RooRandom::randomGenerator()->Gaus(0, 1.5));
+            static_cast<RooRealVar &>(*gobs.at(i)).setVal(k == 0 ? 0 : RooRandom::randomGenerator()->Gaus(0, 0.5));
+        }
+        double logUnnorm = 0, logNormX = 0, logNormGobs = 0, logNormNarrow = 0;
+        for (int i = 0; i < n; ++i) {
+            RooAbsPdf *term = static_cast<RooAbsPdf *>(terms.at(i));
+            RooArgSet xi(*xs.at(i)), gi(*gobs.at(i));
+            logUnnorm += std::log(term->getVal());
+            logNormX += term->getLogVal(&xi);
+            logNormGobs += term->getLogVal(&gi);
+            term->setNormRange("narrow");
+            logNormNarrow += term->getLogVal(&xi);
+            term->setNormRange(0);
+        }
+        check(Form("point %d: unnormalized log", k), block.getLogValFast(), logUnnorm);
+        check(Form("point %d: log normalized over the parameters", k), block.getLogVal(&xset), logNormX);
+        check(Form("point %d: log normalized over the global observables", k), block.getLogVal(&gobsset), logNormGobs);
+        block.setNormRange("narrow");
+        check(Form("point %d: same, in a normalization range", k), block.getLogVal(&xset), logNormNarrow);
+        block.setNormRange(0);
+    }
+
+    // the NLL of CachingSimNLL, for a channel with the constraints as separate terms or as a block
+    RooCategory cat("cat", ""); cat.defineType("ch");
+    RooRealVar obs("obs", "", 0.5, 0, 1), nexp("nexp", "", 10);
+    RooUniform flat("flat", "", RooArgSet(obs));
+    RooAddPdf channel("channel", "", RooArgList(flat), RooArgList(nexp));
+    RooArgList productTerms(channel); productTerms.add(terms);
+    RooProdPdf products("products", "", productTerms), blocks("blocks", "", RooArgList(channel, block));
+    RooSimultaneous simProducts("simProducts", "", cat), simBlocks("simBlocks", "", cat);
+    simProducts.addPdf(products, "ch"); simBlocks.addPdf(blocks, "ch");
+    RooDataSet data("data", "", RooArgSet(obs, cat));
+    for (int i = 0; i < 8; ++i) { obs.setVal((i + 0.5) / 8); data.add(RooArgSet(obs, cat)); }
+    cacheutils::CachingSimNLL nllProduct(&simProducts, &data), nllBlock(&simBlocks, &data);
+    for (int k = 0; k < 5; ++k) {
+        for (int i = 0; i < n; ++i) vars[i]->setVal(RooRandom::randomGenerator()->Gaus(0, 1.5));
+        check(Form("point %d: CachingSimNLL", k), nllBlock.getVal(), nllProduct.getVal());
+    }
+
+    // dropping a constraint (e.g. for a nuisance promoted to a parameter of interest)
+    block.ignoreConstraint(*vars[7]);
+    double logUnnorm = 0;
+    for (int i = 0; i < n; ++i) {
+        if (i != 7) logUnnorm += std::log(static_cast<RooAbsPdf *>(terms.at(i))->getVal());
+    }
+    check("ignoreConstraint: unnormalized log", block.getLogValFast(), logUnnorm);
+    printf("ignoreConstraint: attribute set on the parameter  %s\n", vars[7]->getAttribute("ignoreConstraint") ? "OK" : "FAIL");
+    if (!vars[7]->getAttribute("ignoreConstraint")) failures++;
+
+    printf("%s\n", failures ? "FAILED" : "ALL OK");
+    return failures ? 1 : 0;
+}
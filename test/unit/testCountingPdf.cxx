@@ -0,0 +1,103 @@
+// Compare a CMSCountingPdf of all the bins (in a CMSLogProdPdf with a constraint term) with the model
+// made of one RooPoisson pdf_bin<X> per bin: log of the pdf, NLL on the observed data, and the log of
+// a model with so many bins that its value underflows. Also check the integration codes.
+#include <cmath>
+#include <cstdio>
+#include <memory>
+#include <vector>
+#include <TString.h>
+#include <RooRealVar.h>
+#include <RooArgList.h>
+#include <RooArgSet.h>
+#include <RooConstVar.h>
+#include <RooFormulaVar.h>
+#include <RooProduct.h>
+#include <RooAddition.h>
+#include <RooPoisson.h>
+#include <RooGaussian.h>
+#include <RooProdPdf.h>
+#include <RooDataSet.h>
+#include <RooRandom.h>
+#include "HiggsAnalysis/CombinedLimit/interface/CMSCountingPdf.h"
+#include "HiggsAnalysis/CombinedLimit/interface/CMSLogProdPdf.h"
+
+int failures = 0;
+
+void check(const char *what, double counting, double perbin, double tolerance = 1e-9) {
+    bool ok = std::isfinite(counting) && std::abs(counting - perbin) <= tolerance * std::max(1.0, std::abs(perbin));
+    printf("%-50s counting %+.12g per-bin %+.12g  %s\n", what, counting, perbin, ok ? "OK" : "FAIL");
+    if (!ok) failures++;
+}
+
+/// a counting experiment with a signal scaled by r and a background scaled by a log-normal nuisance theta
+struct Model {
+    RooArgList obs, yields, pdfbins;
+    RooArgSet obsset;
+    std::vector<int> bins;
+    Model(int nbins, RooRealVar &r, RooAbsReal &kappa) {
+        for (int b = 0; b < nbins; ++b) {
+            double s = RooRandom::randomGenerator()->Uniform(1, 5), bkg = RooRandom::randomGenerator()->Uniform(5, 50);
+            RooRealVar *n = new RooRealVar(Form("n_obs_bin%d", b), "", RooRandom::randomGenerator()->Poisson(s + bkg), 0, 10000);
+            RooProduct *sig = new RooProduct(Form("n_exp_bin%d_proc_sig", b), "", RooArgList(r, RooFit::RooConst(s)));
+            RooProduct *bkgy = new RooProduct(Form("n_exp_bin%d_proc_bkg", b), "", RooArgList(kappa, RooFit::RooConst(bkg)));
+            RooAddition *exp = new RooAddition(Form("n_exp_bin%d", b), "", RooArgList(*sig, *bkgy));
+            pdfbins.add(*new RooPoisson(Form("pdf_bin%d", b), "", *n, *exp, true));
+            obs.add(*n); obsset.add(*n);
+            yields.add(*sig); bins.push_back(b);
+            yields.add(*bkgy); bins.push_back(b);
+        }
+    }
+    double logPerBin() {
+        double ret = 0;
+        for (int b = 0, n = pdfbins.getSize(); b < n; ++b) ret += static_cast<RooAbsPdf *>(pdfbins.at(b))->getLogVal(&obsset);
+        return ret;
+    }
+};
+
+int main(int argc, char **argv) {
+    RooRealVar r("r", "", 1, 0, 10), theta("theta", "", 0, -5, 5), thetaIn("theta_In", "", 0, -5, 5);
+    thetaIn.setConstant(true);
+    RooFormulaVar kappa("kappa", "", "exp(0.1*@0)", RooArgList(theta));
+    RooGaussian constraint("theta_Pdf", "", theta, thetaIn, RooFit::RooConst(1.0));
+
+    Model small(60, r, kappa);
+    CMSCountingPdf counting("modelObs_s", "", small.obs, small.yields, small.bins);
+    CMSLogProdPdf model("model_s", "", RooArgList(counting, constraint));
+    RooArgList perBinFactors(small.pdfbins); perBinFactors.add(constraint);
+    RooProdPdf perBinModel("perbin_model_s", "", perBinFactors);
+    RooDataSet data("data_obs", "", small.obsset);
+    data.add(small.obsset);
+    std::auto_ptr<RooAbsReal> nll(model.createNLL(data)), perBinNll(perBinModel.createNLL(data));
+    for (int k = 0; k < 5; ++k) {
+        r.setVal(0.5 * k);
+        theta.setVal(RooRandom::randomGenerator()->Gaus(0, 1));
+        check(Form("point %d: log of the counting pdf", k), counting.getLogVal(&small.obsset), small.logPerBin());
+        check(Form("point %d: log of the model", k), model.getLogVal(&small.obsset), perBinModel.getLogVal(&small.obsset));
+        check(Form("point %d: NLL", k), nll->getVal(), perBinNll->getVal());
+    }
+
+    // so many bins that the value of the product underflows, but not its log
+    Model large(5000, r, kappa);
+    CMSCountingPdf countingLarge("modelObs_s_large", "", large.obs, large.yields, large.bins);
+    CMSLogProdPdf modelLarge("model_s_large", "", RooArgList(countingLarge, constraint));
+    for (int k = 0; k < 3; ++k) {
+        r.setVal(1.0 + k);
+        theta.setVal(0.5 * k - 0.5);
+        RooArgSet none;
+        check(Form("point %d: log of the model with %d bins", k, large.obs.getSize()), modelLarge.getLogVal(&large.obsset),
+              large.logPerBin() + std::log(constraint.getVal(&none)));
+    }
+
+    // the pdf is normalized analytically only over all its observables at once
+    RooArgSet analVars, all(small.obsset), some(*small.obs.at(0), *small.obs.at(1));
+    int codeAll = counting.getAnalyticalIntegral(all, analVars);
+    bool ok = codeAll == 1 && analVars.getSize() == small.obs.getSize();
+    analVars.removeAll();
+    int codeSome = counting.getAnalyticalIntegral(some, analVars);
+    ok = ok && codeSome == 0 && analVars.getSize() == 0;
+    printf("integration codes: all observables %d, some %d  %s\n", codeAll, codeSome, ok ? "OK" : "FAIL");
+    if (!ok) failures++;
+
+    printf("%s\n", failures ? "FAILED" : "ALL OK");
+    return failures ? 1 : 0;
+}
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# Round trip of the on-disk cache of the parsed datacards (--X-datacard-cache):
+# a card read back from the cache must give the same nuisances as an uncached parse.
+# Run as: python test/unit/testDatacardCache.py
+import os, shutil, tempfile, unittest
+from datacardTestUtils import parse, nuisances
+
+card = """imax 2
+jmax 2
+kmax *
+------------
+bin          a     b
+observation  10    20
+------------
+bin          a     a     a     b     b     b
+process      sig   bkg   other sig   bkg   other
+process      0     1     2     0     1     2
+rate         1.5   8.0   0     2.5   15.0  3.0
+------------
+lumi    lnN    1.025  1.025  -      1.025  1.025  -
+jes     lnN    0.95/1.07  -  -      1.10/0.92  -  1.03
+bkgNorm gmN 12 -      0.66   0.5    -      -      -
+shift   param  0.0    1.0
+scale   lnU    -      -      -      -      2.0    -
+"""
+
+class TestDatacardCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.card = os.path.join(self.dir, "card.txt")
+        open(self.card, "w").write(card)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def parse(self, args):
+        return parse(self.card, args)
+
+    def roundTrip(self, args):
+        cacheArgs = args + [ "--X-datacard-cache", os.path.join(self.dir, "cache") ]
+        ref = self.parse(args)
+        miss = self.parse(cacheArgs)
+        self.assertEqual(len([ f for f in os.listdir(os.path.join(self.dir, "cache")) if f.endswith(".npz") ]), 1)
+        hit = self.parse(cacheArgs)
+        for dc in miss, hit:
+            self.assertEqual(nuisances(dc), nuisances(ref))
+            self.assertEqual(dc.exp, ref.exp)
+        # the gmN line sets the null rate of 'other' in bin a to epsilon
+        self.assertEqual(hit.exp["a"]["other"], 1e-6)
+
+    def testSparse(self):
+        self.roundTrip([])
+
+    def testCompact(self):
+        self.roundTrip([ "--X-compact-datacard" ])
+
+if __name__ == "__main__":
+    unittest.main()
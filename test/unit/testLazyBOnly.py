@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# With --X-lazy-b-only text2workspace saves only the set 'signalYields', and combine builds the background-only
+# model setting those yields to zero with a RooCustomizer: that model must be the same as the model_b that
+# text2workspace saves by default.
+# Needs ROOT and the combine libraries; run as: python test/unit/testLazyBOnly.py
+import os, shutil, subprocess, tempfile, unittest
+import ROOT
+
+tutorials = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "tutorials")
+
+def text2workspace(card, out, *args):
+    subprocess.check_call([ "text2workspace.py", card, "-o", out ] + list(args), cwd=os.path.dirname(card))
+
+def backgroundOnly(ws):
+    """the background-only model made as in Combine::run from ModelConfig and the set signalYields"""
+    mc = ws.genobj("ModelConfig")
+    customizer = ROOT.RooCustomizer(mc.GetPdf(), "_model_bonly_")
+    ws.factory("_zero_[0]")
+    yields = ROOT.RooArgList(ws.set("signalYields"))
+    for i in xrange(yields.getSize()):
+        customizer.replaceArg(yields.at(i), ws.var("_zero_"))
+    return customizer.build()
+
+class TestLazyBOnly(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.files = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def workspace(self, fname):
+        self.files.append(ROOT.TFile.Open(os.path.join(self.dir, fname)))
+        return self.files[-1].Get("w")
+
+    def compare(self, inputs, card, params):
+        for f in inputs: shutil.copy(os.path.join(tutorials, f), self.dir)
+        card = os.path.join(self.dir, card)
+        text2workspace(card, "eager.root")
+        text2workspace(card, "lazy.root", "--X-lazy-b-only")
+        eager, lazy = self.workspace("eager.root"), self.workspace("lazy.root")
+        self.assertTrue(eager.pdf("model_b") and eager.genobj("ModelConfig_bonly"))
+        self.assertFalse(lazy.pdf("model_b") or lazy.genobj("ModelConfig_bonly"))
+        self.assertTrue(lazy.set("signalYields").getSize() > 0)
+        model_b = backgroundOnly(lazy)
+        obs = lazy.set("observables")
+        for k in xrange(5):
+            for ws in eager, lazy:
+                for (i,name) in enumerate(params):
+                    ws.var(name).setVal(0.5*((i+k) % 5) - 1.0)
+                ws.var("r").setVal(1.0 + k)
+            self.assertAlmostEqual(model_b.getVal(obs), eager.pdf("model_b").getVal(eager.set("observables")), places=12)
+            self.assertAlmostEqual(model_b.expectedEvents(obs), eager.pdf("model_b").expectedEvents(eager.set("observables")), places=9)
+
+    def testCounting(self):
+        self.compare([ "counting/realistic-multi-channel.txt" ], "realistic-multi-channel.txt",
+                     [ "lumi", "tauid", "ZtoLL", "effic", "QCDel", "QCDmu", "other" ])
+
+    def testShapes(self):
+        self.compare([ "shapes/simple-shapes-TH1.txt", "shapes/simple-shapes-TH1_input.root" ], "simple-shapes-TH1.txt",
+                     [ "lumi", "bgnorm", "alpha", "sigma" ])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# With --X-lazy-channels each channel is written to its own directory of the output file, and the workspace has a
+# CMSLazyChannelPdf standing for it: the model and the NLL must be the same as for the workspace built without it,
+# the channels masked when the NLL is made must not be read, and a channel already read must follow the
+# redirection of the servers of its stand-in.
+# Needs ROOT and the combine libraries; run as: python test/unit/testLazyChannels.py
+import os, shutil, subprocess, tempfile, unittest
+import ROOT
+
+tutorials = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "tutorials", "shapes")
+
+def text2workspace(card, out, *args):
+    subprocess.check_call([ "text2workspace.py", card, "-o", out ] + list(args), cwd=os.path.dirname(card))
+
+def lazyPdfs(ws):
+    pdfs = ws.allPdfs()
+    return [ pdfs.at(i) for i in xrange(pdfs.getSize()) if pdfs.at(i).ClassName() == "CMSLazyChannelPdf" ]
+
+class TestLazyChannels(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        for f in "simple-shapes-TH1.txt", "simple-shapes-TH1_input.root":
+            shutil.copy(os.path.join(tutorials, f), self.dir)
+        card = os.path.join(self.dir, "combined.txt")
+        open(card, "w").write(subprocess.check_output([ "combineCards.py", "ch1=simple-shapes-TH1.txt", "ch2=simple-shapes-TH1.txt" ], cwd=self.dir))
+        text2workspace(card, "eager.root", "--channel-masks")
+        text2workspace(card, "lazy.root", "--channel-masks", "--X-lazy-channels")
+        self.files = [ ROOT.TFile.Open(os.path.join(self.dir, f)) for f in "eager.root", "lazy.root" ]
+        self.eager, self.lazy = [ f.Get("w") for f in self.files ]
+        for pdf in lazyPdfs(self.lazy): pdf.setSource(self.files[1]) # as combine does
+        self.params = [ "r", "lumi", "bgnorm", "alpha", "sigma" ]
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def setPoint(self, k):
+        for ws in self.eager, self.lazy:
+            for (i,name) in enumerate(self.params):
+                ws.var(name).setVal(0.5*((i+k) % 5) - 1.0 if name != "r" else 1.0 + 0.5*k)
+
+    def nll(self, ws):
+        return ws.pdf("model_s").createNLL(ws.data("data_obs"), ROOT.RooFit.Constrain(ws.set("nuisances")))
+
+    def testModel(self):
+        self.assertEqual(len(lazyPdfs(self.lazy)), 2)
+        for k in xrange(5):
+            self.setPoint(k)
+            for name in "pdf_binch1", "pdf_binch2":
+                self.assertAlmostEqual(self.lazy.pdf(name).getVal(self.lazy.set("observables")), self.eager.pdf(name).getVal(self.eager.set("observables")), places=12)
+
+    def testNLL(self):
+        for masked in True, False: # ch2 is read only when it is unmasked
+            for ws in self.eager, self.lazy: ws.var("mask_ch2").setVal(1 if masked else 0)
+            nlls = self.nll(self.eager), self.nll(self.lazy)
+            self.assertEqual([ pdf.isLoaded() for pdf in lazyPdfs(self.lazy) ], [ True, not masked ])
+            for k in xrange(5):
+                self.setPoint(k)
+                self.assertAlmostEqual(nlls[1].getVal(), nlls[0].getVal(), places=8)
+
+    def testRedirectServers(self):
+        pdf = self.lazy.pdf("pdf_binch1")
+        self.setPoint(0)
+        pdf.getVal(self.lazy.set("observables")) # read the channel
+        self.assertTrue(pdf.isLoaded())
+        lumi = ROOT.RooRealVar("lumi", "", 0, -4, 4)
+        pdf.recursiveRedirectServers(ROOT.RooArgSet(lumi))
+        for x in -1.5, 0.3, 2.0:
+            lumi.setVal(x); self.eager.var("lumi").setVal(x)
+            self.assertAlmostEqual(pdf.getVal(self.lazy.set("observables")), self.eager.pdf("pdf_binch1").getVal(self.eager.set("observables")), places=12)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# The workspaces built for several masses in one run (--X-masses), sharing the templates that don't depend on $MASS,
+# must be the same as the ones built for each mass on its own with -m.
+# Needs ROOT and the combine libraries; run as: python test/unit/testMasses.py
+import os, shutil, subprocess, tempfile, unittest
+import ROOT
+
+card = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "tutorials", "htt", "125", "htt_tt.txt")
+
+def text2workspace(out, *args):
+    subprocess.check_call([ "text2workspace.py", card, "-o", out ] + list(args), cwd=os.path.dirname(card))
+
+def components(ws):
+    return sorted([ a.GetName() for a in [ ws.components().at(i) for i in xrange(ws.components().getSize()) ] ])
+
+class TestMasses(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.files = []
+
+    def tearDown(self):
+        for f in self.files: f.Close()
+        shutil.rmtree(self.dir)
+
+    def workspace(self, fname):
+        self.files.append(ROOT.TFile.Open(os.path.join(self.dir, fname)))
+        return self.files[-1].Get("w")
+
+    def testMasses(self):
+        masses = [ "120", "125", "130" ]
+        text2workspace(os.path.join(self.dir, "scan.root"), "--X-masses", ",".join(masses))
+        for mass in masses:
+            text2workspace(os.path.join(self.dir, "single.mH%s.root" % mass), "-m", mass)
+            scan, single = self.workspace("scan.mH%s.root" % mass), self.workspace("single.mH%s.root" % mass)
+            self.assertEqual(components(scan), components(single))
+            nuisances = ROOT.RooArgList(single.set("nuisances"))
+            for k in xrange(4):
+                for ws in scan, single:
+                    ws.var("r").setVal(0.5 + k)
+                    for i in xrange(nuisances.getSize()):
+                        ws.var(nuisances.at(i).GetName()).setVal(0.25 * ((i + k) % 7) - 0.75)
+                obs = [ ws.set("observables") for ws in scan, single ]
+                self.assertAlmostEqual(scan.pdf("model_s").getVal(obs[0]), single.pdf("model_s").getVal(obs[1]), places=12, msg="mass %s" % mass)
+                self.assertAlmostEqual(scan.pdf("model_s").expectedEvents(obs[0]), single.pdf("model_s").expectedEvents(obs[1]), places=9, msg="mass %s" % mass)
+
+if __name__ == "__main__":
+    unittest.main()
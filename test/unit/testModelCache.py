@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# A workspace built from the channel models of the model cache (--X-model-cache) must be the same as one built
+# without the cache: same objects, and same value of the model for different values of the parameters.
+# Needs ROOT and the combine libraries; run as: python test/unit/testModelCache.py
+import os, shutil, subprocess, tempfile, unittest
+import ROOT
+
+tutorials = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "tutorials", "shapes")
+
+def text2workspace(card, out, *args):
+    subprocess.check_call([ "text2workspace.py", card, "-o", out ] + list(args), cwd=os.path.dirname(card))
+
+def components(ws):
+    return sorted([ a.GetName() for a in [ ws.components().at(i) for i in xrange(ws.components().getSize()) ] ])
+
+class TestModelCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        for f in "simple-shapes-TH1.txt", "simple-shapes-TH1_input.root":
+            shutil.copy(os.path.join(tutorials, f), self.dir)
+        self.card = os.path.join(self.dir, "simple-shapes-TH1.txt")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def workspace(self, fname):
+        self.files.append(ROOT.TFile.Open(os.path.join(self.dir, fname)))
+        return self.files[-1].Get("w")
+
+    def testRebuild(self):
+        cache = os.path.join(self.dir, "cache")
+        text2workspace(self.card, "ref.root")
+        text2workspace(self.card, "miss.root", "--X-model-cache", cache)
+        self.assertTrue(any([ f.endswith(".root") for f in os.listdir(cache) ]))
+        self.assertTrue(os.path.exists(os.path.join(cache, "files.json")))
+        text2workspace(self.card, "hit.root", "--X-model-cache", cache)
+        self.files = []
+        ref, hit = self.workspace("ref.root"), self.workspace("hit.root")
+        self.assertEqual(components(hit), components(ref))
+        for point in [ {}, { "r" : 2.0 }, { "alpha" : 1.5, "sigma" : -0.7 }, { "lumi" : 0.8, "bgnorm" : -1.2, "r" : 0.5 } ]:
+            for ws in ref, hit:
+                for name in "r", "alpha", "sigma", "lumi", "bgnorm":
+                    ws.var(name).setVal(point.get(name, 1.0 if name == "r" else 0.0))
+            for pdf in "model_s", "pdf_binbin1":
+                self.assertAlmostEqual(hit.pdf(pdf).getVal(hit.set("observables")), ref.pdf(pdf).getVal(ref.set("observables")), places=12)
+                self.assertAlmostEqual(hit.pdf(pdf).expectedEvents(hit.set("observables")), ref.pdf(pdf).expectedEvents(ref.set("observables")), places=9)
+
+if __name__ == "__main__":
+    unittest.main()
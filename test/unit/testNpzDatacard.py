@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# Round trip of the binary datacard format (.npz): a text datacard written as .npz, by Datacard.writeNpz or by
+# convertDatacard.py, and read back must be the same datacard; converted back to text it must give the same card
+# as the text one written directly (which, like combineCards.py, sorts the nuisances and spells out the shape lines).
+# Run as: python test/unit/testNpzDatacard.py
+import os, shutil, subprocess, sys, tempfile, unittest
+from datacardTestUtils import tutorials, script, parse, nuisances
+
+def convertDatacard(input, output):
+    subprocess.check_call([ sys.executable, script("convertDatacard.py"), input, output ])
+
+class TestNpzDatacard(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def assertSameCard(self, dc, ref, msg):
+        for attr in "bins", "obs", "processes", "signals", "isSignal", "keyline", "exp", "shapeMap", "hasShapes", "flatParamNuisances", "rateParams", "groups", "binParFlags":
+            self.assertEqual(getattr(dc, attr), getattr(ref, attr), msg="%s: %s" % (msg, attr))
+        self.assertEqual(nuisances(dc), nuisances(ref), msg=msg)
+
+    def roundTrip(self, card):
+        card = os.path.join(tutorials, card)
+        ref = parse(card)
+        npz = os.path.join(self.dir, "card.npz")
+        ref.writeNpz(npz)
+        self.assertSameCard(parse(npz), ref, "%s, writeNpz" % card)
+        self.assertSameCard(parse(npz, [ "--X-compact-datacard" ]), ref, "%s, writeNpz, compact" % card)
+        # the same with the conversion script, in both directions
+        converted, text, direct = [ os.path.join(self.dir, f) for f in "converted.npz", "converted.txt", "direct.txt" ]
+        convertDatacard(card, converted)
+        self.assertSameCard(parse(converted), ref, "%s, text -> npz" % card)
+        convertDatacard(converted, text)
+        convertDatacard(card, direct)
+        # all but the first line, with the name of the input
+        self.assertEqual(open(text).readlines()[1:], open(direct).readlines()[1:], msg="%s, npz -> text" % card)
+
+    def testCounting(self):
+        self.roundTrip("counting/realistic-multi-channel.txt")
+
+    def testShapes(self):
+        self.roundTrip("shapes/simple-shapes-TH1.txt")
+
+    def testRateParams(self):
+        self.roundTrip("rate_params/signal_region.txt")
+
+    def testGroups(self):
+        self.roundTrip("groups/myanalysis.dc.txt")
+
+if __name__ == "__main__":
+    unittest.main()
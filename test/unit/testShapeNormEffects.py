@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# The normalization effects of the template shape systematics are in the ProcessNormalization n_exp_bin<X>_proc_<Y>:
+# the yields must be the same as with the old construction, the yield without them times one AsymPow per effect,
+# with the kappas from the integrals of the templates rounded to six decimals, over the range of the nuisances.
+# Needs ROOT and the combine libraries; run as: python test/unit/testShapeNormEffects.py
+import os, shutil, subprocess, tempfile, unittest
+import ROOT
+
+tutorials = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "tutorials", "shapes")
+
+def text2workspace(card, out, *args):
+    subprocess.check_call([ "text2workspace.py", card, "-o", out ] + list(args), cwd=os.path.dirname(card))
+
+class TestShapeNormEffects(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        for f in "simple-shapes-TH1.txt", "simple-shapes-TH1_input.root":
+            shutil.copy(os.path.join(tutorials, f), self.dir)
+        text2workspace(os.path.join(self.dir, "simple-shapes-TH1.txt"), "ws.root")
+        self.file = ROOT.TFile.Open(os.path.join(self.dir, "ws.root"))
+        self.ws = self.file.Get("w")
+        self.templates = ROOT.TFile.Open(os.path.join(self.dir, "simple-shapes-TH1_input.root"))
+        self.nuisances = [ "lumi", "bgnorm", "alpha", "sigma" ]
+        self.kappas = [] # keep the constants of the AsymPow terms alive
+
+    def tearDown(self):
+        self.file.Close(); self.templates.Close()
+        shutil.rmtree(self.dir)
+
+    def asymPow(self, process, syst, scale):
+        """the AsymPow that text2workspace used to make for this shape systematic"""
+        nominal = self.templates.Get(process).Integral()
+        kappas = [ float('%f' % pow(self.templates.Get("%s_%s%s" % (process,syst,shift)).Integral()/nominal, scale)) for shift in "Down","Up" ]
+        self.assertFalse(abs(kappas[0]-1) < 1e-3 and abs(kappas[1]-1) < 1e-3)
+        self.kappas += [ ROOT.RooConstVar('%f' % k, "", k) for k in kappas ]
+        return ROOT.AsymPow("systeff_bin1_%s_%s" % (process,syst), "", self.kappas[-2], self.kappas[-1], self.ws.var(syst))
+
+    def setPoint(self, values):
+        for name in self.nuisances: self.ws.var(name).setVal(values.get(name, 0.0))
+
+    def compare(self, process, syst, scale, others):
+        norm = self.ws.function("n_exp_binbin1_proc_%s" % process)
+        effect = self.asymPow(process, syst, scale)
+        var = self.ws.var(syst)
+        for i in xrange(81):
+            x = var.getMin() + i * (var.getMax() - var.getMin()) / 80.
+            point = dict(others); point[syst] = x
+            self.setPoint(others)
+            base = norm.getVal() # the yield without the effect of syst
+            self.setPoint(point)
+            self.assertAlmostEqual(norm.getVal() / (base * effect.getVal()), 1.0, places=12, msg="%s %s = %g" % (process, syst, x))
+
+    def testBackground(self):
+        self.compare("background", "alpha", 1.0, {})
+        self.compare("background", "alpha", 1.0, { "bgnorm" : 1.3, "lumi" : -0.7 })
+
+    def testSignal(self):
+        self.compare("signal", "sigma", 0.5, {})
+        self.compare("signal", "sigma", 0.5, { "lumi" : 2.1 })
+
+if __name__ == "__main__":
+    unittest.main()